@@ -0,0 +1,86 @@
+"""Compare loading and scoring the pickled pipeline against the compact export.
+
+Usage: python -m benchmarks.compact_model --train-rows 8000 --batch-sizes 1 100 10000
+"""
+
+import argparse
+import pickle
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from genre_classifier.compact_model import export_compact_model, load_compact_model
+from genre_classifier.flows.train.flow import FEATURE_COLS, make_model_pipeline
+
+
+def make_features(n: int, rng: np.random.Generator) -> pd.DataFrame:
+    df = pd.DataFrame(
+        {
+            "duration": rng.normal(240, 60, n),
+            "key": rng.integers(0, 12, n),
+            "loudness": rng.normal(-10, 4, n),
+            "mode": rng.integers(0, 2, n),
+            "tempo": rng.normal(120, 25, n),
+            "year": rng.integers(1960, 2011, n).astype(float),
+        }
+    )
+    df.loc[rng.random(n) < 0.5, "year"] = np.nan
+    return df[FEATURE_COLS]
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(train_rows: int, n_genres: int, batch_sizes: list[int], repeat: int):
+    rng = np.random.default_rng(42)
+    X_train = make_features(train_rows, rng)
+    y_train = (rng.random((train_rows, n_genres)) < 0.1).astype(int)
+    pipeline = make_model_pipeline().fit(X_train, y_train)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pickle_path = Path(tmpdir) / "model.pkl"
+        with open(pickle_path, "wb") as f:
+            pickle.dump(pipeline, f)
+        compact_path = export_compact_model(pipeline, Path(tmpdir) / "model.gcm")
+
+        def load_pickle():
+            with open(pickle_path, "rb") as f:
+                return pickle.load(f)
+
+        print(f"pickle size:  {pickle_path.stat().st_size / 1e6:8.1f} MB")
+        print(f"compact size: {compact_path.stat().st_size / 1e6:8.1f} MB")
+        print(f"pickle load:  {best_of(load_pickle, repeat) * 1e3:8.1f} ms")
+        print(
+            "compact load: "
+            f"{best_of(lambda: load_compact_model(compact_path), repeat) * 1e3:8.1f} ms"
+        )
+
+        compact_model = load_compact_model(compact_path)
+        for batch_size in batch_sizes:
+            batch = make_features(batch_size, rng)
+            pickle_time = best_of(lambda: pipeline.predict(batch), repeat)
+            compact_time = best_of(lambda: compact_model.predict(batch), repeat)
+            print(
+                f"predict batch={batch_size:>6}: "
+                f"pickle {pickle_time * 1e3:8.1f} ms, "
+                f"compact {compact_time * 1e3:8.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--train-rows", type=int, default=8000)
+    parser.add_argument("--n-genres", type=int, default=50)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 100, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    main(args.train_rows, args.n_genres, args.batch_sizes, args.repeat)
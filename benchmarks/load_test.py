@@ -0,0 +1,100 @@
+"""Load test for the online prediction server.
+
+Against a running server:
+    python -m benchmarks.load_test --url http://127.0.0.1:8080
+Or start an in-process server with a model trained on synthetic data:
+    python -m benchmarks.load_test --synthetic
+"""
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib import request
+
+import numpy as np
+from sklearn.preprocessing import MultiLabelBinarizer
+
+from benchmarks.compact_model import make_features
+from genre_classifier.flows.train.flow import make_model_pipeline
+from genre_classifier.serving import (
+    InferenceServer,
+    MicroBatcher,
+    make_handler,
+    make_predict_fn,
+)
+
+
+def start_synthetic_server(max_batch_size: int, max_wait_ms: float) -> str:
+    rng = np.random.default_rng(42)
+    genres = [f"genre {i}" for i in range(20)]
+    X_train = make_features(2000, rng)
+    labels = [list(rng.choice(genres, size=2, replace=False)) for _ in range(2000)]
+    mlb = MultiLabelBinarizer(classes=genres)
+    pipeline = make_model_pipeline().fit(X_train, mlb.fit_transform(labels))
+
+    batcher = MicroBatcher(
+        make_predict_fn(pipeline, mlb),
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+    )
+    server = InferenceServer(("127.0.0.1", 0), make_handler(batcher))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def make_payload(songs_per_request: int, rng: np.random.Generator) -> bytes:
+    df = make_features(songs_per_request, rng)
+    df.insert(0, "song_id", [f"TR{i:016d}" for i in range(songs_per_request)])
+    songs = json.loads(df.to_json(orient="records"))
+    return json.dumps({"songs": songs}).encode()
+
+
+def send_request(url: str, payload: bytes) -> float:
+    start = time.perf_counter()
+    req = request.Request(
+        f"{url}/predict", data=payload, headers={"Content-Type": "application/json"}
+    )
+    with request.urlopen(req) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def main(url: str, requests: int, concurrency: int, songs_per_request: int):
+    rng = np.random.default_rng(0)
+    payloads = [make_payload(songs_per_request, rng) for _ in range(32)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = np.array(
+            list(
+                executor.map(
+                    lambda i: send_request(url, payloads[i % len(payloads)]),
+                    range(requests),
+                )
+            )
+        )
+    elapsed = time.perf_counter() - start
+
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1e3
+    print(f"client: {requests / elapsed:.1f} req/s, p50 {p50:.1f} ms, p99 {p99:.1f} ms")
+    with request.urlopen(f"{url}/metrics") as response:
+        print(f"server: {json.dumps(json.loads(response.read()), indent=2)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--synthetic", action="store_true")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--songs-per-request", type=int, default=1)
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    url = args.url
+    if args.synthetic:
+        url = start_synthetic_server(args.max_batch_size, args.max_wait_ms)
+    main(url, args.requests, args.concurrency, args.songs_per_request)
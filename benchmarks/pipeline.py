@@ -0,0 +1,225 @@
+"""End-to-end timings of the pipeline stages on synthetic data and a local S3 stand-in.
+
+For every scale, synthetic MSD songs are uploaded to an in-process S3 mock (moto), and
+`preprocess_flow`, `split_data_flow`, `train`, prediction of the daily releases and
+`calculate_metrics` are timed against it. Results are written as JSON, one file per
+commit, so runs can be compared:
+
+    python -m benchmarks.pipeline --songs 200 1000 5000
+    python -m benchmarks.pipeline --compare benchmarks/results/pipeline-<a>.json \
+        benchmarks/results/pipeline-<b>.json
+
+Requires moto, which is in the dev dependencies.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import boto3
+import mlflow
+from prefect import flow
+from prefect.testing.utilities import prefect_test_harness
+
+from benchmarks.synthetic_msd import write_genres, write_songs
+from genre_classifier.blocks.create_aws_credentials import create_aws_creds_block
+from genre_classifier.blocks.create_s3_buckets import create_s3_buckets
+from genre_classifier.flows.model_monitoring.flow import calculate_metrics
+from genre_classifier.flows.predict.flow import (
+    predict,
+    read_releases,
+    upload_predictions,
+)
+from genre_classifier.flows.preprocess.flow import preprocess_flow
+from genre_classifier.flows.split_data.flow import split_data_flow
+from genre_classifier.flows.train.flow import (
+    filter_top_genres,
+    fix_outliers,
+    get_top_genres,
+    train,
+)
+from genre_classifier.utils import read_parquet_data, upload_dir_to_s3
+from genre_classifier.watermark import RELEASES_FILE, list_partition_dates
+
+BUCKET_NAMES = ["million-songs-dataset", "evidently-static-dashboard-tvn"]
+BUCKET_BLOCK_NAME = "million-songs-dataset-s3"
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+@contextmanager
+def local_s3() -> Iterator[None]:
+    """Serve the buckets of the S3 blocks from an in-process moto mock"""
+    from moto import mock_aws
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws(), prefect_test_harness():
+        client = boto3.client("s3")
+        for bucket_name in BUCKET_NAMES:
+            client.create_bucket(Bucket=bucket_name)
+        create_aws_creds_block()
+        create_s3_buckets()
+        yield
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Timer:
+    def __init__(self, songs: int):
+        self.songs = songs
+        self.results = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        print(f"{self.songs:>8} songs  {name:<18} {seconds:8.3f} s")
+        self.results.append({"songs": self.songs, "stage": name, "seconds": seconds})
+
+
+def run_scale(songs: int, workdir: Path, timer: Timer) -> None:
+    prefix = f"bench-{songs}"
+    songs_dir = workdir / prefix / "songs"
+    write_songs(songs_dir, songs)
+    genres_url = write_genres(workdir / prefix / "genres.txt").absolute().as_uri()
+    upload_dir_to_s3(songs_dir, f"{prefix}/songs", BUCKET_BLOCK_NAME)
+
+    with timer.stage("preprocess_flow"):
+        preprocessed_path = asyncio.run(
+            preprocess_flow(
+                bucket_folder=f"{prefix}/songs",
+                target_path=f"{prefix}/subset.parquet",
+                s3_bucket_block_name=BUCKET_BLOCK_NAME,
+                genres_url=genres_url,
+            )
+        )
+
+    with timer.stage("split_data_flow"):
+        split_path = split_data_flow(
+            bucket_block_name=BUCKET_BLOCK_NAME,
+            source_data_path=preprocessed_path,
+            target_data_path=f"{prefix}/split",
+        )
+
+    @flow
+    def tasks_flow():
+        # Tasks are timed through .fn, without task run orchestration
+        train_data = read_parquet_data(f"{split_path}/train.parquet", BUCKET_BLOCK_NAME)
+        with timer.stage("train"):
+            top_genres = get_top_genres.fn(train_data, k=50)
+            train_data = filter_top_genres.fn(train_data, top_genres)
+            train_data = fix_outliers.fn(train_data)
+            pipeline, mlb = train.fn(train_data, top_genres)
+
+        daily_path = f"{split_path}/daily"
+        dates = list_partition_dates(daily_path, RELEASES_FILE, BUCKET_BLOCK_NAME)
+        with timer.stage("predict"):
+            for date in dates:
+                releases = read_releases.fn(BUCKET_BLOCK_NAME, daily_path, date)
+                upload_predictions.fn(
+                    predict.fn(releases, pipeline, mlb),
+                    f"{split_path}/predictions/{date}/predictions.parquet",
+                    BUCKET_BLOCK_NAME,
+                )
+
+        reference = read_parquet_data(f"{split_path}/train.parquet", BUCKET_BLOCK_NAME)
+        ground_truth = read_parquet_data(
+            f"{split_path}/test.parquet", BUCKET_BLOCK_NAME
+        )
+        with timer.stage("calculate_metrics"):
+            calculate_metrics.fn(
+                reference,
+                ground_truth,
+                BUCKET_BLOCK_NAME,
+                daily_data_path=daily_path,
+            )
+
+    mlflow.set_tracking_uri((workdir / "mlruns").absolute().as_uri())
+    mlflow.set_experiment(prefix)
+    with mlflow.start_run():
+        tasks_flow()
+
+
+def run(scales: list[int], output: Path | None) -> Path:
+    commit = get_commit()
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir, local_s3():
+        for songs in scales:
+            timer = Timer(songs)
+            run_scale(songs, Path(tmpdir), timer)
+            results += timer.results
+
+    output = output or RESULTS_DIR / f"pipeline-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(
+        json.dumps(
+            {
+                "commit": commit,
+                "created": datetime.datetime.now(datetime.UTC).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"Wrote {output}")
+    return output
+
+
+def compare(baseline_path: Path, candidate_path: Path) -> None:
+    baseline, candidate = (
+        json.loads(Path(path).read_text()) for path in (baseline_path, candidate_path)
+    )
+    baseline_seconds = {
+        (r["songs"], r["stage"]): r["seconds"] for r in baseline["results"]
+    }
+    print(
+        f"{'songs':>8}  {'stage':<18} {baseline['commit']:>10} {candidate['commit']:>10}"
+    )
+    for r in candidate["results"]:
+        before = baseline_seconds.get((r["songs"], r["stage"]))
+        if before is None:
+            continue
+        print(
+            f"{r['songs']:>8}  {r['stage']:<18} {before:9.3f}s {r['seconds']:9.3f}s"
+            f" {before / r['seconds']:6.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--songs", type=int, nargs="+", default=[200, 1000])
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument(
+        "--compare", type=Path, nargs=2, metavar=("BASELINE", "CANDIDATE")
+    )
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args.songs, args.output)
@@ -0,0 +1,66 @@
+"""Compare the per-row prediction post-processing with the vectorised version.
+
+Usage: python -m benchmarks.postprocess --rows 1000000 --genres 50 --top-k 3
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MultiLabelBinarizer
+
+from genre_classifier.postprocess_common import predictions_to_genres, scores_to_columns
+
+
+def loop_postprocess(
+    predictions: np.ndarray, mlb: MultiLabelBinarizer, index: pd.Index
+) -> pd.DataFrame:
+    predictions_plaintext = mlb.inverse_transform(predictions)
+    prediction_data = []
+    for song_id, pred_genres in zip(index, predictions_plaintext):
+        prediction_data.append({"song_id": song_id, "genres": list(pred_genres)})
+    return pd.DataFrame(prediction_data).set_index("song_id")
+
+
+def timed(name: str, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"{name:<28} {time.perf_counter() - start:8.3f} s")
+    return result
+
+
+def main(rows: int, genres: int, top_k: int):
+    rng = np.random.default_rng(42)
+    classes = [f"genre {i}" for i in range(genres)]
+    mlb = MultiLabelBinarizer(classes=classes).fit([])
+    scores = rng.random((rows, genres), dtype=np.float32) ** 8
+    predictions = (scores > 0.5).astype(np.int64)
+    index = pd.Index([f"TR{i:016d}" for i in range(rows)], name="song_id")
+
+    loop_df = timed("per-row loop", lambda: loop_postprocess(predictions, mlb, index))
+    genres_col = timed(
+        "vectorised genres",
+        lambda: predictions_to_genres(predictions, mlb.classes_, index),
+    )
+    timed(
+        f"vectorised top-{top_k} scores",
+        lambda: scores_to_columns(scores, mlb.classes_, index, top_k),
+    )
+    timed(
+        "vectorised all scores", lambda: scores_to_columns(scores, mlb.classes_, index)
+    )
+
+    sample = rng.integers(0, rows, 1000)
+    assert all(
+        list(loop_df["genres"].iloc[i]) == list(genres_col.iloc[i]) for i in sample
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--genres", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+    main(args.rows, args.genres, args.top_k)
@@ -0,0 +1,101 @@
+"""Synthetic songs in the HDF5 layout of the Million Song Dataset.
+
+Only the fields that preprocessing reads are written: the `analysis/songs` and
+`musicbrainz/songs` tables and the `metadata/artist_terms` array. Values follow rough
+MSD distributions, including the zero years and tempo outliers of the real data.
+
+Usage: python -m benchmarks.synthetic_msd --songs 1000 --target-dir data/synthetic
+"""
+
+import argparse
+import string
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+GENRES = [f"genre {i}" for i in range(60)]
+OTHER_TERMS = [f"term {i}" for i in range(40)]
+
+ANALYSIS_DTYPE = np.dtype(
+    [
+        ("danceability", "f8"),
+        ("duration", "f8"),
+        ("energy", "f8"),
+        ("key", "i4"),
+        ("loudness", "f8"),
+        ("mode", "i4"),
+        ("tempo", "f8"),
+    ]
+)
+MUSICBRAINZ_DTYPE = np.dtype([("year", "i4")])
+
+
+def song_id(i: int) -> str:
+    """Unique 18 character id whose 3rd to 5th letters, the directory levels of the
+    MSD, cycle through A-Z, so consecutive songs land in different directories"""
+    letters = string.ascii_uppercase
+    levels = "".join(letters[(i // 26**level) % 26] for level in range(3))
+    return f"TR{levels}{i:013d}"
+
+
+def write_song(path: Path, rng: np.random.Generator) -> None:
+    analysis = np.zeros(1, dtype=ANALYSIS_DTYPE)
+    analysis["duration"] = rng.gamma(8, 30)
+    analysis["key"] = rng.integers(0, 12)
+    analysis["loudness"] = rng.normal(-10, 4)
+    analysis["mode"] = rng.integers(0, 2)
+    # About 5% of the tempos are outliers, as in the real data
+    analysis["tempo"] = rng.choice(
+        [rng.normal(120, 25), 0.0, rng.uniform(200, 260)], p=[0.95, 0.025, 0.025]
+    )
+    musicbrainz = np.zeros(1, dtype=MUSICBRAINZ_DTYPE)
+    musicbrainz["year"] = 0 if rng.random() < 0.5 else rng.integers(1950, 2011)
+
+    genre_weights = 1 / np.arange(1, len(GENRES) + 1)
+    terms = list(
+        rng.choice(
+            GENRES,
+            size=rng.integers(0, 6),
+            replace=False,
+            p=genre_weights / genre_weights.sum(),
+        )
+    ) + list(rng.choice(OTHER_TERMS, size=rng.integers(0, 4), replace=False))
+    rng.shuffle(terms)
+
+    with h5py.File(path, "w") as f:
+        f.create_group("analysis").create_dataset("songs", data=analysis)
+        f.create_group("musicbrainz").create_dataset("songs", data=musicbrainz)
+        f.create_group("metadata").create_dataset(
+            "artist_terms", data=np.array([t.encode() for t in terms], dtype="S")
+        )
+
+
+def write_songs(target_dir: Path, n: int, seed: int = 42) -> list[Path]:
+    """Write `n` songs in the `<A>/<B>/<C>/<song_id>.h5` directory layout of the MSD"""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(n):
+        sid = song_id(i)
+        song_dir = Path(target_dir, sid[2], sid[3], sid[4])
+        song_dir.mkdir(parents=True, exist_ok=True)
+        path = song_dir / f"{sid}.h5"
+        write_song(path, rng)
+        paths.append(path)
+    return paths
+
+
+def write_genres(path: Path) -> Path:
+    """Genre list in the format of the `genres_url` of `preprocess_flow`"""
+    Path(path).write_text("\n".join(GENRES))
+    return Path(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--songs", type=int, default=1000)
+    parser.add_argument("--target-dir", type=Path, default=Path("data/synthetic"))
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    write_songs(args.target_dir, args.songs, args.seed)
+    write_genres(args.target_dir / "genres.txt")
@@ -3,9 +3,13 @@ from prefect import deploy
 from prefect.deployments import DeploymentImage
 from slugify import slugify
 
+from genre_classifier.flows.compact_predictions.flow import compact_predictions_flow
 from genre_classifier.flows.complete_training.flow import complete_training_flow
 from genre_classifier.flows.ingest_data.flow import ingest_flow
-from genre_classifier.flows.model_monitoring.flow import model_monitoring_flow
+from genre_classifier.flows.model_monitoring.flow import (
+    drift_report_flow,
+    model_monitoring_flow,
+)
 from genre_classifier.flows.predict.flow import predict_flow
 from genre_classifier.flows.preprocess.flow import preprocess_flow
 from genre_classifier.flows.split_data.flow import split_data_flow
@@ -26,11 +30,20 @@ if __name__ == "__main__":
             name=f"model-monitoring-{VERSION}",
             cron="0 6 * * *",
         ),
+        drift_report_flow.to_deployment(
+            # The full Evidently report is slow to render, refresh it once a week.
+            name=f"drift-report-{VERSION}",
+            cron="0 7 * * 1",
+        ),
         predict_flow.to_deployment(
             # Execute a prediction every 5 minutes, in a real use-case this would be executed at the end of every day
             name=f"genre-classifier-predict-{VERSION}",
             cron="0/5 * * * *",
         ),
+        compact_predictions_flow.to_deployment(
+            name=f"compact-predictions-{VERSION}",
+            cron="0 5 * * *",
+        ),
         work_pool_name="docker-work-pool",
         image=DeploymentImage(
             name="timovanniedek/genre-classifier-train",  # Change to your own repository on Docker Hub (must be public)
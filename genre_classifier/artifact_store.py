@@ -0,0 +1,104 @@
+"""Run-scoped handoff of tables between the stages of a pipeline run.
+
+While a store is active, `write_parquet_data` keeps the written table in memory and
+uploads it to S3 in the background, and `read_parquet_data` serves tables that were
+written during the run from memory. Stages that run in the same process, such as the
+subflows of `complete_training_flow`, then hand their outputs to the next stage without
+a download and Parquet decode on the critical path, while S3 still gets every output.
+Uploads to the same path run in the order of the writes, so S3 ends up with the last
+one. Closing the store waits for all uploads and raises the first upload error.
+"""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Iterator
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from prefect_aws import S3Bucket
+
+_active_store: "ArtifactStore | None" = None
+
+
+def _upload_table(
+    table: pa.Table,
+    data_path: str,
+    bucket_block_name: str,
+    previous: Future | None = None,
+) -> None:
+    if previous is not None:
+        # The previous upload of the same path was submitted, and so started, earlier;
+        # its error is raised by `flush`
+        wait([previous])
+    buffer = pa.BufferOutputStream()
+    pq.write_table(table, buffer)
+    bucket = S3Bucket.load(bucket_block_name)
+    bucket.write_path(data_path, buffer.getvalue().to_pybytes())
+
+
+class ArtifactStore:
+    def __init__(self, max_workers: int = 4):
+        self._tables: dict[tuple[str, str], pa.Table] = {}
+        self._uploads: list[Future] = []
+        self._last_uploads: dict[tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def put(
+        self,
+        table: pa.Table,
+        data_path: str,
+        bucket_block_name: str = "million-songs-dataset-s3",
+    ) -> None:
+        key = (bucket_block_name, str(data_path))
+        with self._lock:
+            self._tables[key] = table
+            upload = self._executor.submit(
+                _upload_table,
+                table,
+                str(data_path),
+                bucket_block_name,
+                self._last_uploads.get(key),
+            )
+            self._last_uploads[key] = upload
+            self._uploads.append(upload)
+
+    def get(
+        self, data_path: str, bucket_block_name: str = "million-songs-dataset-s3"
+    ) -> pa.Table | None:
+        with self._lock:
+            return self._tables.get((bucket_block_name, str(data_path)))
+
+    def flush(self) -> None:
+        """Wait until every table written so far is uploaded"""
+        with self._lock:
+            uploads = list(self._uploads)
+        for upload in uploads:
+            upload.result()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
+            self._tables.clear()
+
+
+def get_active_store() -> ArtifactStore | None:
+    return _active_store
+
+
+@contextmanager
+def artifact_store(max_workers: int = 4) -> Iterator[ArtifactStore]:
+    """Activate a store for the stages run inside the block, process-wide"""
+    global _active_store
+    if _active_store is not None:
+        raise RuntimeError("An artifact store is already active")
+    store = ArtifactStore(max_workers)
+    _active_store = store
+    try:
+        yield store
+    finally:
+        _active_store = None
+        store.close()
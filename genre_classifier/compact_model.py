@@ -0,0 +1,400 @@
+"""Array-backed export format for the trained genre classifier pipeline.
+
+The fitted sklearn pipeline (column transformer, KNN imputer and random forest) is
+flattened into a handful of contiguous NumPy arrays which are written to a single
+file. The file can be memory-mapped, so loading it is independent of the model size
+and predictions are computed with vectorised NumPy operations over whole batches.
+
+Loading is where the format pays off: milliseconds instead of unpickling the forest.
+Scoring is faster than the pipeline for small batches and on par for large ones, where
+the KNN imputation against the training rows dominates both.
+
+The imputer needs every training row it was fitted on, so `imputer_fit_X` holds the
+full training feature matrix: the file grows with the training set, and anyone who can
+read the model can read the training features.
+"""
+
+import json
+from functools import cached_property
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    # Loading and scoring a compact model does not need sklearn, only exporting does
+    from sklearn.compose import ColumnTransformer
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.impute import KNNImputer
+    from sklearn.pipeline import Pipeline
+
+MAGIC = b"GCCM"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+HEADER_LENGTH_BYTES = 8
+COMPACT_MODEL_ARTIFACT_PATH = "compact_model"
+COMPACT_MODEL_FILE = "model.gcm"
+LEAF_CHUNK_BYTES = 32 << 20
+
+
+def _write_arrays(path: Path | str, arrays: dict[str, np.ndarray], meta: dict):
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        entries[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset += array.nbytes
+
+    header = json.dumps({"meta": meta, "arrays": entries}).encode()
+    data_start = -(-(len(MAGIC) + HEADER_LENGTH_BYTES + len(header)) // ALIGNMENT)
+    data_start *= ALIGNMENT
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(HEADER_LENGTH_BYTES, "little"))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + entries[name]["offset"])
+            f.write(array.tobytes())
+
+
+def _read_arrays(path: Path | str) -> tuple[dict[str, np.ndarray], dict]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a compact model file")
+        header_length = int.from_bytes(f.read(HEADER_LENGTH_BYTES), "little")
+        header = json.loads(f.read(header_length))
+    data_start = -(-(len(MAGIC) + HEADER_LENGTH_BYTES + header_length) // ALIGNMENT)
+    data_start *= ALIGNMENT
+
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        shape = tuple(entry["shape"])
+        if np.prod(shape) == 0:
+            arrays[name] = np.empty(shape, dtype=entry["dtype"])
+            continue
+        arrays[name] = np.memmap(
+            path,
+            dtype=entry["dtype"],
+            mode="r",
+            offset=data_start + entry["offset"],
+            shape=shape,
+        )
+    return arrays, header["meta"]
+
+
+def _is_identity(transformer) -> bool:
+    from sklearn.preprocessing import FunctionTransformer
+
+    # Fitted column transformers replace "passthrough" with an identity transformer
+    return isinstance(transformer, FunctionTransformer) and transformer.func is None
+
+
+def _flatten_column_transformer(ct: "ColumnTransformer") -> tuple[list[str], dict]:
+    """Express the column transformer as a per-column affine transform plus clip."""
+    from sklearn.preprocessing import MinMaxScaler
+
+    if ct.remainder != "drop":
+        raise ValueError("Only column transformers with remainder='drop' are supported")
+
+    columns, scale, offset, lower, upper = [], [], [], [], []
+    for _, transformer, transformer_columns in ct.transformers_:
+        if transformer == "drop":
+            continue
+        n = len(transformer_columns)
+        columns.extend(transformer_columns)
+        if transformer == "passthrough" or _is_identity(transformer):
+            scale.append(np.ones(n))
+            offset.append(np.zeros(n))
+            lower.append(np.full(n, -np.inf))
+            upper.append(np.full(n, np.inf))
+        elif isinstance(transformer, MinMaxScaler):
+            range_min, range_max = transformer.feature_range
+            scale.append(transformer.scale_)
+            offset.append(transformer.min_)
+            lower.append(np.full(n, range_min if transformer.clip else -np.inf))
+            upper.append(np.full(n, range_max if transformer.clip else np.inf))
+        else:
+            raise ValueError(f"Unsupported transformer {transformer!r}")
+
+    return columns, {
+        "input_scale": np.concatenate(scale).astype(np.float64),
+        "input_offset": np.concatenate(offset).astype(np.float64),
+        "input_lower": np.concatenate(lower).astype(np.float64),
+        "input_upper": np.concatenate(upper).astype(np.float64),
+    }
+
+
+def _flatten_imputer(imputer: "KNNImputer") -> tuple[dict, dict]:
+    if imputer.metric != "nan_euclidean" or imputer.add_indicator:
+        raise ValueError("Only nan_euclidean KNN imputers without indicator supported")
+    if imputer.weights not in ("uniform", "distance"):
+        raise ValueError(f"Unsupported imputer weights {imputer.weights!r}")
+    meta = {"n_neighbors": imputer.n_neighbors, "weights": imputer.weights}
+    arrays = {
+        "imputer_fit_X": np.asarray(imputer._fit_X, dtype=np.float64),
+        "imputer_valid_mask": np.asarray(imputer._valid_mask, dtype=np.bool_),
+    }
+    return meta, arrays
+
+
+def _flatten_forest(rfc: "RandomForestClassifier") -> tuple[dict, dict]:
+    """Concatenate all trees of the forest into global node arrays.
+
+    Children of leaf nodes point to the leaf itself, so traversal can run for a fixed
+    number of steps without branching on whether a sample already reached a leaf.
+    """
+    classes = rfc.classes_ if rfc.n_outputs_ > 1 else [rfc.classes_]
+    n_classes = max(len(output_classes) for output_classes in classes)
+    padded_classes = np.zeros((len(classes), n_classes), dtype=np.float64)
+    for k, output_classes in enumerate(classes):
+        padded_classes[k, : len(output_classes)] = output_classes
+        padded_classes[k, len(output_classes) :] = output_classes[0]
+
+    features, thresholds, left, right, missing_left = [], [], [], [], []
+    leaf_index, leaf_values, roots = [], [], []
+    node_offset, leaf_offset, max_depth = 0, 0, 0
+    for estimator in rfc.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == -1
+        node_ids = np.arange(tree.node_count)
+
+        roots.append(node_offset)
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(tree.threshold)
+        left.append(np.where(is_leaf, node_ids, tree.children_left) + node_offset)
+        right.append(np.where(is_leaf, node_ids, tree.children_right) + node_offset)
+        missing_left.append(np.asarray(tree.missing_go_to_left, dtype=np.bool_))
+
+        tree_leaf_index = np.full(tree.node_count, -1)
+        tree_leaf_index[is_leaf] = np.arange(is_leaf.sum()) + leaf_offset
+        leaf_index.append(tree_leaf_index)
+
+        values = tree.value[is_leaf].astype(np.float64)
+        normalizer = values.sum(axis=2, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        leaf_values.append(values / normalizer)
+
+        node_offset += tree.node_count
+        leaf_offset += int(is_leaf.sum())
+        max_depth = max(max_depth, tree.max_depth)
+
+    meta = {
+        "max_depth": max_depth,
+        "n_outputs": int(rfc.n_outputs_),
+        "n_classes": [len(output_classes) for output_classes in classes],
+    }
+    arrays = {
+        "tree_roots": np.asarray(roots, dtype=np.int64),
+        "node_feature": np.concatenate(features).astype(np.int32),
+        "node_threshold": np.concatenate(thresholds).astype(np.float64),
+        "node_left": np.concatenate(left).astype(np.int64),
+        "node_right": np.concatenate(right).astype(np.int64),
+        "node_missing_left": np.concatenate(missing_left),
+        "node_leaf_index": np.concatenate(leaf_index).astype(np.int64),
+        "leaf_values": np.concatenate(leaf_values),
+        "classes": padded_classes,
+    }
+    return meta, arrays
+
+
+def export_compact_model(pipeline: "Pipeline", path: Path | str) -> Path:
+    """Write the fitted pipeline to `path` in the compact array-backed format."""
+    from sklearn.compose import ColumnTransformer
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.impute import KNNImputer
+
+    meta = {"format_version": FORMAT_VERSION, "imputer": None}
+    arrays = {}
+    for _, step in pipeline.steps:
+        if isinstance(step, ColumnTransformer):
+            meta["feature_columns"], step_arrays = _flatten_column_transformer(step)
+        elif isinstance(step, KNNImputer):
+            meta["imputer"], step_arrays = _flatten_imputer(step)
+        elif isinstance(step, RandomForestClassifier):
+            meta["forest"], step_arrays = _flatten_forest(step)
+        else:
+            raise ValueError(f"Unsupported pipeline step {step!r}")
+        arrays.update(step_arrays)
+
+    if "feature_columns" not in meta or "forest" not in meta:
+        raise ValueError("Pipeline must contain a column transformer and a forest")
+
+    _write_arrays(path, arrays, meta)
+    return Path(path)
+
+
+class CompactModel:
+    """Vectorised predictor operating directly on (memory-mapped) model arrays."""
+
+    def __init__(self, arrays: dict[str, np.ndarray], meta: dict):
+        self.arrays = arrays
+        self.meta = meta
+        self.feature_columns: list[str] = meta["feature_columns"]
+
+    @cached_property
+    def _fit_X(self) -> np.ndarray:
+        return self.arrays["imputer_fit_X"]
+
+    @cached_property
+    def _mask_fit_X(self) -> np.ndarray:
+        return np.isnan(self._fit_X)
+
+    def _transform_inputs(self, df: pd.DataFrame) -> np.ndarray:
+        X = df[self.feature_columns].to_numpy(dtype=np.float64, copy=True)
+        X *= self.arrays["input_scale"]
+        X += self.arrays["input_offset"]
+        np.clip(X, self.arrays["input_lower"], self.arrays["input_upper"], out=X)
+        return X
+
+    def _impute(self, X: np.ndarray) -> np.ndarray:
+        """Distance-weighted KNN imputation, equivalent to `KNNImputer.transform`."""
+        from sklearn.metrics.pairwise import nan_euclidean_distances
+
+        n_neighbors = self.meta["imputer"]["n_neighbors"]
+        valid_mask = self.arrays["imputer_valid_mask"]
+        mask = np.isnan(X)
+        row_missing_idx = np.flatnonzero(mask[:, valid_mask].any(axis=1))
+        if row_missing_idx.size == 0:
+            return X[:, valid_mask]
+
+        distances = nan_euclidean_distances(X[row_missing_idx], self._fit_X)
+        imputed = X.copy()
+        for col in np.flatnonzero(valid_mask):
+            receivers = np.flatnonzero(mask[row_missing_idx, col])
+            if receivers.size == 0:
+                continue
+            donors_idx = np.flatnonzero(~self._mask_fit_X[:, col])
+            dist = distances[receivers][:, donors_idx]
+
+            all_nan = np.isnan(dist).all(axis=1)
+            if all_nan.any():
+                col_mean = self._fit_X[donors_idx, col].mean()
+                imputed[row_missing_idx[receivers[all_nan]], col] = col_mean
+                receivers, dist = receivers[~all_nan], dist[~all_nan]
+                if receivers.size == 0:
+                    continue
+
+            k = min(n_neighbors, donors_idx.size)
+            nearest = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            nearest_dist = np.take_along_axis(dist, nearest, axis=1)
+            weights = self._neighbor_weights(nearest_dist)
+            donors = self._fit_X[donors_idx, col][nearest]
+            imputed[row_missing_idx[receivers], col] = np.ma.average(
+                np.ma.asarray(donors), axis=1, weights=weights
+            ).data
+        return imputed[:, valid_mask]
+
+    def _neighbor_weights(self, distances: np.ndarray) -> np.ndarray:
+        if self.meta["imputer"]["weights"] == "uniform":
+            return np.ones_like(distances)
+        with np.errstate(divide="ignore"):
+            weights = 1.0 / distances
+        inf_mask = np.isinf(weights)
+        inf_row = inf_mask.any(axis=1)
+        weights[inf_row] = inf_mask[inf_row]
+        weights[np.isnan(weights)] = 0.0
+        return weights
+
+    @cached_property
+    def _nodes(self) -> tuple[np.ndarray, ...]:
+        # Plain array views, indexing memmaps directly adds per-call overhead
+        return tuple(
+            np.asarray(self.arrays[name])
+            for name in (
+                "node_feature",
+                "node_threshold",
+                "node_missing_left",
+                "node_left",
+                "node_right",
+                "node_leaf_index",
+            )
+        )
+
+    def _apply_forest(self, X: np.ndarray) -> np.ndarray:
+        """Return the leaf index reached in every tree, shape (n_samples, n_trees).
+
+        All (sample, tree) pairs descend together, one level per step, and pairs that
+        reached a leaf drop out, so the work follows the path lengths instead of the
+        depth of the deepest tree.
+        """
+        feature, threshold, missing_left, left, right, leaf_index = self._nodes
+        X = X.astype(np.float32)
+        n_samples, n_features = X.shape
+        roots = np.asarray(self.arrays["tree_roots"])
+        X = X.ravel()
+
+        nodes = np.tile(roots, n_samples)
+        row_offsets = np.repeat(np.arange(n_samples) * n_features, len(roots))
+        active = np.flatnonzero(leaf_index[nodes] < 0)
+        while active.size:
+            current = nodes[active]
+            values = X[row_offsets[active] + feature[current]]
+            go_left = (values <= threshold[current]) | (
+                np.isnan(values) & missing_left[current]
+            )
+            current = np.where(go_left, left[current], right[current])
+            nodes[active] = current
+            active = active[leaf_index[current] < 0]
+        return leaf_index[nodes].reshape(n_samples, len(roots))
+
+    def _forest_proba(self, X: np.ndarray) -> np.ndarray:
+        """Class probabilities averaged over trees, shape (n_samples, n_outputs, n_classes)."""
+        leaves = self._apply_forest(X)
+        leaf_values = np.asarray(self.arrays["leaf_values"])
+        n_samples, n_trees = leaves.shape
+        # Gather and sum the leaves of several trees at once, in chunks of about
+        # LEAF_CHUNK_BYTES so the gathered values stay small
+        chunk = max(1, LEAF_CHUNK_BYTES // max(n_samples * leaf_values[0].nbytes, 1))
+        proba = np.zeros((n_samples,) + leaf_values.shape[1:])
+        for start in range(0, n_trees, chunk):
+            proba += leaf_values[leaves[:, start : start + chunk]].sum(axis=1)
+        proba /= n_trees
+        return proba
+
+    def _features(self, df: pd.DataFrame) -> np.ndarray:
+        X = self._transform_inputs(df)
+        if self.meta["imputer"] is not None:
+            X = self._impute(X)
+        return X
+
+    @property
+    def classes_(self) -> list[np.ndarray]:
+        classes = self.arrays["classes"].astype(np.int64)
+        return [
+            output_classes[:n_classes]
+            for output_classes, n_classes in zip(
+                classes, self.meta["forest"]["n_classes"]
+            )
+        ]
+
+    def predict_proba(self, df: pd.DataFrame) -> list[np.ndarray]:
+        """Per-output class probabilities, in the same layout as sklearn's forest."""
+        proba = self._forest_proba(self._features(df))
+        return [
+            proba[:, k, :n_classes]
+            for k, n_classes in enumerate(self.meta["forest"]["n_classes"])
+        ]
+
+    def predict(self, df: pd.DataFrame) -> np.ndarray:
+        proba = self._forest_proba(self._features(df))
+        class_idx = proba.argmax(axis=2)
+        classes = self.arrays["classes"]
+        return classes[np.arange(classes.shape[0]), class_idx].astype(np.int64)
+
+
+def load_compact_model(path: Path | str) -> CompactModel:
+    """Memory-map a model written by `export_compact_model`."""
+    arrays, meta = _read_arrays(path)
+    if meta.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported compact model version {meta.get('format_version')}"
+        )
+    return CompactModel(arrays, meta)
@@ -0,0 +1,217 @@
+"""Vectorised data drift statistics for the retrain gate.
+
+Every column is compared between a reference and a current sample given as weighted
+values, which covers raw data (unit weights) as well as the merged histograms of
+`genre_classifier.sketches`. Numerical columns get PSI, Kolmogorov-Smirnov and the
+Wasserstein distance, categorical columns PSI and a chi-square test. A column drifts
+on a statistical test for references of at most `SMALL_REFERENCE_SIZE` rows (p < 0.05
+for Kolmogorov-Smirnov or chi-square), and on a distance for larger ones (normed
+Wasserstein > 0.1 for numerical columns, PSI > 0.2 for categorical ones). The dataset
+drifts once at least half of the columns drifted. A column without values in either
+sample, such as one that is missing for a whole window, has insufficient data and
+never drifts.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pydantic import BaseModel
+from scipy import stats
+
+from genre_classifier.sketches import PartitionSketch
+
+SMALL_REFERENCE_SIZE = 1000
+P_VALUE_THRESHOLD = 0.05
+WASSERSTEIN_THRESHOLD = 0.1
+PSI_THRESHOLD = 0.2
+DRIFT_SHARE = 0.5
+
+
+class ColumnDrift(BaseModel):
+    column: str
+    psi: float | None = None
+    ks_statistic: float | None = None
+    ks_p_value: float | None = None
+    wasserstein_normed: float | None = None
+    chi2_statistic: float | None = None
+    chi2_p_value: float | None = None
+    drifted: bool
+    insufficient_data: bool = False
+
+
+class DatasetDrift(BaseModel):
+    columns: dict[str, ColumnDrift]
+    share_drifted: float
+    dataset_drift: bool
+    insufficient_data: bool = False
+
+
+def insufficient_data(column: str) -> ColumnDrift:
+    return ColumnDrift(column=column, drifted=False, insufficient_data=True)
+
+
+def _distribution(counts: np.ndarray, epsilon: float = 1e-4) -> np.ndarray:
+    distribution = counts / max(counts.sum(), 1)
+    return np.clip(distribution, epsilon, None)
+
+
+def population_stability_index(expected: np.ndarray, actual: np.ndarray) -> float:
+    """PSI between two count vectors over the same bins"""
+    expected, actual = _distribution(expected), _distribution(actual)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def _weighted_quantiles(values: np.ndarray, weights: np.ndarray, q: np.ndarray):
+    order = np.argsort(values, kind="stable")
+    cumulative = np.cumsum(weights[order])
+    ranks = q * (cumulative[-1] - 1)
+    return values[order][np.searchsorted(cumulative, ranks, side="right")]
+
+
+def numerical_drift(
+    column: str,
+    reference_values: np.ndarray,
+    current_values: np.ndarray,
+    reference_weights: np.ndarray | None = None,
+    current_weights: np.ndarray | None = None,
+) -> ColumnDrift:
+    reference_values = np.asarray(reference_values, dtype=np.float64)
+    current_values = np.asarray(current_values, dtype=np.float64)
+    if reference_weights is None:
+        reference_weights = np.ones_like(reference_values)
+    if current_weights is None:
+        current_weights = np.ones_like(current_values)
+    reference_weights = np.asarray(reference_weights, dtype=np.float64)
+    current_weights = np.asarray(current_weights, dtype=np.float64)
+    n_reference, n_current = reference_weights.sum(), current_weights.sum()
+    if n_reference == 0 or n_current == 0:
+        return insufficient_data(column)
+
+    # Weighted empirical CDFs of both samples over the union of their values
+    grid = np.union1d(reference_values, current_values)
+    reference_cdf = np.cumsum(
+        np.bincount(
+            np.searchsorted(grid, reference_values), reference_weights, len(grid)
+        )
+    ) / max(n_reference, 1)
+    current_cdf = np.cumsum(
+        np.bincount(np.searchsorted(grid, current_values), current_weights, len(grid))
+    ) / max(n_current, 1)
+    cdf_difference = np.abs(reference_cdf - current_cdf)
+
+    ks_statistic = float(cdf_difference.max(initial=0.0))
+    effective_n = np.sqrt(n_reference * n_current / max(n_reference + n_current, 1))
+    ks_p_value = float(stats.kstwobign.sf(effective_n * ks_statistic))
+
+    mean = np.average(reference_values, weights=reference_weights)
+    std = np.sqrt(np.average((reference_values - mean) ** 2, weights=reference_weights))
+    wasserstein = float(np.sum(cdf_difference[:-1] * np.diff(grid)))
+    wasserstein_normed = wasserstein / std if std > 0 else wasserstein
+
+    # PSI over the deciles of the reference distribution
+    edges = np.unique(
+        _weighted_quantiles(
+            reference_values, reference_weights, np.linspace(0.1, 0.9, 9)
+        )
+    )
+    psi = population_stability_index(
+        np.bincount(
+            np.searchsorted(edges, reference_values), reference_weights, len(edges) + 1
+        ),
+        np.bincount(
+            np.searchsorted(edges, current_values), current_weights, len(edges) + 1
+        ),
+    )
+
+    if n_reference <= SMALL_REFERENCE_SIZE:
+        drifted = ks_p_value < P_VALUE_THRESHOLD
+    else:
+        drifted = wasserstein_normed > WASSERSTEIN_THRESHOLD
+    return ColumnDrift(
+        column=column,
+        psi=psi,
+        ks_statistic=ks_statistic,
+        ks_p_value=ks_p_value,
+        wasserstein_normed=wasserstein_normed,
+        drifted=drifted,
+    )
+
+
+def aligned_counts(
+    reference: dict, current: dict
+) -> tuple[list, np.ndarray, np.ndarray]:
+    """Counts of two sparse histograms over the union of their keys"""
+    keys = sorted(set(reference) | set(current), key=str)
+    return (
+        keys,
+        np.array([reference.get(key, 0) for key in keys], dtype=np.float64),
+        np.array([current.get(key, 0) for key in keys], dtype=np.float64),
+    )
+
+
+def categorical_drift(
+    column: str, reference_counts: dict, current_counts: dict
+) -> ColumnDrift:
+    _, expected, actual = aligned_counts(reference_counts, current_counts)
+    if expected.sum() == 0 or actual.sum() == 0:
+        return insufficient_data(column)
+    psi = population_stability_index(expected, actual)
+
+    # Chi-square goodness of fit of the current counts to the reference proportions,
+    # which are floored so categories unseen in the reference do not divide by zero
+    expected_counts = _distribution(expected) * actual.sum()
+    chi2_statistic = float(np.sum((actual - expected_counts) ** 2 / expected_counts))
+    chi2_p_value = float(stats.chi2.sf(chi2_statistic, max(len(expected) - 1, 1)))
+
+    if expected.sum() <= SMALL_REFERENCE_SIZE:
+        drifted = chi2_p_value < P_VALUE_THRESHOLD
+    else:
+        drifted = psi > PSI_THRESHOLD
+    return ColumnDrift(
+        column=column,
+        psi=psi,
+        chi2_statistic=chi2_statistic,
+        chi2_p_value=chi2_p_value,
+        drifted=drifted,
+    )
+
+
+def sketch_drift(
+    reference: PartitionSketch,
+    current: PartitionSketch,
+    drift_share: float = DRIFT_SHARE,
+    max_workers: int | None = None,
+) -> DatasetDrift:
+    """Drift of every sketched column, computed in parallel across columns. Columns
+    that are missing from the current sketch, as all of them are for a window without
+    partitions, have insufficient data."""
+
+    def numerical(column: str) -> ColumnDrift:
+        if column not in current.numerical:
+            return insufficient_data(column)
+        reference_values, reference_counts = reference.numerical[column].histogram()
+        current_values, current_counts = current.numerical[column].histogram()
+        return numerical_drift(
+            column, reference_values, current_values, reference_counts, current_counts
+        )
+
+    def categorical(column: str) -> ColumnDrift:
+        return categorical_drift(
+            column, reference.categorical[column], current.categorical.get(column, {})
+        )
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = [
+            executor.submit(numerical, column) for column in reference.numerical
+        ] + [executor.submit(categorical, column) for column in reference.categorical]
+        columns = {drift.column: drift for drift in (f.result() for f in futures)}
+
+    # The share is over the columns with enough data to compare
+    compared = [drift for drift in columns.values() if not drift.insufficient_data]
+    share_drifted = sum(drift.drifted for drift in compared) / max(len(compared), 1)
+    return DatasetDrift(
+        columns=columns,
+        share_drifted=share_drifted,
+        dataset_drift=bool(compared) and share_drifted >= drift_share,
+        insufficient_data=not compared,
+    )
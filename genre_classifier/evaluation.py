@@ -0,0 +1,298 @@
+"""Vectorised multi-label metrics for predictions joined with ground truth.
+
+Genre lists are binarised into boolean matrices over the model's classes with one
+flattening pass, after which Jaccard and Hamming follow from row-wise set operations.
+Daily results are kept as sums in a single JSON history, so metrics over any window of
+days are exact and every day is only evaluated once.
+
+Per-genre precision, recall and F1 follow from the counts of true and false positives
+and negatives, taken in a single pass over a sparse matrix with one confusion cell per
+row and genre. Bootstrap resamples only reweight the rows of that matrix, so the counts
+of a block of resamples are one sparse product, without looping over resamples.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import scipy.sparse as sp
+from botocore.exceptions import ClientError
+from prefect_aws import S3Bucket
+from pydantic import BaseModel
+
+
+def binarize(genres: pd.Series, classes: list[str] | np.ndarray) -> np.ndarray:
+    """Boolean (n, n_classes) matrix of genre lists, genres outside `classes` are ignored"""
+    list_array = pa.array(genres, type=pa.list_(pa.string()))
+    flat = list_array.flatten().to_numpy(zero_copy_only=False)
+    rows = list_array.value_parent_indices().to_numpy()
+    codes = pd.Categorical(flat, categories=classes).codes
+    known = codes >= 0
+
+    matrix = np.zeros((len(genres), len(classes)), dtype=bool)
+    matrix[rows[known], codes[known]] = True
+    return matrix
+
+
+def join_on_song_id(
+    predictions: pd.DataFrame, ground_truth: pd.DataFrame
+) -> tuple[np.ndarray, np.ndarray]:
+    """Positions of predictions and their ground truth rows with the same song_id.
+
+    The ground truth index is sorted once and looked up with a binary search, instead
+    of hashing both sides as in a pandas join.
+    """
+    truth_ids = ground_truth.index.to_numpy()
+    order = np.argsort(truth_ids, kind="stable")
+    sorted_ids = truth_ids[order]
+
+    prediction_ids = predictions.index.to_numpy()
+    positions = np.searchsorted(sorted_ids, prediction_ids)
+    positions[positions == len(sorted_ids)] = 0
+    matched = (
+        sorted_ids[positions] == prediction_ids
+        if len(sorted_ids)
+        else np.zeros(len(prediction_ids), dtype=bool)
+    )
+    return np.flatnonzero(matched), order[positions[matched]]
+
+
+def row_metrics(
+    y_true: np.ndarray, y_pred: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Per-row Jaccard score and Hamming loss of two boolean label matrices"""
+    intersection = np.count_nonzero(y_true & y_pred, axis=1)
+    union = np.count_nonzero(y_true | y_pred, axis=1)
+    jaccard = np.divide(
+        intersection, union, out=np.zeros(len(union), dtype=np.float64), where=union > 0
+    )
+    hamming = np.count_nonzero(y_true ^ y_pred, axis=1) / max(y_true.shape[1], 1)
+    return jaccard, hamming
+
+
+# Confusion cells of a row and genre, coded as 2 * true + predicted
+TRUE_NEGATIVE, FALSE_POSITIVE, FALSE_NEGATIVE, TRUE_POSITIVE = range(4)
+# Resample weights per block of resamples, (resamples, rows)
+BOOTSTRAP_BLOCK_CELLS = 1 << 22
+
+
+def confusion_matrix(y_true: np.ndarray, y_pred: np.ndarray) -> sp.csr_matrix:
+    """Sparse (n, 4 * n_classes) indicator of the confusion cell of every row and class"""
+    y_true = np.asarray(y_true, dtype=bool)
+    y_pred = np.asarray(y_pred, dtype=bool)
+    n, n_classes = y_true.shape
+    cells = (y_true.astype(np.intp) << 1) | y_pred
+    columns = (cells + 4 * np.arange(n_classes)).ravel()
+    return sp.csr_matrix(
+        (np.ones(len(columns)), columns, np.arange(0, len(columns) + 1, n_classes)),
+        shape=(n, 4 * n_classes),
+    )
+
+
+def confusion_counts(y_true: np.ndarray, y_pred: np.ndarray) -> np.ndarray:
+    """(n_classes, 4) counts of true negatives, false positives, false negatives and
+    true positives of every class"""
+    counts = np.asarray(confusion_matrix(y_true, y_pred).sum(axis=0))
+    return counts.reshape(-1, 4).astype(np.int64)
+
+
+def class_metrics(counts: np.ndarray) -> dict[str, np.ndarray]:
+    """Precision, recall and F1 of every class from (..., n_classes, 4) counts, 0 where
+    they are undefined, as in scikit-learn. Also the micro-averaged F1."""
+    tp = counts[..., TRUE_POSITIVE]
+    fp = counts[..., FALSE_POSITIVE]
+    fn = counts[..., FALSE_NEGATIVE]
+
+    def ratio(numerator, denominator):
+        numerator = np.asarray(numerator, dtype=np.float64)
+        return np.divide(
+            numerator,
+            denominator,
+            out=np.zeros_like(numerator),
+            where=denominator > 0,
+        )
+
+    return {
+        "precision": ratio(tp, tp + fp),
+        "recall": ratio(tp, tp + fn),
+        "f1": ratio(2 * tp, 2 * tp + fp + fn),
+        "micro_f1": ratio(
+            2 * tp.sum(axis=-1), 2 * tp.sum(axis=-1) + fp.sum(axis=-1) + fn.sum(axis=-1)
+        ),
+    }
+
+
+def bootstrap_weights(
+    n_rows: int, n_resamples: int, rng: np.random.Generator
+) -> np.ndarray:
+    """(n_resamples, n_rows) number of times each row is drawn in each resample"""
+    rows = rng.integers(0, n_rows, size=(n_resamples, n_rows))
+    rows += n_rows * np.arange(n_resamples)[:, None]
+    counts = np.bincount(rows.ravel(), minlength=n_resamples * n_rows)
+    return counts.reshape(n_resamples, n_rows).astype(np.float64)
+
+
+class Interval(BaseModel):
+    estimate: float
+    lower: float
+    upper: float
+
+
+class GenreEvaluation(BaseModel):
+    support: int
+    precision: Interval
+    recall: Interval
+    f1: Interval
+
+
+class BootstrapEvaluation(BaseModel):
+    rows: int
+    resamples: int
+    confidence: float
+    jaccard_score: Interval
+    hamming_loss: Interval
+    macro_f1: Interval
+    micro_f1: Interval
+    genres: dict[str, GenreEvaluation]
+
+
+def bootstrap_evaluation(
+    y_true: np.ndarray,
+    y_pred: np.ndarray,
+    classes: list[str] | np.ndarray,
+    n_resamples: int = 1000,
+    confidence: float = 0.95,
+    seed: int | None = None,
+) -> BootstrapEvaluation:
+    """Sample-averaged Jaccard score and Hamming loss, per-genre precision, recall and
+    F1 and their macro and micro averages, with percentile bootstrap intervals.
+
+    Every resample draws the rows with replacement. Its confusion counts are the row
+    weights times the sparse confusion matrix, computed for blocks of resamples at once.
+    """
+    y_true = np.asarray(y_true, dtype=bool)
+    y_pred = np.asarray(y_pred, dtype=bool)
+    n_rows, n_classes = y_true.shape
+    cells = confusion_matrix(y_true, y_pred)
+    jaccard, hamming = row_metrics(y_true, y_pred)
+    rows = np.column_stack([jaccard, hamming])
+
+    def metrics(counts: np.ndarray, row_means: np.ndarray) -> dict[str, np.ndarray]:
+        metrics = class_metrics(counts)
+        metrics["macro_f1"] = metrics["f1"].mean(axis=-1)
+        metrics["jaccard_score"] = row_means[..., 0]
+        metrics["hamming_loss"] = row_means[..., 1]
+        return metrics
+
+    estimate = metrics(
+        confusion_counts(y_true, y_pred), rows.mean(axis=0) if n_rows else np.zeros(2)
+    )
+
+    rng = np.random.default_rng(seed)
+    block = max(1, BOOTSTRAP_BLOCK_CELLS // max(n_rows, 1))
+    resampled: dict[str, list[np.ndarray]] = {name: [] for name in estimate}
+    for start in range(0, n_resamples if n_rows else 0, block):
+        weights = bootstrap_weights(n_rows, min(block, n_resamples - start), rng)
+        # (cells.T @ weights.T).T keeps the sparse matrix on the left
+        counts = (cells.T @ weights.T).T.reshape(-1, n_classes, 4)
+        for name, values in metrics(counts, weights @ rows / n_rows).items():
+            resampled[name].append(values)
+
+    alpha = (1 - confidence) / 2
+
+    def interval(name: str, i: int | None = None) -> Interval:
+        value = estimate[name] if i is None else estimate[name][i]
+        if not resampled[name]:
+            return Interval(estimate=value, lower=value, upper=value)
+        samples = np.concatenate(resampled[name])
+        if i is not None:
+            samples = samples[:, i]
+        lower, upper = np.quantile(samples, [alpha, 1 - alpha])
+        return Interval(estimate=value, lower=lower, upper=upper)
+
+    support = y_true.sum(axis=0)
+    return BootstrapEvaluation(
+        rows=n_rows,
+        resamples=n_resamples,
+        confidence=confidence,
+        jaccard_score=interval("jaccard_score"),
+        hamming_loss=interval("hamming_loss"),
+        macro_f1=interval("macro_f1"),
+        micro_f1=interval("micro_f1"),
+        genres={
+            str(genre): GenreEvaluation(
+                support=support[i],
+                precision=interval("precision", i),
+                recall=interval("recall", i),
+                f1=interval("f1", i),
+            )
+            for i, genre in enumerate(classes)
+        },
+    )
+
+
+class DailyPerformance(BaseModel):
+    rows: int = 0
+    jaccard_sum: float = 0.0
+    hamming_sum: float = 0.0
+
+
+class PerformanceHistory(BaseModel):
+    days: dict[str, DailyPerformance] = {}
+
+    def summary(self, dates: list[str] | None = None) -> dict[str, float | int]:
+        """Jaccard score and Hamming loss over the given days, all days by default"""
+        dates = self.days if dates is None else dates
+        days = [self.days[date] for date in dates if date in self.days]
+        rows = sum(day.rows for day in days)
+        return {
+            "rows": rows,
+            "jaccard_score": sum(day.jaccard_sum for day in days) / rows
+            if rows
+            else float("nan"),
+            "hamming_loss": sum(day.hamming_sum for day in days) / rows
+            if rows
+            else float("nan"),
+        }
+
+
+def evaluate_predictions(
+    predictions: pd.DataFrame,
+    ground_truth: pd.DataFrame,
+    classes: list[str] | np.ndarray,
+) -> DailyPerformance:
+    """Metrics of predictions that have ground truth with at least one known genre.
+
+    Ground truth genres are restricted to the model classes, as in training evaluation.
+    """
+    prediction_rows, truth_rows = join_on_song_id(predictions, ground_truth)
+    y_true = binarize(ground_truth["genres"].iloc[truth_rows], classes)
+    y_pred = binarize(predictions["genres"].iloc[prediction_rows], classes)
+    labelled = y_true.any(axis=1)
+    jaccard, hamming = row_metrics(y_true[labelled], y_pred[labelled])
+    return DailyPerformance(
+        rows=int(labelled.sum()),
+        jaccard_sum=float(jaccard.sum()),
+        hamming_sum=float(hamming.sum()),
+    )
+
+
+def load_performance_history(
+    history_path: str, bucket_block_name: str = "million-songs-dataset-s3"
+) -> PerformanceHistory:
+    bucket = S3Bucket.load(bucket_block_name)
+    try:
+        content = bucket.read_path(history_path)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return PerformanceHistory()
+        raise
+    return PerformanceHistory.model_validate_json(content)
+
+
+def save_performance_history(
+    history: PerformanceHistory,
+    history_path: str,
+    bucket_block_name: str = "million-songs-dataset-s3",
+) -> None:
+    bucket = S3Bucket.load(bucket_block_name)
+    bucket.write_path(history_path, history.model_dump_json().encode())
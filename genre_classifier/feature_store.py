@@ -0,0 +1,146 @@
+"""Local store of cleaned, memory-mappable feature matrices and binarised labels.
+
+A feature set holds, for every split, the cleaned feature matrix as a column-major
+float64 `.npy` file, the binarised labels as a uint8 `.npy` file and the song ids as an
+Arrow IPC file. It is keyed by the fingerprint of the source data and the cleaning
+parameters, so training runs and sweeps over model hyperparameters on the same data
+open the matrices with `np.load(mmap_mode="r")` instead of downloading, decoding,
+filtering and cleaning the Parquet files again. Data frames over the matrices share
+their memory, nothing is copied until a model reads them.
+
+Feature sets are written to a temporary directory and renamed into place once
+complete, so concurrent runs never open a partially written set.
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pydantic import BaseModel
+
+from genre_classifier.fingerprint import compute_fingerprint
+from genre_classifier.sketches import GenreCounts
+
+FORMAT_VERSION = 1
+DEFAULT_STORE_DIR = os.environ.get(
+    "GENRE_CLASSIFIER_FEATURE_STORE", "~/.cache/genre-classifier/features"
+)
+INFO_FILE = "feature_set.json"
+FEATURES_FILE = "features.npy"
+LABELS_FILE = "labels.npy"
+SONG_IDS_FILE = "song_ids.arrow"
+
+
+class FeatureSetInfo(BaseModel):
+    key: str
+    format_version: int = FORMAT_VERSION
+    inputs: dict
+    feature_columns: list[str]
+    classes: list[str]
+    label_counts: GenreCounts
+    rows: dict[str, int]
+
+
+class FeatureSplit:
+    def __init__(self, X: pd.DataFrame, y: np.ndarray, song_ids: pa.Array):
+        self.X = X
+        self.y = y
+        self.song_ids = song_ids
+
+
+class FeatureSet:
+    def __init__(self, info: FeatureSetInfo, path: Path):
+        self.info = info
+        self.path = path
+
+    def __getitem__(self, split: str) -> FeatureSplit:
+        """Memory-map the matrices of a split"""
+        split_dir = self.path / split
+        features = np.load(split_dir / FEATURES_FILE, mmap_mode="r")
+        # The arrays keep the map open
+        source = pa.memory_map(str(split_dir / SONG_IDS_FILE))
+        song_ids = pa.ipc.open_file(source).read_all().column("song_id")
+        return FeatureSplit(
+            X=pd.DataFrame(features, columns=self.info.feature_columns, copy=False),
+            y=np.load(split_dir / LABELS_FILE, mmap_mode="r"),
+            song_ids=song_ids,
+        )
+
+
+def get_store_dir(store_dir: Path | str | None = None) -> Path:
+    return Path(store_dir or DEFAULT_STORE_DIR).expanduser()
+
+
+def feature_set_key(inputs: dict) -> str:
+    """Key of the feature set built from `inputs`: the fingerprints of the source data
+    and the parameters of filtering and cleaning"""
+    return compute_fingerprint("features", {**inputs, "format_version": FORMAT_VERSION})
+
+
+def _feature_set_path(key: str, store_dir: Path | str | None) -> Path:
+    return get_store_dir(store_dir) / f"v{FORMAT_VERSION}" / key
+
+
+def open_feature_set(
+    key: str, store_dir: Path | str | None = None
+) -> FeatureSet | None:
+    path = _feature_set_path(key, store_dir)
+    if not (path / INFO_FILE).exists():
+        return None
+    info = FeatureSetInfo.model_validate_json((path / INFO_FILE).read_text())
+    return FeatureSet(info, path)
+
+
+def _write_split(
+    split_dir: Path, df: pd.DataFrame, labels: np.ndarray, feature_columns: list[str]
+) -> None:
+    split_dir.mkdir(parents=True)
+    # Column-major, so a data frame over the matrix is a view on the memory map
+    features = np.asfortranarray(df[feature_columns].to_numpy(dtype=np.float64))
+    np.save(split_dir / FEATURES_FILE, features)
+    np.save(split_dir / LABELS_FILE, np.ascontiguousarray(labels, dtype=np.uint8))
+    song_ids = pa.table({"song_id": pa.array(df.index.astype(str), pa.string())})
+    with pa.OSFile(str(split_dir / SONG_IDS_FILE), "wb") as sink:
+        with pa.ipc.new_file(sink, song_ids.schema) as writer:
+            writer.write_table(song_ids)
+
+
+def materialize_feature_set(
+    key: str,
+    inputs: dict,
+    splits: dict[str, tuple[pd.DataFrame, np.ndarray]],
+    feature_columns: list[str],
+    classes: list[str],
+    label_counts: GenreCounts,
+    store_dir: Path | str | None = None,
+) -> FeatureSet:
+    """Write the cleaned features and binarised labels of every split, indexed by song
+    id, and open the stored feature set"""
+    path = _feature_set_path(key, store_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    build_dir = Path(tempfile.mkdtemp(dir=path.parent, prefix=f".{key[:12]}-"))
+    try:
+        for split, (df, labels) in splits.items():
+            _write_split(build_dir / split, df, labels, feature_columns)
+        info = FeatureSetInfo(
+            key=key,
+            inputs=inputs,
+            feature_columns=feature_columns,
+            classes=classes,
+            label_counts=label_counts,
+            rows={split: len(df) for split, (df, _) in splits.items()},
+        )
+        (build_dir / INFO_FILE).write_text(info.model_dump_json())
+        try:
+            build_dir.rename(path)
+        except OSError:
+            # Another run stored the same feature set first
+            if not (path / INFO_FILE).exists():
+                raise
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return open_feature_set(key, store_dir)
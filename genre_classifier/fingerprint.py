@@ -0,0 +1,100 @@
+"""Content-addressed fingerprints of the stages of the training pipeline.
+
+A stage's fingerprint hashes its parameters together with the content of its inputs:
+the ETags of the S3 objects it reads, or the validators of a remote file. A stage
+records its fingerprint, output path and output fingerprint once it completes, and a
+later run with the same fingerprint reuses that output, as long as it is unchanged,
+instead of running the stage again. The next stage fingerprints the output by content,
+so a stage that rewrites identical data does not invalidate the stages after it.
+"""
+
+import hashlib
+import json
+import urllib.request
+
+from botocore.exceptions import ClientError
+from prefect_aws import S3Bucket
+from pydantic import BaseModel
+
+from genre_classifier.utils import get_object_key
+
+STAGES_PATH = "subset/_stages"
+
+
+class StageRecord(BaseModel):
+    stage: str
+    fingerprint: str
+    output: str | None = None
+    output_fingerprint: str | None = None
+
+
+def compute_fingerprint(stage: str, inputs: dict) -> str:
+    """SHA-256 of the stage name and its inputs, independent of the order of the keys"""
+    content = json.dumps(
+        {"stage": stage, "inputs": inputs}, sort_keys=True, default=str
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def s3_fingerprint(
+    data_path: str,
+    suffix: str = "",
+    bucket_block_name: str = "million-songs-dataset-s3",
+) -> str:
+    """Hash of the keys and ETags of an object, or of the objects under a folder.
+
+    Only objects whose key ends with `suffix` are included, so outputs that other stages
+    write to the same folder do not change the fingerprint.
+    """
+    bucket = S3Bucket.load(bucket_block_name)
+    client = bucket.credentials.get_s3_client()
+    key = get_object_key(bucket, data_path)
+    digest = hashlib.sha256()
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket.bucket_name, Prefix=key):
+        for obj in page.get("Contents", []):
+            if obj["Key"] != key and not obj["Key"].startswith(f"{key}/"):
+                continue
+            if obj["Key"].endswith(suffix):
+                digest.update(f"{obj['Key'][len(key) :]}\0{obj['ETag']}\n".encode())
+    return digest.hexdigest()
+
+
+def url_fingerprint(url: str) -> dict[str, str | None]:
+    """The validators of a remote file, without downloading it"""
+    with urllib.request.urlopen(urllib.request.Request(url, method="HEAD")) as r:
+        return {
+            header: r.headers.get(header)
+            for header in ("ETag", "Last-Modified", "Content-Length")
+        }
+
+
+def get_stage_record_path(stage: str, stages_path: str = STAGES_PATH) -> str:
+    return f"{stages_path}/{stage}.json"
+
+
+def load_stage_record(
+    stage: str,
+    bucket_block_name: str = "million-songs-dataset-s3",
+    stages_path: str = STAGES_PATH,
+) -> StageRecord | None:
+    bucket = S3Bucket.load(bucket_block_name)
+    try:
+        content = bucket.read_path(get_stage_record_path(stage, stages_path))
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return StageRecord.model_validate_json(content)
+
+
+def save_stage_record(
+    record: StageRecord,
+    bucket_block_name: str = "million-songs-dataset-s3",
+    stages_path: str = STAGES_PATH,
+) -> None:
+    bucket = S3Bucket.load(bucket_block_name)
+    bucket.write_path(
+        get_stage_record_path(record.stage, stages_path),
+        record.model_dump_json().encode(),
+    )
@@ -0,0 +1,245 @@
+import json
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+from prefect import flow, get_run_logger, task
+from prefect_aws import S3Bucket
+
+from genre_classifier.instrumentation import instrumented, instrumented_flow
+from genre_classifier.utils import (
+    PREDICTIONS_INDEX_FILE,
+    PREDICTIONS_METADATA_FILE,
+    compacted_files,
+    get_object_key,
+    read_parquet_data,
+    read_parquet_partitions,
+    upload_file_to_s3,
+)
+from genre_classifier.watermark import (
+    LATE_RELEASE_LOOKBACK_DAYS,
+    PREDICTIONS_FILE,
+    list_partition_dates,
+    load_watermark,
+    lookback_start,
+)
+
+COMPACTED_PREDICTIONS_FILE = "predictions-{date}.parquet"
+
+
+@task
+@instrumented
+def read_predictions(
+    bucket_block_name: str, data_path: str, dates: list[str]
+) -> pd.DataFrame:
+    """All prediction partitions of `dates` in date order, with a date column"""
+    table = read_parquet_partitions(
+        [f"{data_path}/{date}/{PREDICTIONS_FILE}" for date in dates],
+        dates,
+        bucket_block_name=bucket_block_name,
+    )
+    return table.to_pandas()
+
+
+@task
+@instrumented
+def load_compaction_index(bucket_block_name: str, target_data_path: str) -> dict | None:
+    """Index of the last compaction, None before the first one"""
+    bucket = S3Bucket.load(bucket_block_name)
+    try:
+        content = bucket.read_path(f"{target_data_path}/{PREDICTIONS_INDEX_FILE}")
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(content)
+
+
+@task
+@instrumented
+def read_compacted_predictions(
+    bucket_block_name: str, target_data_path: str, files: list[dict]
+) -> pd.DataFrame:
+    """The files of the compacted table, oldest first"""
+    return pd.concat(
+        [
+            read_parquet_data(f"{target_data_path}/{file['file']}", bucket_block_name)
+            for file in files
+        ]
+    )
+
+
+def compact(df: pd.DataFrame) -> pd.DataFrame:
+    """Keep the latest prediction per song, sorted by song_id"""
+    df = df[~df.index.duplicated(keep="last")]
+    return df.sort_index(kind="stable")
+
+
+def build_index(metadata: pq.FileMetaData, file_name: str, file_size: int) -> dict:
+    """Sidecar index with the song_id range of every row group of the compacted table"""
+    column = [
+        metadata.schema.column(i).path for i in range(metadata.num_columns)
+    ].index("song_id")
+    row_groups = [metadata.row_group(i) for i in range(metadata.num_row_groups)]
+    return {
+        "file": file_name,
+        "file_size": file_size,
+        "num_rows": metadata.num_rows,
+        "row_group_min": [rg.column(column).statistics.min for rg in row_groups],
+        "row_group_max": [rg.column(column).statistics.max for rg in row_groups],
+        "row_group_num_rows": [rg.num_rows for rg in row_groups],
+    }
+
+
+@task
+@instrumented
+def write_compacted_predictions(
+    df: pd.DataFrame,
+    index: dict,
+    target_data_path: str,
+    file_name: str,
+    row_group_size: int,
+    bucket_block_name: str = "million-songs-dataset-s3",
+) -> dict:
+    """Write `df` as a new file of the compacted table, and `index` with the file added
+    after its files"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        local_path = Path(tmpdir) / file_name
+        pq.write_table(
+            pa.Table.from_pandas(df),
+            local_path,
+            row_group_size=row_group_size,
+            write_statistics=True,
+        )
+        metadata = pq.read_metadata(local_path)
+        file_index = build_index(metadata, file_name, local_path.stat().st_size)
+        file_index["metadata_file"] = f"{file_name}.{PREDICTIONS_METADATA_FILE}"
+        upload_file_to_s3(
+            local_path, f"{target_data_path}/{file_name}", bucket_block_name
+        )
+        # Lookups read the footer from here instead of the end of the table
+        metadata_path = Path(tmpdir) / file_index["metadata_file"]
+        metadata.write_metadata_file(str(metadata_path))
+        upload_file_to_s3(
+            metadata_path,
+            f"{target_data_path}/{file_index['metadata_file']}",
+            bucket_block_name,
+        )
+    index = {**index, "files": [*index["files"], file_index]}
+    # Written last, so readers never see an index for a missing file
+    bucket = S3Bucket.load(bucket_block_name)
+    bucket.write_path(
+        f"{target_data_path}/{PREDICTIONS_INDEX_FILE}", json.dumps(index).encode()
+    )
+    return index
+
+
+@task
+@instrumented
+def delete_compacted_files(
+    bucket_block_name: str, target_data_path: str, files: list[dict]
+) -> None:
+    """Delete files that were merged into a newer file of the compacted table"""
+    bucket = S3Bucket.load(bucket_block_name)
+    keys = [
+        get_object_key(bucket, f"{target_data_path}/{name}")
+        for file in files
+        for name in (file["file"], file["metadata_file"])
+    ]
+    bucket.credentials.get_s3_client().delete_objects(
+        Bucket=bucket.bucket_name,
+        Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+    )
+
+
+@flow(log_prints=True)
+@instrumented_flow
+def compact_predictions_flow(
+    bucket_block_name: str = "million-songs-dataset-s3",
+    source_data_path: str = "subset/predictions",
+    target_data_path: str = "subset/predictions_compacted",
+    row_group_size: int = 10_000,
+    max_files: int = 8,
+):
+    """Add the prediction partitions written since the last compaction to the
+    compacted table. Partitions of the last `LATE_RELEASE_LOOKBACK_DAYS` before the last
+    compacted date are listed again, and added if they were scored late.
+
+    The predictions of the new dates are written as a new file of the table, so a run
+    only reads and writes the new dates. Once the table would have more than
+    `max_files` files, all of them are merged into one instead, which bounds the
+    footers a lookup reads.
+
+    Only dates up to the prediction watermark are compacted, since dates after it may
+    still have gaps that are scored later, and would then be skipped.
+    """
+    logger = get_run_logger()
+    previous_index = load_compaction_index(bucket_block_name, target_data_path) or {}
+    last_compacted_date = previous_index.get("last_compacted_date")
+    previous_files = compacted_files(previous_index) if previous_index else []
+    # Dates of the lookback window are listed again, for predictions of late releases
+    dates = list_partition_dates(
+        source_data_path,
+        PREDICTIONS_FILE,
+        bucket_block_name,
+        lookback_start(last_compacted_date, LATE_RELEASE_LOOKBACK_DAYS),
+    )
+    # Indexes of earlier versions only record the last compacted date
+    recent_dates = previous_index.get(
+        "recent_dates",
+        [date for date in dates if last_compacted_date and date <= last_compacted_date],
+    )
+    dates = [date for date in dates if date not in recent_dates]
+    watermark = load_watermark(source_data_path, bucket_block_name)
+    if watermark is not None:
+        dates = [
+            date
+            for date in dates
+            if watermark.last_scored_date is not None
+            and date <= watermark.last_scored_date
+        ]
+    if not dates:
+        logger.info("No predictions to compact.")
+        return
+
+    new_predictions = read_predictions(bucket_block_name, source_data_path, dates)
+    merged_files = previous_files if len(previous_files) >= max_files else []
+    if merged_files:
+        # Predictions of the new dates replace the compacted ones of the same songs
+        compacted = read_compacted_predictions(
+            bucket_block_name, target_data_path, merged_files
+        )
+        new_predictions = pd.concat([compacted, new_predictions])
+    df = compact(new_predictions)
+    last_compacted_date = max(dates[-1], last_compacted_date or dates[-1])
+    window_start = lookback_start(last_compacted_date, LATE_RELEASE_LOOKBACK_DAYS)
+    index = {
+        "files": [file for file in previous_files if file not in merged_files],
+        "last_compacted_date": last_compacted_date,
+        # The dates that will be listed again by the next run
+        "recent_dates": sorted(
+            date for date in {*recent_dates, *dates} if date > window_start
+        ),
+    }
+    index = write_compacted_predictions(
+        df,
+        index,
+        target_data_path,
+        # Unique, as every date is compacted once
+        COMPACTED_PREDICTIONS_FILE.format(date=dates[-1]),
+        row_group_size,
+        bucket_block_name,
+    )
+    if merged_files:
+        delete_compacted_files(bucket_block_name, target_data_path, merged_files)
+    logger.info(
+        f"Compacted {len(df)} predictions, adding {len(dates)} dates up to "
+        f"{dates[-1]}, into a table of {len(index['files'])} files"
+    )
+
+
+if __name__ == "__main__":
+    compact_predictions_flow()
@@ -1,12 +1,83 @@
-from prefect import flow
+from typing import Callable
 
-from genre_classifier.flows.ingest_data.flow import ingest_flow
-from genre_classifier.flows.preprocess.flow import preprocess_flow
+from prefect import flow, get_run_logger
+
+from genre_classifier.artifact_store import artifact_store, get_active_store
+from genre_classifier.fingerprint import (
+    STAGES_PATH,
+    StageRecord,
+    compute_fingerprint,
+    load_stage_record,
+    s3_fingerprint,
+    save_stage_record,
+    url_fingerprint,
+)
+from genre_classifier.flows.ingest_data.flow import MSD_SUBSET_URL, ingest_flow
+from genre_classifier.flows.preprocess.flow import DEFAULT_GENRES_URL, preprocess_flow
 from genre_classifier.flows.split_data.flow import split_data_flow
 from genre_classifier.flows.train.flow import train_flow
+from genre_classifier.instrumentation import instrumented_flow
+from genre_classifier.sampling import resolve_sample_fraction, sample_path
+
+
+def run_stage(
+    stage: str,
+    inputs: dict,
+    run: Callable[[], str | None],
+    fingerprint_output: Callable[[str], str] | None = None,
+    bucket_block_name: str = "million-songs-dataset-s3",
+    reuse: bool = True,
+    stages_path: str = STAGES_PATH,
+) -> tuple[StageRecord, bool]:
+    """Run a stage, unless a completed run had the same fingerprint and its output is
+    unchanged. Returns the stage record and whether the previous output was reused."""
+    logger = get_run_logger()
+    fingerprint = compute_fingerprint(stage, inputs)
+    record = load_stage_record(stage, bucket_block_name, stages_path)
+    if (
+        reuse
+        and record is not None
+        and record.fingerprint == fingerprint
+        and (
+            fingerprint_output is None
+            or fingerprint_output(record.output) == record.output_fingerprint
+        )
+    ):
+        logger.info(f"Reusing {stage} output {record.output} ({fingerprint[:12]})")
+        return record, True
+
+    output = run()
+    store = get_active_store()
+    if store is not None and fingerprint_output is not None:
+        # Outputs are fingerprinted by their S3 ETags
+        store.flush()
+    record = StageRecord(
+        stage=stage,
+        fingerprint=fingerprint,
+        output=output,
+        output_fingerprint=fingerprint_output(output) if fingerprint_output else None,
+    )
+    save_stage_record(record, bucket_block_name, stages_path)
+    logger.info(f"Ran {stage} ({fingerprint[:12]})")
+    return record, False
+
+
+def split_output_fingerprint(
+    data_path: str, bucket_block_name: str = "million-songs-dataset-s3"
+) -> str:
+    """Fingerprint of the train, validation and test sets, but not of the daily
+    releases, as those are consumed by other flows"""
+    return compute_fingerprint(
+        "split",
+        {
+            name: s3_fingerprint(f"{data_path}/{name}.parquet", "", bucket_block_name)
+            for name in ("train", "val", "test")
+        },
+    )
 
 
 @flow
+@instrumented_flow
 def complete_training_flow(
     mlflow_experiment_name: str,
     bucket_block_name: str = "million-songs-dataset-s3",
@@ -24,36 +95,129 @@ def complete_training_flow(
     min_jaccard_score: float = 0.12,
     max_hamming_loss: float = 0.3,
     register_to_environment: str = "dev",
+    reuse_completed_stages: bool = True,
+    sample_fraction: float | None = None,
+    retrain: bool = False,
 ):
-    ingested_data_path = ingest_flow()
-    preprocessed_data_path = preprocess_flow(
-        bucket_folder=ingested_data_path,
-        s3_bucket_block_name=bucket_block_name,
-        limit=songs_dataset_size_limit,
-    )
-    split_data_path = split_data_flow(
-        bucket_block_name=bucket_block_name,
-        source_data_path=preprocessed_data_path,
-        val_size=val_size,
-        test_size=test_size,
-        seed=seed,
-    )
-    train_flow(
-        mlflow_experiment_name,
-        bucket_block_name=bucket_block_name,
-        data_path=split_data_path,
-        top_k_genres=top_k_genres,
-        valid_tempo_min=valid_tempo_min,
-        valid_tempo_max=valid_tempo_max,
-        impute_missing_values=impute_missing_values,
-        imputer_n_neighbors=imputer_n_neighbors,
-        class_weight=class_weight,
-        seed=seed,
-        register_model_if_accepted=register_model_if_accepted,
-        min_jaccard_score=min_jaccard_score,
-        max_hamming_loss=max_hamming_loss,
-        register_to_environment=register_to_environment,
-    )
+    """Ingest, preprocess, split and train in sequence.
+
+    Every stage is fingerprinted on its parameters and the content of its inputs, and
+    with `reuse_completed_stages` a stage whose fingerprint matches its last completed
+    run reuses that run's output instead of running again. Stages hand their tables
+    to the next stage in memory through a run-scoped artifact store, which persists
+    them to S3 in the background.
+
+    With `retrain`, as when monitoring triggers the flow, the train stage always runs.
+    Its output is the registered model, which fingerprints cannot check, and retraining
+    on unchanged data is the point of the run.
+
+    With `sample_fraction`, every stage works on the same deterministic sample of the
+    songs, for fast development runs. Sampled runs keep their outputs and stage records
+    under `subset/sample-<fraction>`, apart from those of full runs.
+    """
+    logger = get_run_logger()
+    reused = []
+    sample_fraction = resolve_sample_fraction(sample_fraction)
+    # Only part of the fingerprints when sampling, so full runs keep reusing stages
+    sampling = {} if sample_fraction is None else {"sample_fraction": sample_fraction}
+    stages_path = sample_path(STAGES_PATH, sample_fraction)
+
+    with artifact_store():
+        ingested, was_reused = run_stage(
+            "ingest",
+            {"source": url_fingerprint(MSD_SUBSET_URL), **sampling},
+            lambda: ingest_flow(sample_fraction=sample_fraction),
+            lambda path: s3_fingerprint(path, ".h5", bucket_block_name),
+            bucket_block_name,
+            reuse_completed_stages,
+            stages_path,
+        )
+        if was_reused:
+            reused.append("ingest")
+
+        preprocessed, was_reused = run_stage(
+            "preprocess",
+            {
+                "source": ingested.output_fingerprint,
+                "genres_url": DEFAULT_GENRES_URL,
+                "limit": songs_dataset_size_limit,
+                **sampling,
+            },
+            lambda: preprocess_flow(
+                bucket_folder=ingested.output,
+                s3_bucket_block_name=bucket_block_name,
+                limit=songs_dataset_size_limit,
+                sample_fraction=sample_fraction,
+            ),
+            lambda path: s3_fingerprint(path, "", bucket_block_name),
+            bucket_block_name,
+            reuse_completed_stages,
+            stages_path,
+        )
+        if was_reused:
+            reused.append("preprocess")
+
+        split, was_reused = run_stage(
+            "split",
+            {
+                "source": preprocessed.output_fingerprint,
+                "val_size": val_size,
+                "test_size": test_size,
+                "seed": seed,
+                **sampling,
+            },
+            lambda: split_data_flow(
+                bucket_block_name=bucket_block_name,
+                source_data_path=preprocessed.output,
+                val_size=val_size,
+                test_size=test_size,
+                seed=seed,
+                sample_fraction=sample_fraction,
+            ),
+            lambda path: split_output_fingerprint(path, bucket_block_name),
+            bucket_block_name,
+            reuse_completed_stages,
+            stages_path,
+        )
+        if was_reused:
+            reused.append("split")
+
+        train_params = dict(
+            top_k_genres=top_k_genres,
+            valid_tempo_min=valid_tempo_min,
+            valid_tempo_max=valid_tempo_max,
+            impute_missing_values=impute_missing_values,
+            imputer_n_neighbors=imputer_n_neighbors,
+            class_weight=class_weight,
+            seed=seed,
+            register_model_if_accepted=register_model_if_accepted,
+            min_jaccard_score=min_jaccard_score,
+            max_hamming_loss=max_hamming_loss,
+            register_to_environment=register_to_environment,
+        )
+        _, was_reused = run_stage(
+            "train",
+            {
+                "source": split.output_fingerprint,
+                "mlflow_experiment_name": mlflow_experiment_name,
+                **train_params,
+                **sampling,
+            },
+            lambda: train_flow(
+                mlflow_experiment_name,
+                bucket_block_name=bucket_block_name,
+                data_path=split.output,
+                sample_fraction=sample_fraction,
+                **train_params,
+            ),
+            bucket_block_name=bucket_block_name,
+            reuse=reuse_completed_stages and not retrain,
+            stages_path=stages_path,
+        )
+        if was_reused:
+            reused.append("train")
+
+        logger.info(f"Reused stages: {', '.join(reused) if reused else 'none'}")
 
 
 if __name__ == "__main__":
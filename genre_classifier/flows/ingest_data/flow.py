@@ -5,11 +5,21 @@ from prefect import flow, get_run_logger, task
 from prefect_aws import S3Bucket
 from prefect_shell.commands import ShellOperation
 
+from genre_classifier.instrumentation import instrumented, instrumented_flow
+from genre_classifier.sampling import (
+    resolve_sample_fraction,
+    sample_keys,
+    sample_path,
+)
+
+MSD_SUBSET_URL = "http://labrosa.ee.columbia.edu/~dpwe/tmp/millionsongsubset.tar.gz"
+
 
 @task(retries=1, retry_delay_seconds=2)
+@instrumented
 def download_msd_subset(
     target_dir: Path,
-    url: str = "http://labrosa.ee.columbia.edu/~dpwe/tmp/millionsongsubset.tar.gz",
+    url: str = MSD_SUBSET_URL,
 ) -> None:
     """Download the Million Song Dataset's subset used for development purposes.
     These are downloaded to the given target directory, and consist of many h5 files.
@@ -24,6 +34,7 @@ def download_msd_subset(
 
 
 @task
+@instrumented
 def list_files(data_dir: Path) -> None:
     """List the h5 files present in the data directory"""
     h5_files = list(sorted(Path(data_dir).rglob("*.h5")))
@@ -32,26 +43,48 @@ def list_files(data_dir: Path) -> None:
 
 
 @task
+@instrumented
 def upload_to_s3(
     data_dir: Path,
     target_dir: Optional[Path],
     bucket_block_name: str = "million-songs-dataset-s3",
+    sample_fraction: Optional[float] = None,
 ) -> int:
+    """Upload the data directory, or only the h5 files of the sampled songs"""
     logger = get_run_logger()
     bucket = S3Bucket.load(bucket_block_name)
     to_path = str(target_dir) if target_dir is not None else None
-    file_count = bucket.put_directory(local_path=str(data_dir), to_path=to_path)
+    if sample_fraction is None:
+        file_count = bucket.put_directory(local_path=str(data_dir), to_path=to_path)
+    else:
+        h5_files = sorted(str(path) for path in Path(data_dir).rglob("*.h5"))
+        file_count = 0
+        for h5_file in sample_keys(h5_files, sample_fraction):
+            key = Path(h5_file).relative_to(data_dir)
+            if to_path is not None:
+                key = Path(to_path) / key
+            bucket.upload_from_path(h5_file, key.as_posix())
+            file_count += 1
     logger.info(f"Uploaded {file_count} files to {bucket.bucket_name}")
     return file_count
 
 
 @flow(log_prints=True)
-def ingest_flow() -> str:
+@instrumented_flow
+def ingest_flow(sample_fraction: Optional[float] = None) -> str:
+    """Upload the dataset, or with `sample_fraction` the sampled songs to
+    `subset/sample-<fraction>`, and return the folder of the h5 files"""
+    sample_fraction = resolve_sample_fraction(sample_fraction)
     local_data_path = Path("data")
     download_completion = download_msd_subset(local_data_path)
     list_files(local_data_path, wait_for=[download_completion])
-    upload_to_s3(local_data_path, Path("subset"), wait_for=[download_completion])
-    return "subset/MillionSongSubset"
+    upload_to_s3(
+        local_data_path,
+        Path(sample_path("subset", sample_fraction)),
+        sample_fraction=sample_fraction,
+        wait_for=[download_completion],
+    )
+    return sample_path("subset/MillionSongSubset", sample_fraction)
 
 
 if __name__ == "__main__":
@@ -1,54 +1,163 @@
 import datetime
+import json
 import tempfile
+from typing import TYPE_CHECKING
 
 import numpy as np
 import pandas as pd
-from evidently import ColumnMapping
-from evidently.metric_preset import DataDriftPreset
-from evidently.report import Report
-from prefect import flow, get_run_logger, task
-from prefect_aws import S3Bucket
+import pyarrow as pa
+from prefect import flow, get_run_logger, task, unmapped
 
-from genre_classifier.flows.complete_training.flow import complete_training_flow
-from genre_classifier.utils import get_file_uri, read_parquet_data, upload_file_to_s3
+from genre_classifier.drift import (
+    ColumnDrift,
+    DatasetDrift,
+    categorical_drift,
+    sketch_drift,
+)
+from genre_classifier.evaluation import (
+    PerformanceHistory,
+    evaluate_predictions,
+    load_performance_history,
+    save_performance_history,
+)
+from genre_classifier.instrumentation import instrumented, instrumented_flow
+from genre_classifier.model_cache import (
+    get_local_artifact,
+    load_model,
+    resolve_model_version,
+)
+from genre_classifier.sampling import (
+    StratifiedReservoir,
+    resolve_sample_fraction,
+    sample_path,
+)
+from genre_classifier.schema import to_pandas
+from genre_classifier.sketches import (
+    GENRE_COUNTS_FILE,
+    REFERENCE_GENRE_COUNTS_PATH,
+    GenreCounts,
+    PartitionSketch,
+    compute_sketch,
+    get_reference_sketch_path,
+    get_sketch_path,
+    load_sketch,
+    merge_sketches,
+    save_sketch,
+    window_dates,
+)
+from genre_classifier.utils import (
+    iter_parquet_partitions,
+    read_parquet_data,
+    upload_file_to_s3,
+)
+from genre_classifier.watermark import (
+    LATE_RELEASE_LOOKBACK_DAYS,
+    PREDICTIONS_FILE,
+    RELEASES_FILE,
+    list_partition_dates,
+    lookback_start,
+)
+
+if TYPE_CHECKING:
+    from evidently.report import Report
 
-FEATURE_COLS = ["duration", "key", "loudness", "mode", "tempo", "year"]
 NUMERICAL_COLS = ["duration", "loudness", "tempo", "year"]
 BINARY_COLS = ["mode"]
 CATEGORICAL_COLS = ["key"]
 LABEL_COL = "genres"
+REFERENCE_DATA_PATH = "subset/train.parquet"
+GROUND_TRUTH_DATA_PATH = "subset/test.parquet"
+DAILY_DATA_PATH = "subset/daily"
+PREDICTIONS_DATA_PATH = "subset/predictions"
+PERFORMANCE_HISTORY_PATH = "subset/metrics/performance.json"
 
 
 @task
-def get_reference_data(bucket_block_name="million-songs-dataset-s3") -> pd.DataFrame:
-    return read_parquet_data(
-        "subset/train.parquet", bucket_block_name=bucket_block_name
-    )
+@instrumented
+def get_reference_data(
+    bucket_block_name="million-songs-dataset-s3", data_path: str = REFERENCE_DATA_PATH
+) -> pd.DataFrame:
+    return read_parquet_data(data_path, bucket_block_name=bucket_block_name)
+
+
+@task
+@instrumented
+def get_reference_sketch(
+    bucket_block_name="million-songs-dataset-s3", data_path: str = REFERENCE_DATA_PATH
+) -> PartitionSketch:
+    """Load the sketch of the reference data, computing it once if it is missing"""
+    sketch_path = get_reference_sketch_path(data_path)
+    sketch = load_sketch(sketch_path, bucket_block_name)
+    if sketch is None:
+        reference = read_parquet_data(data_path, bucket_block_name=bucket_block_name)
+        sketch = compute_sketch(
+            reference, NUMERICAL_COLS, BINARY_COLS + CATEGORICAL_COLS
+        )
+        save_sketch(sketch, sketch_path, bucket_block_name)
+    return sketch
 
 
 @task
-def get_ground_truth_data(bucket_block_name="million-songs-dataset-s3") -> pd.DataFrame:
-    return read_parquet_data("subset/test.parquet", bucket_block_name=bucket_block_name)
+@instrumented
+def get_ground_truth_data(
+    bucket_block_name="million-songs-dataset-s3",
+    data_path: str = GROUND_TRUTH_DATA_PATH,
+) -> pd.DataFrame:
+    return read_parquet_data(data_path, bucket_block_name=bucket_block_name)
 
 
 @task
+@instrumented
 def calculate_metrics(
     reference: pd.DataFrame,
     ground_truth: pd.DataFrame,
     bucket_block_name="million-songs-dataset-s3",
-) -> Report:
-    bucket = S3Bucket.load(bucket_block_name)
-    all_features = []
-
-    input_files = bucket.list_objects("subset/daily")
-    for input_file_object in input_files:
-        input_file_path = input_file_object["Key"]
-        pred_date = input_file_path.split("/")[-2]
-        features_df = read_parquet_data(input_file_path)
-        features_df["timestamp"] = datetime.datetime.strptime(pred_date, "%Y-%m-%d")
-        all_features.append(features_df)
-
-    all_features_df = pd.concat(all_features)
+    sample_size: int | None = None,
+    seed: int | None = None,
+    daily_data_path: str = DAILY_DATA_PATH,
+) -> "Report":
+    """Build the Evidently drift report over all daily releases.
+
+    With `sample_size`, the report is built from stratified reservoir samples of the
+    reference and current data instead, so the daily files are streamed with fixed
+    memory and the rendered HTML stays small.
+    """
+    from evidently import ColumnMapping
+    from evidently.metric_preset import DataDriftPreset
+    from evidently.report import Report
+
+    dates = list_partition_dates(daily_data_path, RELEASES_FILE, bucket_block_name)
+    partitions = iter_parquet_partitions(
+        [f"{daily_data_path}/{date}/{RELEASES_FILE}" for date in dates],
+        dates,
+        partition_col="timestamp",
+        bucket_block_name=bucket_block_name,
+    )
+
+    if sample_size is not None:
+        strata_cols = BINARY_COLS + CATEGORICAL_COLS
+        current_reservoir = StratifiedReservoir(sample_size, strata_cols, seed)
+        for table in partitions:
+            current_reservoir.add(to_pandas(table))
+        all_features_df = current_reservoir.sample()
+        reference_reservoir = StratifiedReservoir(sample_size, strata_cols, seed)
+        reference_reservoir.add(reference)
+        reference = reference_reservoir.sample()
+        sampling = {
+            "sample_size": sample_size,
+            "strata": strata_cols,
+            "reference_rows": reference_reservoir.rows_seen,
+            "reference_sample_rows": len(reference),
+            "current_rows": current_reservoir.rows_seen,
+            "current_sample_rows": len(all_features_df),
+        }
+    else:
+        all_features_df = to_pandas(
+            pa.concat_tables(list(partitions), promote_options="default")
+        )
+    all_features_df["timestamp"] = pd.to_datetime(
+        all_features_df["timestamp"].astype(str)
+    )
     reference["year"].replace(0, np.nan)
     reference["timestamp"] = datetime.datetime(year=2024, month=1, day=1)
 
@@ -76,6 +185,12 @@ def calculate_metrics(
         report_path = f"{dir}/index.html"
         json_path = f"{dir}/report.json"
         data_drift_report.save_json(json_path)
+        if sample_size is not None:
+            with open(json_path) as f:
+                report_json = json.load(f)
+            report_json["sampling"] = sampling
+            with open(json_path, "w") as f:
+                json.dump(report_json, f)
         data_drift_report.save_html(report_path)
         upload_file_to_s3(
             report_path,
@@ -94,30 +209,286 @@ def calculate_metrics(
 
 
 @task
-def validate_model_performance(report: Report) -> bool:
-    report_dict = report.as_dict()
-    return report_dict["metrics"][0]["result"]["dataset_drift"]
+@instrumented
+def get_partition_sketch(
+    bucket_block_name: str, data_path: str, date: str
+) -> PartitionSketch:
+    """Load the sketch of a daily partition, computing it once if it is missing"""
+    sketch_path = get_sketch_path(data_path, date)
+    sketch = load_sketch(sketch_path, bucket_block_name)
+    if sketch is None:
+        releases = read_parquet_data(
+            f"{data_path}/{date}/{RELEASES_FILE}", bucket_block_name=bucket_block_name
+        )
+        sketch = compute_sketch(
+            releases, NUMERICAL_COLS, BINARY_COLS + CATEGORICAL_COLS
+        )
+        save_sketch(sketch, sketch_path, bucket_block_name)
+    return sketch
+
+
+@task
+@instrumented
+def get_window_sketch(
+    bucket_block_name: str = "million-songs-dataset-s3",
+    data_path: str = DAILY_DATA_PATH,
+    window_days: int = 7,
+) -> PartitionSketch:
+    dates = window_dates(
+        list_partition_dates(data_path, RELEASES_FILE, bucket_block_name), window_days
+    )
+    sketches = get_partition_sketch.map(
+        unmapped(bucket_block_name), unmapped(data_path), dates
+    )
+    return merge_sketches([future.result() for future in sketches])
+
+
+@task
+@instrumented
+def get_model_classes(environment: str = "dev") -> list[str]:
+    mlb = load_model("genre-classifier-multi-label-binarizer", environment)
+    return list(mlb.classes_)
+
+
+@task
+@instrumented
+def evaluate_new_predictions(
+    ground_truth: pd.DataFrame,
+    classes: list[str],
+    bucket_block_name: str = "million-songs-dataset-s3",
+    predictions_data_path: str = PREDICTIONS_DATA_PATH,
+    history_path: str = PERFORMANCE_HISTORY_PATH,
+) -> PerformanceHistory:
+    """Evaluate the prediction partitions that are not in the performance history yet"""
+    logger = get_run_logger()
+    history = load_performance_history(history_path, bucket_block_name)
+    # Listing starts at the last evaluated date, less the window late releases are
+    # scored in, instead of at the first date
+    dates = list_partition_dates(
+        predictions_data_path,
+        PREDICTIONS_FILE,
+        bucket_block_name,
+        lookback_start(max(history.days, default=None), LATE_RELEASE_LOOKBACK_DAYS),
+    )
+    new_dates = [date for date in dates if date not in history.days]
+    logger.info(f"Evaluating predictions of {len(new_dates)} new dates")
+    if not new_dates:
+        return history
+
+    days = dict(history.days)
+    partitions = iter_parquet_partitions(
+        [f"{predictions_data_path}/{date}/{PREDICTIONS_FILE}" for date in new_dates],
+        bucket_block_name=bucket_block_name,
+    )
+    for date, table in zip(new_dates, partitions):
+        days[date] = evaluate_predictions(table.to_pandas(), ground_truth, classes)
+    history = PerformanceHistory(days=days)
+    save_performance_history(history, history_path, bucket_block_name)
+    return history
+
+
+@task
+@instrumented
+def get_training_genre_counts(environment: str = "dev") -> GenreCounts | None:
+    """Counts of the genres the model tagged for `environment` predicted on the
+    validation set, logged by its training run"""
+    from mlflow.exceptions import MlflowException
+
+    model_version = resolve_model_version("genre-classifier-random-forest", environment)
+    try:
+        local_dir = get_local_artifact(
+            model_version,
+            f"runs:/{model_version.run_id}/{REFERENCE_GENRE_COUNTS_PATH}",
+            "val_predictions",
+        )
+    except MlflowException:
+        get_run_logger().warning(
+            f"Model version {model_version.version} has no {REFERENCE_GENRE_COUNTS_PATH}"
+        )
+        return None
+    return GenreCounts.model_validate_json((local_dir / GENRE_COUNTS_FILE).read_text())
+
+
+@task
+@instrumented
+def get_window_genre_counts(
+    bucket_block_name: str = "million-songs-dataset-s3",
+    data_path: str = PREDICTIONS_DATA_PATH,
+    window_days: int = 7,
+) -> GenreCounts:
+    """Merged counts of the predicted genres, written by predict_flow for every date"""
+    dates = window_dates(
+        list_partition_dates(data_path, GENRE_COUNTS_FILE, bucket_block_name),
+        window_days,
+    )
+    counts = [
+        load_sketch(
+            f"{data_path}/{date}/{GENRE_COUNTS_FILE}", bucket_block_name, GenreCounts
+        )
+        for date in dates
+    ]
+    return merge_sketches(counts, GenreCounts())
+
+
+@task
+@instrumented
+def calculate_prediction_drift(
+    training_counts: GenreCounts, window_counts: GenreCounts
+) -> ColumnDrift | None:
+    """Drift of the predicted genres, None when the window has no predictions"""
+    if window_counts.rows == 0:
+        return None
+    return categorical_drift("genres", training_counts.counts, window_counts.counts)
+
+
+@task
+@instrumented
+def calculate_drift(
+    reference_sketch: PartitionSketch, window_sketch: PartitionSketch
+) -> DatasetDrift:
+    return sketch_drift(reference_sketch, window_sketch)
+
+
+@task
+@instrumented
+def validate_model_performance(drift: DatasetDrift) -> bool:
+    return drift.dataset_drift
+
+
+@flow
+@instrumented_flow
+def drift_report_flow(
+    bucket_block_name: str = "million-songs-dataset-s3",
+    sample_size: int | None = None,
+    seed: int | None = 42,
+    sample_fraction: float | None = None,
+):  # -> Report, not annotated since Prefect resolves it, importing Evidently
+    """Render the Evidently data drift report to the static dashboard bucket. With
+    `sample_fraction`, of the data of the sampled runs."""
+    sample_fraction = resolve_sample_fraction(sample_fraction)
+    reference = get_reference_data(
+        bucket_block_name, sample_path(REFERENCE_DATA_PATH, sample_fraction)
+    )
+    ground_truth = get_ground_truth_data(
+        bucket_block_name, sample_path(GROUND_TRUTH_DATA_PATH, sample_fraction)
+    )
+    return calculate_metrics(
+        reference,
+        ground_truth,
+        bucket_block_name=bucket_block_name,
+        sample_size=sample_size,
+        seed=seed,
+        daily_data_path=sample_path(DAILY_DATA_PATH, sample_fraction),
+    )
 
 
 @flow
+@instrumented_flow
 def model_monitoring_flow(
     bucket_block_name: str = "million-songs-dataset-s3",
     trigger_retrain_if_needed: bool = True,
+    drift_window_days: int = 7,
+    generate_report: bool = False,
+    report_sample_size: int | None = None,
+    environment: str = "dev",
+    min_jaccard_score: float | None = None,
+    max_hamming_loss: float | None = None,
+    retrain_on_prediction_drift: bool = False,
+    sample_fraction: float | None = None,
 ) -> bool:
+    """Check the data drift, the performance and the prediction drift of the daily
+    releases, and retrain if needed. With `sample_fraction`, of the data and the
+    predictions of the sampled runs."""
     logger = get_run_logger()
-    reference = get_reference_data(bucket_block_name=bucket_block_name)
-    ground_truth = get_ground_truth_data(bucket_block_name=bucket_block_name)
-    report = calculate_metrics(
-        reference, ground_truth, bucket_block_name=bucket_block_name
+    sample_fraction = resolve_sample_fraction(sample_fraction)
+    predictions_data_path = sample_path(PREDICTIONS_DATA_PATH, sample_fraction)
+    reference_sketch = get_reference_sketch(
+        bucket_block_name, sample_path(REFERENCE_DATA_PATH, sample_fraction)
+    )
+    window_sketch = get_window_sketch(
+        bucket_block_name,
+        sample_path(DAILY_DATA_PATH, sample_fraction),
+        window_days=drift_window_days,
+    )
+    drift = calculate_drift(reference_sketch, window_sketch)
+    if drift.insufficient_data:
+        logger.info(
+            f"No feature values over the last {drift_window_days} days, "
+            "not enough data for feature drift"
+        )
+    for column_drift in drift.columns.values():
+        logger.info(f"Drift over the last {drift_window_days} days: {column_drift}")
+    if generate_report:
+        drift_report_flow(
+            bucket_block_name=bucket_block_name,
+            sample_size=report_sample_size,
+            sample_fraction=sample_fraction,
+        )
+
+    ground_truth = get_ground_truth_data(
+        bucket_block_name, sample_path(GROUND_TRUTH_DATA_PATH, sample_fraction)
+    )
+    history = evaluate_new_predictions(
+        ground_truth,
+        get_model_classes(environment),
+        bucket_block_name,
+        predictions_data_path,
+        sample_path(PERFORMANCE_HISTORY_PATH, sample_fraction),
+    )
+    performance = history.summary(window_dates(list(history.days), drift_window_days))
+    logger.info(f"Performance over the last {drift_window_days} days: {performance}")
+    performance_degraded = (
+        min_jaccard_score is not None
+        and performance["jaccard_score"] < min_jaccard_score
+    ) or (
+        max_hamming_loss is not None and performance["hamming_loss"] > max_hamming_loss
+    )
+
+    training_counts = get_training_genre_counts(environment)
+    prediction_drift = None
+    if training_counts is not None:
+        window_counts = get_window_genre_counts(
+            bucket_block_name, predictions_data_path, window_days=drift_window_days
+        )
+        prediction_drift = calculate_prediction_drift(training_counts, window_counts)
+        if prediction_drift is None:
+            logger.info(
+                f"No predictions over the last {drift_window_days} days, "
+                "not enough data for prediction drift"
+            )
+        else:
+            logger.info(
+                f"Prediction drift over the last {drift_window_days} days "
+                f"({window_counts.rows} rows): {prediction_drift}"
+            )
+    predictions_drifted = (
+        retrain_on_prediction_drift
+        and prediction_drift is not None
+        and prediction_drift.drifted
+    )
+
+    retrain_needed = (
+        validate_model_performance(drift) or performance_degraded or predictions_drifted
     )
-    retrain_needed = validate_model_performance(report)
     if retrain_needed:
-        logger.info("Model should be retrained!")
-        report_url = get_file_uri("subset/metrics_report.html", bucket_block_name)
-        logger.info(f"Full report available at {report_url}")
+        drifted = [column for column, d in drift.columns.items() if d.drifted]
+        logger.info(
+            f"Model should be retrained! Drifted features: {drifted}, "
+            f"performance degraded: {performance_degraded}, "
+            f"predictions drifted: {predictions_drifted}"
+        )
         if trigger_retrain_if_needed:
+            # Training pulls in mlflow, sklearn and h5py, which monitoring does not need
+            from genre_classifier.flows.complete_training.flow import (
+                complete_training_flow,
+            )
+
             logger.info("Triggering complete training run")
-            complete_training_flow(mlflow_experiment_name="automatic-retraining")
+            complete_training_flow(
+                mlflow_experiment_name="automatic-retraining",
+                sample_fraction=sample_fraction,
+                retrain=True,
+            )
     else:
         logger.info("No retrain required")
     return retrain_needed
@@ -1,89 +1,489 @@
-import mlflow
+import json
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
+
+import numpy as np
 import pandas as pd
-from mlflow.client import MlflowClient
-from prefect import flow, get_run_logger, task
+import pyarrow as pa
+import pyarrow.parquet as pq
+from prefect import flow, get_run_logger, task, unmapped
 from prefect_aws import S3Bucket
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import MultiLabelBinarizer
 
-from genre_classifier.preprocess_common import fix_outliers
+from genre_classifier.compact_model import CompactModel
+from genre_classifier.instrumentation import instrumented, instrumented_flow
+from genre_classifier.model_cache import (
+    DEFAULT_REGISTRY_TTL_SECONDS,
+    load_compact_model_cached,
+    load_model,
+    load_model_version,
+    load_run_artifact_model,
+)
+from genre_classifier.postprocess_common import (
+    PREDICTION_COLUMN_TYPES,
+    predictions_to_genres,
+    proba_to_scores,
+    scores_to_columns,
+)
+from genre_classifier.preprocess_common import fix_outliers, fix_outliers_batch
+from genre_classifier.sampling import resolve_sample_fraction, sample_path
+from genre_classifier.schema import to_pandas
+from genre_classifier.sketches import (
+    GENRE_COUNTS_FILE,
+    GenreCounts,
+    count_genres,
+    save_sketch,
+)
 from genre_classifier.utils import (
+    download_file_from_s3,
+    iter_parquet_partitions,
     read_parquet_data,
-    set_aws_credential_env,
+    upload_file_to_s3,
     write_parquet_data,
 )
+from genre_classifier.watermark import (
+    LATE_RELEASE_LOOKBACK_DAYS,
+    PREDICTIONS_FILE,
+    RELEASES_FILE,
+    PredictionWatermark,
+    list_partition_dates,
+    load_watermark,
+    lookback_start,
+    save_watermark,
+)
+
+if TYPE_CHECKING:
+    # sklearn is only needed to unpickle full pipelines, which mlflow imports itself
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import MultiLabelBinarizer
+
+SHADOW_LATENCY_FILE = "latency.json"
 
 
 @task
-def fetch_model(registered_model_name: str, env="production"):
-    set_aws_credential_env("aws-creds")
-    client = MlflowClient("http://127.0.0.1:5000")
+@instrumented
+def fetch_model(
+    registered_model_name: str,
+    env="production",
+    cache_dir: str | None = None,
+    registry_ttl_seconds: float = DEFAULT_REGISTRY_TTL_SECONDS,
+):
+    return load_model(
+        registered_model_name,
+        env,
+        cache_dir=cache_dir,
+        ttl_seconds=registry_ttl_seconds,
+    )
 
-    model = client.get_registered_model(registered_model_name)
-    model_version = [
-        model for model in model.latest_versions if model.tags.get("env") == env
-    ][0]
-    return mlflow.sklearn.load_model(model_version.source)
+
+@task
+@instrumented
+def fetch_compact_model(
+    registered_model_name: str,
+    env="production",
+    cache_dir: str | None = None,
+    registry_ttl_seconds: float = DEFAULT_REGISTRY_TTL_SECONDS,
+) -> CompactModel:
+    """Fetch the array-backed export that was logged alongside the registered model."""
+    return load_compact_model_cached(
+        registered_model_name,
+        env,
+        cache_dir=cache_dir,
+        ttl_seconds=registry_ttl_seconds,
+    )
 
 
 @task
-def get_latest_releases(
-    bucket_block_name, source_data_path, target_data_path
-) -> tuple[pd.DataFrame, str] | None:
-    """Get the latest releases for which predictions were not yet made"""
-    logger = get_run_logger()
+@instrumented
+def fetch_pinned_model(
+    registered_model_name: str, version: str, cache_dir: str | None = None
+):
+    return load_model_version(registered_model_name, version, cache_dir=cache_dir)
 
-    bucket = S3Bucket.load(bucket_block_name)
-    release_directories = list(
-        sorted(
-            [obj["Key"].split("/")[-2] for obj in bucket.list_objects(source_data_path)]
-        )
+
+@task
+@instrumented
+def fetch_pinned_run_model(
+    registered_model_name: str,
+    version: str,
+    artifact_path: str,
+    cache_dir: str | None = None,
+):
+    """Fetch a model logged by the training run of a pinned model version"""
+    return load_run_artifact_model(
+        registered_model_name, version, artifact_path, cache_dir=cache_dir
     )
-    prediction_directories = list(
-        sorted(
-            [obj["Key"].split("/")[-2] for obj in bucket.list_objects(target_data_path)]
+
+
+@task
+@instrumented
+def get_pending_release_dates(
+    bucket_block_name,
+    source_data_path,
+    target_data_path,
+    lookback_days: int = LATE_RELEASE_LOOKBACK_DAYS,
+) -> list[str]:
+    """Get the release dates for which predictions were not yet made, oldest first,
+    including dates of the last `lookback_days` up to the watermark that arrived late"""
+    watermark = load_watermark(target_data_path, bucket_block_name)
+    if watermark is None:
+        get_run_logger().info(
+            "No prediction watermark found, creating it from a full listing"
+        )
+        release_dates = list_partition_dates(
+            source_data_path, RELEASES_FILE, bucket_block_name
+        )
+        prediction_dates = list_partition_dates(
+            target_data_path, PREDICTIONS_FILE, bucket_block_name
         )
+        watermark = PredictionWatermark().advance(prediction_dates, release_dates)
+        save_watermark(watermark, target_data_path, bucket_block_name)
+
+    start_after_date = lookback_start(watermark.last_scored_date, lookback_days)
+    release_dates = list_partition_dates(
+        source_data_path, RELEASES_FILE, bucket_block_name, start_after_date
+    )
+    late_dates = watermark.late_dates(
+        release_dates,
+        list_partition_dates(
+            target_data_path, PREDICTIONS_FILE, bucket_block_name, start_after_date
+        ),
+    )
+    if late_dates:
+        get_run_logger().info(f"Found late release partitions for {late_dates}")
+    return late_dates + watermark.pending_dates(release_dates)
+
+
+@task
+@instrumented
+def update_watermark(
+    scored_dates: list[str], bucket_block_name, source_data_path, target_data_path
+) -> PredictionWatermark:
+    watermark = load_watermark(target_data_path, bucket_block_name)
+    watermark = watermark or PredictionWatermark()
+    release_dates = list_partition_dates(
+        source_data_path, RELEASES_FILE, bucket_block_name, watermark.last_scored_date
     )
+    watermark = watermark.advance(scored_dates, release_dates)
+    # An overlapping run may have saved its progress since the watermark was loaded
+    latest = load_watermark(target_data_path, bucket_block_name)
+    if latest is not None:
+        watermark = watermark.merge(latest, release_dates)
+    save_watermark(watermark, target_data_path, bucket_block_name)
+    get_run_logger().info(f"Predictions complete up to {watermark.last_scored_date}")
+    return watermark
 
-    if len(prediction_directories) == len(release_directories):
-        return None
 
-    latest_date = release_directories[len(prediction_directories)]
-    data_path = f"{source_data_path}/{latest_date}/releases.parquet"
-    logger.info(f"Fetching data for date {latest_date} from path {data_path}")
+@task
+@instrumented
+def read_releases(bucket_block_name, source_data_path, date: str) -> pd.DataFrame:
+    logger = get_run_logger()
+    data_path = f"{source_data_path}/{date}/{RELEASES_FILE}"
+    logger.info(f"Fetching data for date {date} from path {data_path}")
     df = read_parquet_data(data_path, bucket_block_name=bucket_block_name)
     logger.info(f"Found {len(df)} rows")
-    return df, latest_date
+    return df
+
+
+@task
+@instrumented
+def read_backfill_releases(
+    bucket_block_name, source_data_path, dates: list[str]
+) -> list[pd.DataFrame]:
+    """The releases of every date, fetched concurrently by `iter_parquet_partitions`"""
+    partitions = iter_parquet_partitions(
+        [f"{source_data_path}/{date}/{RELEASES_FILE}" for date in dates],
+        bucket_block_name=bucket_block_name,
+    )
+    return [to_pandas(table) for table in partitions]
 
 
 @task
+@instrumented
 def predict(
     df: pd.DataFrame,
-    pipeline: Pipeline,
-    mlb: MultiLabelBinarizer,
+    pipeline: "Pipeline | CompactModel",
+    mlb: "MultiLabelBinarizer",
     valid_tempo_min: float = 70,
     valid_tempo_max: float = 180,
+    output_scores: bool = False,
+    top_k_scores: int | None = None,
+    clean_features: bool = True,
 ) -> pd.DataFrame:
+    """Predict the genres of releases, `clean_features=False` for releases that had
+    their outliers fixed already"""
+    if clean_features:
+        df = fix_outliers(df, valid_tempo_min, valid_tempo_max)
+    index = df.index.rename("song_id")
+    if not output_scores and top_k_scores is None:
+        predictions = pipeline.predict(df)
+        genres = predictions_to_genres(predictions, mlb.classes_, index)
+        return pd.DataFrame({"genres": genres})
+
+    predictions, scores = proba_to_scores(pipeline.predict_proba(df), pipeline.classes_)
+    genres = predictions_to_genres(predictions, mlb.classes_, index)
+    return pd.DataFrame(
+        {
+            "genres": genres,
+            **scores_to_columns(scores, mlb.classes_, index, top_k_scores),
+        }
+    )
+
+
+def preprocessing_key(pipeline: "Pipeline") -> str:
+    """Hash of the fitted steps before the classifier, equal for identical preprocessing"""
+    import joblib
+
+    return joblib.hash(pipeline[:-1])
+
+
+@task
+@instrumented
+def shadow_predict(
+    df: pd.DataFrame,
+    pipelines: dict[str, "Pipeline"],
+    mlbs: dict[str, "MultiLabelBinarizer"],
+    valid_tempo_min: float = 70,
+    valid_tempo_max: float = 180,
+) -> tuple[pd.DataFrame, dict[str, dict]]:
+    """Score several model versions on the same batch, with one genres column per model.
+
+    `fix_outliers` runs once for all models, and pipelines whose steps before the
+    classifier are identical, including their fitted state, transform the batch once.
+    """
+    start = time.perf_counter()
     df = fix_outliers(df, valid_tempo_min, valid_tempo_max)
-    predictions = pipeline.predict(df)
-    predictions_plaintext = mlb.inverse_transform(predictions)
-    prediction_data = []
-    for song_id, pred_genres in zip(df.index, predictions_plaintext):
-        prediction_data.append({"song_id": song_id, "genres": list(pred_genres)})
-    prediction_df = pd.DataFrame(prediction_data).set_index("song_id")
-    return prediction_df
+    index = df.index.rename("song_id")
+    fix_outliers_seconds = time.perf_counter() - start
+
+    features = {}
+    columns = {}
+    latencies = {}
+    for label, pipeline in pipelines.items():
+        key = preprocessing_key(pipeline)
+        shared = key in features
+        start = time.perf_counter()
+        if not shared:
+            features[key] = pipeline[:-1].transform(df)
+        preprocess_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        predictions = pipeline[-1].predict(features[key])
+        predict_seconds = time.perf_counter() - start
+
+        columns[f"genres_{label}"] = predictions_to_genres(
+            predictions, mlbs[label].classes_, index
+        )
+        latencies[label] = {
+            "rows": len(df),
+            "fix_outliers_seconds": fix_outliers_seconds,
+            "preprocess_seconds": preprocess_seconds,
+            "preprocessing_shared": shared,
+            "predict_seconds": predict_seconds,
+        }
+    return pd.DataFrame(columns, index=index), latencies
 
 
 @task
+@instrumented
+def upload_shadow_predictions(
+    df: pd.DataFrame,
+    latencies: dict[str, dict],
+    target_dir: str,
+    bucket_block_name: str = "million-songs-dataset-s3",
+):
+    write_parquet_data(df, f"{target_dir}/{PREDICTIONS_FILE}", bucket_block_name)
+    bucket = S3Bucket.load(bucket_block_name)
+    bucket.write_path(
+        f"{target_dir}/{SHADOW_LATENCY_FILE}", json.dumps(latencies).encode()
+    )
+
+
+def _ordered_bounded_map(
+    executor: ThreadPoolExecutor, fn: Callable, items: Iterable, max_in_flight: int
+) -> Iterator:
+    """Like `executor.map`, but only keeps `max_in_flight` items in memory at a time"""
+    in_flight = deque()
+    for item in items:
+        in_flight.append(executor.submit(fn, item))
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def _with_prediction_types(table: pa.Table) -> pa.Table:
+    """Fix the types of list columns, which are inferred as null lists for empty chunks"""
+    schema = table.schema
+    for name, dtype in PREDICTION_COLUMN_TYPES.items():
+        index = schema.get_field_index(name)
+        if index >= 0:
+            schema = schema.set(index, pa.field(name, dtype))
+    return table.cast(schema)
+
+
+def _empty_predictions(
+    index: pd.Index, output_scores: bool = False, top_k_scores: int | None = None
+) -> pa.Table:
+    """Predictions table without rows, with the columns `predict` would return"""
+    columns = ["genres"]
+    if top_k_scores is not None:
+        columns += ["top_genres", "top_scores"]
+    elif output_scores:
+        columns += ["genre_scores"]
+    empty = pd.DataFrame(
+        {name: pd.Series([], index=index, dtype=object) for name in columns}
+    )
+    return _with_prediction_types(pa.Table.from_pandas(empty))
+
+
+@task
+@instrumented
+def predict_streaming(
+    date: str,
+    pipeline: "Pipeline | CompactModel",
+    mlb: "MultiLabelBinarizer",
+    bucket_block_name: str,
+    source_data_path: str,
+    target_data_path: str,
+    chunk_size: int = 50_000,
+    workers: int = 1,
+    valid_tempo_min: float = 70,
+    valid_tempo_max: float = 180,
+    output_scores: bool = False,
+    top_k_scores: int | None = None,
+) -> int:
+    """Score a release partition chunk by chunk, streaming predictions to Parquet.
+
+    Peak memory is bounded by `chunk_size` times the number of chunks in flight, which
+    is twice the number of `workers` scoring chunks concurrently.
+    """
+    logger = get_run_logger()
+
+    def score(batch: pa.RecordBatch) -> pa.Table:
+        # Clean the features on the Arrow buffers, before converting to pandas
+        batch = fix_outliers_batch(batch, valid_tempo_min, valid_tempo_max)
+        predictions = predict.fn(
+            to_pandas(batch),
+            pipeline,
+            mlb,
+            valid_tempo_min,
+            valid_tempo_max,
+            output_scores,
+            top_k_scores,
+            clean_features=False,
+        )
+        return _with_prediction_types(pa.Table.from_pandas(predictions))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        releases_path = Path(tmpdir) / RELEASES_FILE
+        predictions_path = Path(tmpdir) / PREDICTIONS_FILE
+        download_file_from_s3(
+            f"{source_data_path}/{date}/{RELEASES_FILE}",
+            str(releases_path),
+            bucket_block_name,
+        )
+        releases = pq.ParquetFile(releases_path)
+        batches = releases.iter_batches(batch_size=chunk_size)
+
+        genre_counts = GenreCounts()
+        writer = None
+        with ThreadPoolExecutor(workers) as executor:
+            for table in _ordered_bounded_map(executor, score, batches, 2 * workers):
+                if writer is None:
+                    writer = pq.ParquetWriter(predictions_path, table.schema)
+                writer.write_table(table)
+                genre_counts = genre_counts.merge(count_genres(table["genres"]))
+        if writer is None:
+            # Empty partition, still write a predictions file to mark it as scored
+            index = to_pandas(releases.schema_arrow.empty_table()).index
+            table = _empty_predictions(
+                index.rename("song_id"), output_scores, top_k_scores
+            )
+            writer = pq.ParquetWriter(predictions_path, table.schema)
+        writer.close()
+
+        logger.info(
+            f"Scored {genre_counts.rows} rows for date {date} "
+            f"in chunks of {chunk_size}"
+        )
+        upload_file_to_s3(
+            predictions_path,
+            f"{target_data_path}/{date}/{PREDICTIONS_FILE}",
+            bucket_block_name,
+        )
+    save_sketch(
+        genre_counts,
+        f"{target_data_path}/{date}/{GENRE_COUNTS_FILE}",
+        bucket_block_name,
+    )
+    return genre_counts.rows
+
+
+def split_by_lengths(df: pd.DataFrame, lengths: list[int]) -> list[pd.DataFrame]:
+    offsets = np.cumsum([0] + lengths)
+    return [df.iloc[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+@task
+@instrumented
 def upload_predictions(
     df: pd.DataFrame,
     target_data_path: str,
     bucket_block_name: str = "million-songs-dataset-s3",
 ):
+    """Write a predictions partition, with the counts of its predicted genres next to it"""
     write_parquet_data(df, target_data_path, bucket_block_name)
+    save_sketch(
+        count_genres(df["genres"]),
+        str(PurePosixPath(target_data_path).with_name(GENRE_COUNTS_FILE)),
+        bucket_block_name,
+    )
+
+
+def backfill_predictions(
+    pending_dates: list[str],
+    pipeline: "Pipeline | CompactModel",
+    mlb: "MultiLabelBinarizer",
+    bucket_block_name: str,
+    source_data_path: str,
+    target_data_path: str,
+    valid_tempo_min: float,
+    valid_tempo_max: float,
+    output_scores: bool = False,
+    top_k_scores: int | None = None,
+):
+    """Score all pending dates as one batch, reading and writing partitions concurrently"""
+    logger = get_run_logger()
+    releases = read_backfill_releases(
+        bucket_block_name, source_data_path, pending_dates
+    )
+    lengths = [len(df) for df in releases]
+    logger.info(f"Scoring {sum(lengths)} rows for {len(pending_dates)} dates")
+
+    predictions_data = predict(
+        pd.concat(releases),
+        pipeline,
+        mlb,
+        valid_tempo_min,
+        valid_tempo_max,
+        output_scores,
+        top_k_scores,
+    )
+    upload_futures = upload_predictions.map(
+        split_by_lengths(predictions_data, lengths),
+        [f"{target_data_path}/{date}/{PREDICTIONS_FILE}" for date in pending_dates],
+        unmapped(bucket_block_name),
+    )
+    for future in upload_futures:
+        future.result()
 
 
 @flow(log_prints=True)
+@instrumented_flow
 def predict_flow(
     bucket_block_name: str = "million-songs-dataset-s3",
     source_data_path: str = "subset/daily",
@@ -91,23 +491,135 @@ def predict_flow(
     valid_tempo_min: float = 70,
     valid_tempo_max: float = 180,
     environment: str = "dev",
+    use_compact_model: bool = False,
+    cache_dir: str | None = None,
+    registry_ttl_seconds: float = DEFAULT_REGISTRY_TTL_SECONDS,
+    backfill: bool = False,
+    max_backfill_dates: int | None = None,
+    output_scores: bool = False,
+    top_k_scores: int | None = None,
+    streaming_chunk_size: int | None = None,
+    streaming_workers: int = 1,
+    shadow_model_versions: list[str] | None = None,
+    shadow_data_path: str = "subset/shadow_predictions",
+    sample_fraction: float | None = None,
+    late_release_lookback_days: int = LATE_RELEASE_LOOKBACK_DAYS,
 ):
+    """Predict the genres of the pending daily releases. With `sample_fraction`, of
+    the releases of the sampled runs, under `sample_path`."""
     logger = get_run_logger()
-    releases_data = get_latest_releases(
-        bucket_block_name, source_data_path, target_data_path
+    sample_fraction = resolve_sample_fraction(sample_fraction)
+    source_data_path = sample_path(source_data_path, sample_fraction)
+    target_data_path = sample_path(target_data_path, sample_fraction)
+    shadow_data_path = sample_path(shadow_data_path, sample_fraction)
+    if shadow_model_versions and (backfill or streaming_chunk_size is not None):
+        raise ValueError("Shadow scoring is only supported for single-date runs")
+    pending_dates = get_pending_release_dates(
+        bucket_block_name,
+        source_data_path,
+        target_data_path,
+        late_release_lookback_days,
+    )
+    pending_dates = (
+        pending_dates[:max_backfill_dates] if backfill else pending_dates[:1]
     )
-    if releases_data is None:
+    if not pending_dates:
         logger.info("Predictions are up to date, nothing to do.")
         return
+
+    fetch_classifier = fetch_compact_model if use_compact_model else fetch_model
+    pipeline = fetch_classifier(
+        "genre-classifier-random-forest",
+        environment,
+        cache_dir,
+        registry_ttl_seconds,
+    )
+    mlb = fetch_model(
+        "genre-classifier-multi-label-binarizer",
+        environment,
+        cache_dir,
+        registry_ttl_seconds,
+    )
+
+    if streaming_chunk_size is not None:
+        for date in pending_dates:
+            predict_streaming(
+                date,
+                pipeline,
+                mlb,
+                bucket_block_name,
+                source_data_path,
+                target_data_path,
+                chunk_size=streaming_chunk_size,
+                workers=streaming_workers,
+                valid_tempo_min=valid_tempo_min,
+                valid_tempo_max=valid_tempo_max,
+                output_scores=output_scores,
+                top_k_scores=top_k_scores,
+            )
+    elif backfill:
+        backfill_predictions(
+            pending_dates,
+            pipeline,
+            mlb,
+            bucket_block_name,
+            source_data_path,
+            target_data_path,
+            valid_tempo_min,
+            valid_tempo_max,
+            output_scores,
+            top_k_scores,
+        )
     else:
-        releases, date = releases_data
-    pipeline = fetch_model("genre-classifier-random-forest", environment)
-    mlb = fetch_model("genre-classifier-multi-label-binarizer", environment)
-    predictions_data = predict(
-        releases, pipeline, mlb, valid_tempo_min, valid_tempo_max
+        date = pending_dates[0]
+        releases = read_releases(bucket_block_name, source_data_path, date)
+        predictions_data = predict(
+            releases,
+            pipeline,
+            mlb,
+            valid_tempo_min,
+            valid_tempo_max,
+            output_scores,
+            top_k_scores,
+        )
+        predictions_fullpath = f"{target_data_path}/{date}/{PREDICTIONS_FILE}"
+        upload_predictions(predictions_data, predictions_fullpath, bucket_block_name)
+
+        if shadow_model_versions:
+            labels = [f"v{version}" for version in shadow_model_versions]
+            shadow_pipelines = {
+                label: fetch_pinned_model(
+                    "genre-classifier-random-forest", version, cache_dir
+                )
+                for label, version in zip(labels, shadow_model_versions)
+            }
+            # The binarizer is logged by the run that trained each classifier
+            shadow_mlbs = {
+                label: fetch_pinned_run_model(
+                    "genre-classifier-random-forest",
+                    version,
+                    "multi_label_binarizer",
+                    cache_dir,
+                )
+                for label, version in zip(labels, shadow_model_versions)
+            }
+            shadow_data, latencies = shadow_predict(
+                releases,
+                shadow_pipelines,
+                shadow_mlbs,
+                valid_tempo_min,
+                valid_tempo_max,
+            )
+            shadow_data.insert(0, f"genres_{environment}", predictions_data["genres"])
+            for label, latency in latencies.items():
+                logger.info(f"Shadow model {label}: {latency}")
+            upload_shadow_predictions(
+                shadow_data, latencies, f"{shadow_data_path}/{date}", bucket_block_name
+            )
+
+    update_watermark(
+        pending_dates, bucket_block_name, source_data_path, target_data_path
     )
-    predictions_fullpath = f"{target_data_path}/{date}/predictions.parquet"
-    upload_predictions(predictions_data, predictions_fullpath, bucket_block_name)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,4 @@
 import asyncio
-import tempfile
 from io import BytesIO
 from pathlib import Path
 from typing import Optional
@@ -13,6 +12,15 @@ from prefect.tasks import task_input_hash
 from prefect_aws import S3Bucket
 from pydantic import BaseModel
 
+from genre_classifier.instrumentation import instrumented, instrumented_flow
+from genre_classifier.sampling import (
+    resolve_sample_fraction,
+    sample_keys,
+    sample_path,
+)
+from genre_classifier.schema import SONG_SCHEMA
+from genre_classifier.utils import write_parquet_data
+
 DEFAULT_GENRES_URL = "https://gist.githubusercontent.com/TimovNiedek/0530d9bc36aa3b3e83df4714c9a68c86/raw/5c7d92f81ed2f78ea949238c7563af0626d43b7d/spotify-genres.txt"
 ANALYSIS_FEATURE_NAMES = [
     "danceability",
@@ -27,10 +35,12 @@ MUSICBRAINZ_FEATURE_NAMES = ["year"]
 
 
 @task
+@instrumented
 def list_file_paths(
     bucket_folder: str,
     n: Optional[int] = None,
     bucket_block_name: str = "million-songs-dataset-s3",
+    sample_fraction: Optional[float] = None,
 ) -> list[str]:
     logger = get_run_logger()
     bucket = S3Bucket.load(bucket_block_name)
@@ -39,6 +49,9 @@ def list_file_paths(
         sorted([obj["Key"] for obj in objects if obj["Key"].endswith(".h5")])
     )
     logger.info(f"Found {len(object_keys)} objects")
+    if sample_fraction is not None:
+        object_keys = sample_keys(object_keys, sample_fraction)
+        logger.info(f"Sampled {len(object_keys)} objects")
 
     if n:
         return object_keys[:n]
@@ -50,6 +63,7 @@ def normalize_genre(genre_str) -> str:
 
 
 @task
+@instrumented
 def get_genres_list(url: str = DEFAULT_GENRES_URL) -> list[str]:
     logger = get_run_logger()
     with request.urlopen(url) as f:
@@ -135,22 +149,20 @@ async def get_song_metadata_async(
 
 
 @task(cache_key_fn=task_input_hash)
+@instrumented
 def write_features(
     song_metadata: list[SongMetadata],
     target_path: str = "subset/MillionSongSubset/subset.parquet",
     bucket_block_name: str = "million-songs-dataset-s3",
 ):
     logger = get_run_logger()
-    bucket = S3Bucket.load(bucket_block_name)
     df = pd.DataFrame([dict(song) for song in song_metadata])
     logger.info(df.head())
-
-    with tempfile.NamedTemporaryFile(mode="w") as f:
-        df.to_parquet(f.name)
-        bucket.upload_from_path(from_path=f.name, to_path=target_path)
+    write_parquet_data(df, target_path, bucket_block_name, schema=SONG_SCHEMA)
 
 
 @task(cache_key_fn=task_input_hash)
+@instrumented
 async def get_song_metadata_list(
     h5_paths: str,
     genre_filter: list[str] = [],
@@ -171,12 +183,14 @@ async def get_song_metadata_list(
 
 
 @flow(task_runner=ConcurrentTaskRunner())
+@instrumented_flow
 async def preprocess_flow(
     bucket_folder: str = "subset/MillionSongSubset",
     target_path: str = "subset/MillionSongSubset/subset.parquet",
     s3_bucket_block_name: str = "million-songs-dataset-s3",
     genres_url: str = DEFAULT_GENRES_URL,
     limit: Optional[int] = None,
+    sample_fraction: Optional[float] = None,
 ) -> str:
     """Preprocess the Million Song Dataset.
 
@@ -186,11 +200,17 @@ async def preprocess_flow(
         s3_bucket_block_name (str): The name of the S3 bucket block in Prefect.
         genres_url (str): The URL to the list of genres.
         limit (int): The number of songs to process.
+        sample_fraction (float): The fraction of songs to process, sampled by song id.
+            The output is written under `sample_path(target_path, sample_fraction)`.
 
     Returns:
         str: The path to the preprocessed data relative to the S3 bucket.
     """
-    paths = list_file_paths.submit(bucket_folder, limit, s3_bucket_block_name)
+    sample_fraction = resolve_sample_fraction(sample_fraction)
+    target_path = sample_path(target_path, sample_fraction)
+    paths = list_file_paths.submit(
+        bucket_folder, limit, s3_bucket_block_name, sample_fraction
+    )
     genre_filter = get_genres_list.submit(genres_url)
     song_metas = await get_song_metadata_list(
         paths, genre_filter, bucket_block_name=s3_bucket_block_name
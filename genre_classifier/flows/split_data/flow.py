@@ -3,20 +3,36 @@ import datetime
 import pandas as pd
 from prefect import flow, task
 from prefect.tasks import task_input_hash
-from sklearn.model_selection import train_test_split
 
+from genre_classifier.instrumentation import instrumented, instrumented_flow
+from genre_classifier.sampling import (
+    resolve_sample_fraction,
+    sample_path,
+    sample_songs,
+)
+from genre_classifier.schema import SONG_SCHEMA
+from genre_classifier.sketches import (
+    compute_sketch,
+    get_reference_sketch_path,
+    get_sketch_path,
+    save_sketch,
+)
 from genre_classifier.utils import read_parquet_data, write_parquet_data
 
 
 @task
+@instrumented
 def read_data(
-    data_path: str, bucket_block_name: str = "million-songs-dataset-s3"
+    data_path: str,
+    bucket_block_name: str = "million-songs-dataset-s3",
+    sample_fraction: float | None = None,
 ) -> pd.DataFrame:
     data = read_parquet_data(data_path, bucket_block_name).set_index("song_id")
-    return data
+    return sample_songs(data, sample_fraction)
 
 
 @task(cache_key_fn=task_input_hash)
+@instrumented
 def split_by_release_year(
     df: pd.DataFrame, test_size: float
 ) -> tuple[pd.DataFrame, pd.DataFrame]:
@@ -27,23 +43,28 @@ def split_by_release_year(
 
 
 @task(cache_key_fn=task_input_hash)
+@instrumented
 def random_split(
     df: pd.DataFrame, test_size, seed: int = None
 ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    from sklearn.model_selection import train_test_split
+
     train_data, test_data = train_test_split(df, test_size=test_size, random_state=seed)
     return train_data, test_data
 
 
 @task(cache_key_fn=task_input_hash)
+@instrumented
 def upload_df_to_s3(
     df: pd.DataFrame,
     data_path: str,
     bucket_block_name: str = "million-songs-dataset-s3",
 ) -> None:
-    write_parquet_data(df, data_path, bucket_block_name)
+    write_parquet_data(df, data_path, bucket_block_name, schema=SONG_SCHEMA)
 
 
 @task(cache_key_fn=task_input_hash)
+@instrumented
 def add_daily_releases(
     df: pd.DataFrame,
     start_date: datetime.date,
@@ -59,11 +80,18 @@ def add_daily_releases(
             chunk,
             f"{target_data_path}/{current_date}/releases.parquet",
             bucket_block_name=target_bucket_block_name,
+            schema=SONG_SCHEMA,
+        )
+        save_sketch(
+            compute_sketch(chunk),
+            get_sketch_path(target_data_path, current_date.isoformat()),
+            bucket_block_name=target_bucket_block_name,
         )
         current_date = current_date + datetime.timedelta(days=1)
 
 
 @flow(log_prints=True)
+@instrumented_flow
 def split_data_flow(
     bucket_block_name: str = "million-songs-dataset-s3",
     source_data_path: str = "subset/MillionSongSubset/subset.parquet",
@@ -73,14 +101,25 @@ def split_data_flow(
     seed: int | None = 42,
     new_releases_start_date: datetime.date = datetime.date.today(),
     num_releases_per_day: int = 100,
+    sample_fraction: float | None = None,
 ) -> str:
-    full_data = read_data(source_data_path, bucket_block_name)
+    """Split the preprocessed songs into train, validation and test sets and daily
+    releases. With `sample_fraction`, the sampled songs are split and written under
+    `sample_path(target_data_path, sample_fraction)`."""
+    sample_fraction = resolve_sample_fraction(sample_fraction)
+    target_data_path = sample_path(target_data_path, sample_fraction)
+    full_data = read_data(source_data_path, bucket_block_name, sample_fraction)
     train_val_set, test_set = split_by_release_year(full_data, test_size=test_size)
     train_set, val_set = random_split(
         train_val_set, val_size / (1 - test_size), seed=seed
     )
 
     upload_df_to_s3(train_set, f"{target_data_path}/train.parquet", bucket_block_name)
+    save_sketch(
+        compute_sketch(train_set),
+        get_reference_sketch_path(f"{target_data_path}/train.parquet"),
+        bucket_block_name,
+    )
     upload_df_to_s3(val_set, f"{target_data_path}/val.parquet", bucket_block_name)
     upload_df_to_s3(test_set, f"{target_data_path}/test.parquet", bucket_block_name)
     add_daily_releases(
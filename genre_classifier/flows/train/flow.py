@@ -1,3 +1,4 @@
+import re
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
@@ -14,14 +15,35 @@ from sklearn.metrics import hamming_loss, jaccard_score
 from sklearn.pipeline import Pipeline, make_pipeline
 from sklearn.preprocessing import MinMaxScaler, MultiLabelBinarizer
 
+from genre_classifier.compact_model import (
+    COMPACT_MODEL_ARTIFACT_PATH,
+    COMPACT_MODEL_FILE,
+    export_compact_model,
+)
+from genre_classifier.evaluation import BootstrapEvaluation, bootstrap_evaluation
+from genre_classifier.feature_store import (
+    FeatureSet,
+    feature_set_key,
+    materialize_feature_set,
+    open_feature_set,
+)
+from genre_classifier.fingerprint import s3_fingerprint
+from genre_classifier.instrumentation import instrumented, instrumented_flow
+from genre_classifier.postprocess_common import predictions_to_genres
 from genre_classifier.preprocess_common import fix_outliers as _fix_outliers
+from genre_classifier.sampling import resolve_sample_fraction, sample_songs
+from genre_classifier.schema import FEATURE_COLS
+from genre_classifier.sketches import (
+    REFERENCE_GENRE_COUNTS_PATH,
+    GenreCounts,
+    count_genres,
+)
 from genre_classifier.utils import (
     get_file_uri,
     read_parquet_data,
     set_aws_credential_env,
 )
 
-FEATURE_COLS = ["duration", "key", "loudness", "mode", "tempo", "year"]
 NUMERICAL_COLS = ["duration", "loudness", "tempo", "year"]
 BINARY_COLS = ["mode"]
 CATEGORICAL_COLS = ["key"]
@@ -29,31 +51,45 @@ LABEL_COL = "genres"
 
 
 @task
+@instrumented
 def read_data(
-    data_path: str, bucket_block_name: str = "million-songs-dataset-s3"
+    data_path: str,
+    bucket_block_name: str = "million-songs-dataset-s3",
+    sample_fraction: float | None = None,
 ) -> pd.DataFrame:
     data_uri = get_file_uri(data_path, bucket_block_name=bucket_block_name)
-    data = read_parquet_data(data_path, bucket_block_name)
+    data = sample_songs(
+        read_parquet_data(data_path, bucket_block_name), sample_fraction
+    )
     dataset = mlflow.data.from_pandas(data, source=data_uri, name=Path(data_path).stem)
     mlflow.log_input(dataset, context="training")
     return data
 
 
-@task
-def get_top_genres(df: pd.DataFrame, k=50) -> list[str]:
+def count_top_genres(df: pd.DataFrame, k=50) -> GenreCounts:
     genre_counts = df["genres"].explode().value_counts()
-    genre_names = list(genre_counts.index)
-    top_genre_names = genre_names[:k]
+    return GenreCounts(rows=len(df), counts=genre_counts.iloc[:k].astype(int).to_dict())
+
+
+def log_top_genres(label_counts: GenreCounts):
     with TemporaryDirectory() as tmpdir:
         genres_file = Path(tmpdir) / "genres.txt"
         with open(genres_file, "w") as f:
-            f.write("\n".join(top_genre_names))
+            f.write("\n".join(label_counts.counts))
 
         mlflow.log_artifact(genres_file)
-    return top_genre_names
 
 
 @task
+@instrumented
+def get_top_genres(df: pd.DataFrame, k=50) -> list[str]:
+    label_counts = count_top_genres(df, k)
+    log_top_genres(label_counts)
+    return list(label_counts.counts)
+
+
+@task
+@instrumented
 def filter_top_genres(df: pd.DataFrame, genre_names: list[str]) -> pd.DataFrame:
     df["genres_filtered"] = df["genres"].apply(
         lambda genres: [genre for genre in genres if genre in genre_names]
@@ -66,17 +102,8 @@ def filter_top_genres(df: pd.DataFrame, genre_names: list[str]) -> pd.DataFrame:
     return data_filtered
 
 
-def fix_tempo(tempo_val: float, min_tempo: float, max_tempo: float) -> float:
-    if tempo_val == 0:
-        return np.nan
-    elif tempo_val > max_tempo:
-        return tempo_val / 2
-    elif tempo_val < min_tempo:
-        return tempo_val * 2
-    return tempo_val
-
-
 @task
+@instrumented
 def fix_outliers(
     df: pd.DataFrame, valid_tempo_min: float = 70, valid_tempo_max: float = 180
 ) -> pd.DataFrame:
@@ -90,14 +117,68 @@ def fix_outliers(
 
 
 @task
-def train(
-    train_data: pd.DataFrame,
-    top_genres: list[str],
+@instrumented
+def load_feature_set(
+    bucket_block_name: str = "million-songs-dataset-s3",
+    data_path: str = "subset",
+    top_k_genres=50,
+    valid_tempo_min: float = 70,
+    valid_tempo_max: float = 180,
+    feature_store_dir: str | None = None,
+    sample_fraction: float | None = None,
+) -> FeatureSet:
+    """Open the stored feature set of the train and validation data, or build it with
+    the same steps as `train_flow` if the data or the cleaning parameters changed"""
+    logger = get_run_logger()
+    inputs = {
+        "data": {
+            split: s3_fingerprint(f"{data_path}/{split}.parquet", "", bucket_block_name)
+            for split in ("train", "val")
+        },
+        "feature_columns": FEATURE_COLS,
+        "top_k_genres": top_k_genres,
+        "valid_tempo_min": valid_tempo_min,
+        "valid_tempo_max": valid_tempo_max,
+        "sample_fraction": sample_fraction,
+    }
+    key = feature_set_key(inputs)
+    feature_set = open_feature_set(key, feature_store_dir)
+    if feature_set is not None:
+        logger.info(f"Opened feature set {key[:12]} at {feature_set.path}")
+        return feature_set
+
+    train_data = read_data.fn(
+        data_path + "/train.parquet", bucket_block_name, sample_fraction
+    )
+    val_data = read_data.fn(
+        data_path + "/val.parquet", bucket_block_name, sample_fraction
+    )
+    label_counts = count_top_genres(train_data, k=top_k_genres)
+    top_genres = list(label_counts.counts)
+    mlb = MultiLabelBinarizer(classes=top_genres).fit([top_genres])
+    splits = {}
+    for split, df in (("train", train_data), ("val", val_data)):
+        df = filter_top_genres.fn(df, top_genres)
+        df = fix_outliers.fn(df, valid_tempo_min, valid_tempo_max)
+        splits[split] = (df, mlb.transform(df[LABEL_COL]))
+    feature_set = materialize_feature_set(
+        key, inputs, splits, FEATURE_COLS, top_genres, label_counts, feature_store_dir
+    )
+    logger.info(f"Stored feature set {key[:12]} at {feature_set.path}")
+    return feature_set
+
+
+def select_features(df: pd.DataFrame) -> pd.DataFrame:
+    # Selecting columns copies, also when the frame is a view on a feature set
+    return df if list(df.columns) == FEATURE_COLS else df[FEATURE_COLS]
+
+
+def make_model_pipeline(
     impute_missing_values: bool = True,
     imputer_n_neighbors: int = 5,
     class_weight: str | None = "balanced",
     seed=42,
-) -> tuple[Pipeline, MultiLabelBinarizer]:
+) -> Pipeline:
     pipeline_steps = []
 
     ct = make_column_transformer(
@@ -116,11 +197,40 @@ def train(
     rfc = RandomForestClassifier(random_state=seed, class_weight=class_weight)
     pipeline_steps.append(rfc)
 
-    pipeline = make_pipeline(*pipeline_steps)
+    return make_pipeline(*pipeline_steps)
+
+
+@task
+@instrumented
+def train(
+    train_data: pd.DataFrame,
+    top_genres: list[str],
+    impute_missing_values: bool = True,
+    imputer_n_neighbors: int = 5,
+    class_weight: str | None = "balanced",
+    seed=42,
+    y_train: np.ndarray | None = None,
+) -> tuple[Pipeline, MultiLabelBinarizer]:
+    """Fit the pipeline on the genres of `train_data`, or on `y_train`, labels that are
+    binarised already in the order of `top_genres`."""
+    pipeline = make_model_pipeline(
+        impute_missing_values=impute_missing_values,
+        imputer_n_neighbors=imputer_n_neighbors,
+        class_weight=class_weight,
+        seed=seed,
+    )
     mlb = MultiLabelBinarizer(classes=top_genres)
 
-    X_train = train_data[FEATURE_COLS]
-    y_train = mlb.fit_transform(train_data[LABEL_COL])
+    X_train = select_features(train_data)
+    if y_train is None:
+        labels = train_data[LABEL_COL]
+        y_train = mlb.fit_transform(labels)
+    else:
+        mlb.fit([top_genres])
+        # Only an example for the signature
+        labels = pd.Series(
+            [list(genres) for genres in mlb.inverse_transform(y_train[:100])]
+        )
 
     pipeline = pipeline.fit(X_train, y_train)
     y_pred = pipeline.predict(X_train)
@@ -134,8 +244,9 @@ def train(
     mlflow.sklearn.log_model(
         mlb,
         "multi_label_binarizer",
-        signature=infer_signature(train_data[LABEL_COL], y_train),
+        signature=infer_signature(labels, y_train),
     )
+    log_compact_model(pipeline)
 
     mlflow.log_metric("jaccard_score_train", _jaccard_score)
     mlflow.log_metric("hamming_loss_val", _hamming_loss)
@@ -143,6 +254,13 @@ def train(
     return pipeline, mlb
 
 
+def log_compact_model(pipeline: Pipeline):
+    """Log the pipeline in the memory-mappable array format next to the pickle."""
+    with TemporaryDirectory() as tmpdir:
+        model_path = export_compact_model(pipeline, Path(tmpdir) / COMPACT_MODEL_FILE)
+        mlflow.log_artifact(model_path, COMPACT_MODEL_ARTIFACT_PATH)
+
+
 def register_models(environment: str):
     logger = get_run_logger()
     run = mlflow.active_run()
@@ -162,7 +280,29 @@ def register_models(environment: str):
     logger.info(f"Registered MultiLabelBinarizer with version {new_version.version}")
 
 
+def log_evaluation(evaluation: BootstrapEvaluation, suffix: str = "val"):
+    """Log the metrics with their interval bounds, and the per-genre metrics under
+    `<metric>_<suffix>/<genre>`, the full evaluation is logged as JSON"""
+    metrics = {}
+    for name in ("jaccard_score", "hamming_loss", "macro_f1", "micro_f1"):
+        interval = getattr(evaluation, name)
+        metrics[f"{name}_{suffix}"] = interval.estimate
+        metrics[f"{name}_{suffix}_lower"] = interval.lower
+        metrics[f"{name}_{suffix}_upper"] = interval.upper
+    for genre, genre_evaluation in evaluation.genres.items():
+        # Metric names only allow alphanumerics, spaces and _-./
+        genre = re.sub(r"[^\w\-. /]", "_", genre)
+        for name in ("precision", "recall", "f1"):
+            interval = getattr(genre_evaluation, name)
+            metrics[f"{name}_{suffix}/{genre}"] = interval.estimate
+            metrics[f"{name}_{suffix}_lower/{genre}"] = interval.lower
+            metrics[f"{name}_{suffix}_upper/{genre}"] = interval.upper
+    mlflow.log_metrics(metrics)
+    mlflow.log_dict(evaluation.model_dump(), f"evaluation_{suffix}.json")
+
+
 @task
+@instrumented
 def eval(
     test_data: pd.DataFrame,
     pipeline: Pipeline,
@@ -171,18 +311,48 @@ def eval(
     min_jaccard_score: float,
     max_hamming_loss: float,
     register_to_environment: str,
+    y_true: np.ndarray | None = None,
+    bootstrap_resamples: int = 1000,
+    confidence_level: float = 0.95,
+    gate_on_confidence_bound: bool = False,
+    seed=42,
 ) -> bool:
+    """Evaluate on the validation set with bootstrap confidence intervals, and register
+    the models if they meet the criteria. With `gate_on_confidence_bound`, the criteria
+    apply to the pessimistic bounds, the lower bound of the Jaccard score and the upper
+    bound of the Hamming loss, instead of the point estimates."""
     logger = get_run_logger()
-    X_test = test_data[FEATURE_COLS]
-    y_true = mlb.transform(test_data[LABEL_COL])
+    X_test = select_features(test_data)
+    if y_true is None:
+        y_true = mlb.transform(test_data[LABEL_COL])
     y_pred = pipeline.predict(X_test)
-    _jaccard_score = jaccard_score(y_true, y_pred, average="samples")
-    _hamming_loss = hamming_loss(y_true, y_pred)
-    logger.info(f"jaccard score: {_jaccard_score:.4f}")
-    logger.info(f"hamming loss: {_hamming_loss:.4f}")
+    # Reference for the distribution of predicted genres in monitoring
+    predicted_counts = count_genres(
+        predictions_to_genres(y_pred, mlb.classes_, X_test.index)
+    )
+    mlflow.log_dict(predicted_counts.model_dump(), REFERENCE_GENRE_COUNTS_PATH)
+    evaluation = bootstrap_evaluation(
+        y_true,
+        y_pred,
+        mlb.classes_,
+        n_resamples=bootstrap_resamples,
+        confidence=confidence_level,
+        seed=seed,
+    )
+    for name in ("jaccard_score", "hamming_loss", "macro_f1"):
+        interval = getattr(evaluation, name)
+        logger.info(
+            f"{name.replace('_', ' ')}: {interval.estimate:.4f} "
+            f"({confidence_level:.0%} CI {interval.lower:.4f}-{interval.upper:.4f})"
+        )
+    log_evaluation(evaluation)
 
-    mlflow.log_metric("jaccard_score_val", _jaccard_score)
-    mlflow.log_metric("hamming_loss_val", _hamming_loss)
+    if gate_on_confidence_bound:
+        _jaccard_score = evaluation.jaccard_score.lower
+        _hamming_loss = evaluation.hamming_loss.upper
+    else:
+        _jaccard_score = evaluation.jaccard_score.estimate
+        _hamming_loss = evaluation.hamming_loss.estimate
 
     if not register_model_if_accepted:
         return False
@@ -202,6 +372,7 @@ def log_params(**kwargs):
 
 
 @flow(log_prints=True)
+@instrumented_flow
 def train_flow(
     mlflow_experiment_name: str,
     mlflow_tracking_uri: str = "http://127.0.0.1:5000",
@@ -218,8 +389,15 @@ def train_flow(
     min_jaccard_score: float = 0.12,
     max_hamming_loss: float = 0.3,
     register_to_environment: str = "dev",
+    use_feature_store: bool = False,
+    feature_store_dir: str | None = None,
+    sample_fraction: float | None = None,
+    bootstrap_resamples: int = 1000,
+    confidence_level: float = 0.95,
+    gate_on_confidence_bound: bool = False,
 ):
     set_aws_credential_env()
+    sample_fraction = resolve_sample_fraction(sample_fraction)
 
     mlflow.set_tracking_uri(mlflow_tracking_uri)
     mlflow.set_experiment(mlflow_experiment_name)
@@ -233,18 +411,45 @@ def train_flow(
         imputer_n_neighbors=imputer_n_neighbors,
         class_weight=class_weight,
         seed=seed,
+        bootstrap_resamples=bootstrap_resamples,
+        confidence_level=confidence_level,
+        gate_on_confidence_bound=gate_on_confidence_bound,
     )
+    if sample_fraction is not None:
+        log_params(sample_fraction=sample_fraction)
+
+    if use_feature_store:
+        feature_set = load_feature_set(
+            bucket_block_name,
+            data_path,
+            top_k_genres,
+            valid_tempo_min,
+            valid_tempo_max,
+            feature_store_dir,
+            sample_fraction,
+        )
+        mlflow.log_param("feature_set", feature_set.info.key)
+        log_top_genres(feature_set.info.label_counts)
+        top_genres = feature_set.info.classes
+        train_split, val_split = feature_set["train"], feature_set["val"]
+        train_data, y_train = train_split.X, train_split.y
+        val_data, y_val = val_split.X, val_split.y
+    else:
+        train_data = read_data(
+            data_path + "/train.parquet", bucket_block_name, sample_fraction
+        )
+        val_data = read_data(
+            data_path + "/val.parquet", bucket_block_name, sample_fraction
+        )
 
-    train_data = read_data(data_path + "/train.parquet", bucket_block_name)
-    val_data = read_data(data_path + "/val.parquet", bucket_block_name)
-
-    top_genres = get_top_genres(train_data, k=top_k_genres)
+        top_genres = get_top_genres(train_data, k=top_k_genres)
 
-    train_data = filter_top_genres(train_data, top_genres)
-    train_data = fix_outliers(train_data, valid_tempo_min, valid_tempo_max)
+        train_data = filter_top_genres(train_data, top_genres)
+        train_data = fix_outliers(train_data, valid_tempo_min, valid_tempo_max)
 
-    val_data = filter_top_genres(val_data, top_genres)
-    val_data = fix_outliers(val_data, valid_tempo_min, valid_tempo_max)
+        val_data = filter_top_genres(val_data, top_genres)
+        val_data = fix_outliers(val_data, valid_tempo_min, valid_tempo_max)
+        y_train = y_val = None
 
     trained_pipeline, mlb = train(
         train_data,
@@ -253,6 +458,7 @@ def train_flow(
         imputer_n_neighbors=imputer_n_neighbors,
         class_weight=class_weight,
         seed=seed,
+        y_train=y_train,
     )
 
     eval(
@@ -263,6 +469,11 @@ def train_flow(
         min_jaccard_score=min_jaccard_score,
         max_hamming_loss=max_hamming_loss,
         register_to_environment=register_to_environment,
+        y_true=y_val,
+        bootstrap_resamples=bootstrap_resamples,
+        confidence_level=confidence_level,
+        gate_on_confidence_bound=gate_on_confidence_bound,
+        seed=seed,
     )
     mlflow.end_run()
 
@@ -0,0 +1,248 @@
+"""Wall time, CPU time, memory and throughput of every task of a flow run.
+
+Tasks are wrapped with `instrumented` below their `@task` decorator, and flows with
+`instrumented_flow` below their `@flow` decorator. Every task run logs its metrics as
+a JSON line, and as MLflow metrics when it runs inside an active MLflow run, as the
+tasks of `train_flow` do, with the number of earlier calls of the task in that run as
+their step. At the end of a flow run, the metrics of its tasks are
+published as a Prefect table artifact and logged as a table, and handed to the parent
+flow run, so the summary of `complete_training_flow` covers all of its subflows.
+
+CPU time and peak RSS are process-wide, so they overlap for tasks that run
+concurrently. Rows and bytes are counted on the data frames, series, arrays, Arrow
+tables and lists of records that a task receives and returns.
+"""
+
+import functools
+import inspect
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from prefect import get_run_logger
+from prefect.artifacts import create_table_artifact
+from prefect.context import FlowRunContext, TaskRunContext
+from prefect.runtime import flow_run
+from pydantic import BaseModel
+
+_records: dict[str, list["TaskMetrics"]] = {}
+# Calls of each task per MLflow run, the step of their metrics
+_mlflow_steps: dict[tuple[str, str], int] = {}
+_lock = threading.Lock()
+
+
+class TaskMetrics(BaseModel):
+    task: str
+    wall_seconds: float
+    cpu_seconds: float
+    peak_rss_mb: float
+    rss_growth_mb: float
+    rows_in: int = 0
+    rows_out: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        rows = max(self.rows_in, self.rows_out)
+        return rows / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+
+def _current_flow_run_id() -> str | None:
+    task_run_context = TaskRunContext.get()
+    if task_run_context is not None:
+        flow_run_id = task_run_context.task_run.flow_run_id
+        return str(flow_run_id) if flow_run_id is not None else None
+    flow_run_context = FlowRunContext.get()
+    if flow_run_context is not None and flow_run_context.flow_run is not None:
+        return str(flow_run_context.flow_run.id)
+    return None
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    scale = 1024**2 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def data_size(value) -> tuple[int, int]:
+    """Rows and bytes of a data frame, series, array, table or list of records, or of
+    a collection of them"""
+    if isinstance(value, pd.DataFrame):
+        return len(value), int(value.memory_usage(index=True).sum())
+    if isinstance(value, pd.Series):
+        return len(value), int(value.memory_usage(index=True))
+    if isinstance(value, np.ndarray):
+        return (len(value) if value.ndim else 1), value.nbytes
+    if isinstance(value, (pa.Table, pa.RecordBatch)):
+        return value.num_rows, value.nbytes
+    if isinstance(value, list) and value and isinstance(value[0], BaseModel):
+        # Records, such as the SongMetadata of preprocessing
+        return len(value), 0
+    if isinstance(value, (list, tuple)):
+        sizes = [data_size(item) for item in value]
+        return sum(rows for rows, _ in sizes), sum(size for _, size in sizes)
+    if isinstance(value, dict):
+        return data_size(list(value.values()))
+    return 0, 0
+
+
+class _Measurement:
+    def __init__(self, name: str, args: tuple, kwargs: dict):
+        self.name = name
+        self.rows_in, self.bytes_in = data_size([*args, *kwargs.values()])
+        self.peak_rss_start = peak_rss_mb()
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+
+    def finish(self, result) -> "TaskMetrics":
+        wall_seconds = time.perf_counter() - self.wall_start
+        cpu_seconds = time.process_time() - self.cpu_start
+        peak_rss = peak_rss_mb()
+        rows_out, bytes_out = data_size(result)
+        return TaskMetrics(
+            task=self.name,
+            wall_seconds=wall_seconds,
+            cpu_seconds=cpu_seconds,
+            peak_rss_mb=peak_rss,
+            rss_growth_mb=peak_rss - self.peak_rss_start,
+            rows_in=self.rows_in,
+            rows_out=rows_out,
+            bytes_in=self.bytes_in,
+            bytes_out=bytes_out,
+        )
+
+
+def record_task_metrics(metrics: TaskMetrics) -> None:
+    """Log the metrics of a task run and keep them for the summary of its flow run.
+    Outside of a flow run, e.g. when a task is called through `.fn`, this does nothing.
+    """
+    flow_run_id = _current_flow_run_id()
+    if flow_run_id is None:
+        return
+    with _lock:
+        _records.setdefault(flow_run_id, []).append(metrics)
+    get_run_logger().info(f"Task metrics {metrics.model_dump_json()}")
+
+    # A run can only be active if mlflow was imported already
+    mlflow = sys.modules.get("mlflow")
+    run = mlflow.active_run() if mlflow is not None else None
+    if run is not None:
+        # Repeated calls of a task are logged as steps, instead of overwriting each other
+        with _lock:
+            step = _mlflow_steps.get((run.info.run_id, metrics.task), 0)
+            _mlflow_steps[(run.info.run_id, metrics.task)] = step + 1
+        mlflow.log_metrics(
+            {
+                f"{metrics.task}.{key}": value
+                for key, value in metrics.model_dump(exclude={"task"}).items()
+            },
+            step=step,
+        )
+
+
+def instrumented(fn):
+    """Record the metrics of every call of a task function"""
+    if inspect.iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            measurement = _Measurement(fn.__name__, args, kwargs)
+            result = await fn(*args, **kwargs)
+            record_task_metrics(measurement.finish(result))
+            return result
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        measurement = _Measurement(fn.__name__, args, kwargs)
+        result = fn(*args, **kwargs)
+        record_task_metrics(measurement.finish(result))
+        return result
+
+    return wrapper
+
+
+def format_summary(records: list[TaskMetrics]) -> str:
+    lines = [
+        f"{'task':<28} {'wall s':>8} {'cpu s':>8} {'peak MB':>9} {'+MB':>7} "
+        f"{'rows in':>9} {'rows out':>9} {'rows/s':>10}"
+    ]
+    for m in records:
+        lines.append(
+            f"{m.task:<28} {m.wall_seconds:8.2f} {m.cpu_seconds:8.2f} "
+            f"{m.peak_rss_mb:9.1f} {m.rss_growth_mb:7.1f} {m.rows_in:9d} "
+            f"{m.rows_out:9d} {m.rows_per_second:10.0f}"
+        )
+    return "\n".join(lines)
+
+
+def _collect_flow_run_records() -> list[TaskMetrics]:
+    """Take the metrics of the tasks of the current flow run, log them as a table and
+    hand them to the parent flow run"""
+    with _lock:
+        records = _records.pop(_current_flow_run_id(), [])
+    if not records:
+        return records
+
+    get_run_logger().info(f"Task metrics summary\n{format_summary(records)}")
+    parent_flow_run_id = flow_run.parent_flow_run_id
+    if parent_flow_run_id is not None:
+        with _lock:
+            _records.setdefault(str(parent_flow_run_id), []).extend(records)
+    return records
+
+
+def _table_artifact(records: list[TaskMetrics]) -> dict:
+    flow_name = flow_run.flow_name.replace("_", "-").lower()
+    return dict(
+        table=[
+            {**m.model_dump(), "rows_per_second": m.rows_per_second} for m in records
+        ],
+        key=f"task-metrics-{flow_name}",
+        description=f"Task metrics of flow run {flow_run.name}",
+    )
+
+
+def summarize_flow_run() -> list[TaskMetrics]:
+    """Publish the metrics of the tasks of the current flow run"""
+    records = _collect_flow_run_records()
+    if records:
+        create_table_artifact(**_table_artifact(records))
+    return records
+
+
+async def asummarize_flow_run() -> list[TaskMetrics]:
+    """`summarize_flow_run` for async flows, where the artifact has to be awaited"""
+    records = _collect_flow_run_records()
+    if records:
+        await create_table_artifact(**_table_artifact(records))
+    return records
+
+
+def instrumented_flow(fn):
+    """Summarize the task metrics at the end of every run of a flow function"""
+    if inspect.iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                await asummarize_flow_run()
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            summarize_flow_run()
+
+    return wrapper
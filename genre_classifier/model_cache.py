@@ -0,0 +1,269 @@
+"""Local cache of registered models, keyed by registered model name and version.
+
+The registry is only consulted when the cached pointer for a (name, env) pair is older
+than a TTL, artifacts are only downloaded when the resolved version changes, and loaded
+models are kept in an in-process LRU so long-lived workers do not unpickle them again.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from functools import lru_cache
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from genre_classifier.compact_model import (
+    COMPACT_MODEL_ARTIFACT_PATH,
+    COMPACT_MODEL_FILE,
+    CompactModel,
+    load_compact_model,
+)
+from genre_classifier.utils import set_aws_credential_env
+
+DEFAULT_TRACKING_URI = "http://127.0.0.1:5000"
+DEFAULT_CACHE_DIR = os.environ.get(
+    "GENRE_CLASSIFIER_MODEL_CACHE", "~/.cache/genre-classifier/models"
+)
+DEFAULT_REGISTRY_TTL_SECONDS = 300.0
+COMPLETE_MARKER = ".complete"
+
+
+class CachedModelVersion(BaseModel):
+    name: str
+    version: str
+    source: str
+    run_id: str
+    checked_at: float
+
+
+def get_cache_dir(cache_dir: Path | str | None = None) -> Path:
+    return Path(cache_dir or DEFAULT_CACHE_DIR).expanduser()
+
+
+def _pointer_path(cache_dir: Path, registered_model_name: str, env: str) -> Path:
+    return cache_dir / registered_model_name / f"{env}.json"
+
+
+def _write_atomic(path: Path, content: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=path.parent, delete=False, suffix=".tmp"
+    ) as f:
+        f.write(content)
+    os.replace(f.name, path)
+
+
+def fetch_registered_version(
+    registered_model_name: str,
+    env: str = "production",
+    tracking_uri: str = DEFAULT_TRACKING_URI,
+) -> CachedModelVersion:
+    """Look up the latest version of a registered model tagged with `env`."""
+    from mlflow.client import MlflowClient
+
+    set_aws_credential_env("aws-creds")
+    client = MlflowClient(tracking_uri)
+
+    model = client.get_registered_model(registered_model_name)
+    model_version = [
+        model for model in model.latest_versions if model.tags.get("env") == env
+    ][0]
+    return CachedModelVersion(
+        name=registered_model_name,
+        version=str(model_version.version),
+        source=model_version.source,
+        run_id=model_version.run_id,
+        checked_at=time.time(),
+    )
+
+
+def fetch_model_version(
+    registered_model_name: str,
+    version: str,
+    tracking_uri: str = DEFAULT_TRACKING_URI,
+) -> CachedModelVersion:
+    """Look up a specific version of a registered model."""
+    from mlflow.client import MlflowClient
+
+    set_aws_credential_env("aws-creds")
+    client = MlflowClient(tracking_uri)
+
+    model_version = client.get_model_version(registered_model_name, version)
+    return CachedModelVersion(
+        name=registered_model_name,
+        version=str(model_version.version),
+        source=model_version.source,
+        run_id=model_version.run_id,
+        checked_at=time.time(),
+    )
+
+
+def resolve_model_version(
+    registered_model_name: str,
+    env: str = "production",
+    tracking_uri: str = DEFAULT_TRACKING_URI,
+    cache_dir: Path | str | None = None,
+    ttl_seconds: float = DEFAULT_REGISTRY_TTL_SECONDS,
+) -> CachedModelVersion:
+    """Return the model version for `env`, re-checking the registry only after the TTL."""
+    pointer_path = _pointer_path(get_cache_dir(cache_dir), registered_model_name, env)
+    if pointer_path.exists():
+        cached = CachedModelVersion.model_validate_json(pointer_path.read_text())
+        if time.time() - cached.checked_at < ttl_seconds:
+            return cached
+
+    model_version = fetch_registered_version(registered_model_name, env, tracking_uri)
+    _write_atomic(pointer_path, model_version.model_dump_json())
+    return model_version
+
+
+def resolve_pinned_version(
+    registered_model_name: str,
+    version: str,
+    tracking_uri: str = DEFAULT_TRACKING_URI,
+    cache_dir: Path | str | None = None,
+) -> CachedModelVersion:
+    """Return a pinned model version. Versions are immutable, so it is looked up once."""
+    pointer_path = (
+        get_cache_dir(cache_dir)
+        / registered_model_name
+        / "versions"
+        / f"{version}.json"
+    )
+    if pointer_path.exists():
+        return CachedModelVersion.model_validate_json(pointer_path.read_text())
+
+    model_version = fetch_model_version(registered_model_name, version, tracking_uri)
+    _write_atomic(pointer_path, model_version.model_dump_json())
+    return model_version
+
+
+def get_local_artifact(
+    model_version: CachedModelVersion,
+    artifact_uri: str,
+    artifact_name: str,
+    cache_dir: Path | str | None = None,
+    tracking_uri: str = DEFAULT_TRACKING_URI,
+) -> Path:
+    """Download an artifact of a model version once and return its local path."""
+    version_dir = get_cache_dir(cache_dir) / model_version.name / model_version.version
+    target_dir = version_dir / artifact_name
+    if (target_dir / COMPLETE_MARKER).exists():
+        return target_dir
+
+    import mlflow
+
+    set_aws_credential_env("aws-creds")
+    version_dir.mkdir(parents=True, exist_ok=True)
+    download_dir = Path(tempfile.mkdtemp(dir=version_dir, prefix=".download-"))
+    try:
+        mlflow.artifacts.download_artifacts(
+            artifact_uri, dst_path=str(download_dir), tracking_uri=tracking_uri
+        )
+        (download_dir / COMPLETE_MARKER).write_text(
+            json.dumps({"artifact_uri": artifact_uri, "downloaded_at": time.time()})
+        )
+        try:
+            download_dir.rename(target_dir)
+        except OSError:
+            # Another process finished the same download first
+            if not (target_dir / COMPLETE_MARKER).exists():
+                raise
+    finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+    return target_dir
+
+
+@lru_cache(maxsize=8)
+def _load_sklearn_model(model_path: str):
+    import mlflow.sklearn
+
+    return mlflow.sklearn.load_model(model_path)
+
+
+@lru_cache(maxsize=8)
+def _load_compact_model(model_path: str) -> CompactModel:
+    return load_compact_model(model_path)
+
+
+def _load_model_version(
+    model_version: CachedModelVersion,
+    tracking_uri: str = DEFAULT_TRACKING_URI,
+    cache_dir: Path | str | None = None,
+):
+    artifact_name = Path(model_version.source).name
+    local_dir = get_local_artifact(
+        model_version, model_version.source, artifact_name, cache_dir, tracking_uri
+    )
+    return _load_sklearn_model(str(local_dir / artifact_name))
+
+
+def load_model(
+    registered_model_name: str,
+    env: str = "production",
+    tracking_uri: str = DEFAULT_TRACKING_URI,
+    cache_dir: Path | str | None = None,
+    ttl_seconds: float = DEFAULT_REGISTRY_TTL_SECONDS,
+):
+    model_version = resolve_model_version(
+        registered_model_name, env, tracking_uri, cache_dir, ttl_seconds
+    )
+    return _load_model_version(model_version, tracking_uri, cache_dir)
+
+
+def load_model_version(
+    registered_model_name: str,
+    version: str,
+    tracking_uri: str = DEFAULT_TRACKING_URI,
+    cache_dir: Path | str | None = None,
+):
+    model_version = resolve_pinned_version(
+        registered_model_name, version, tracking_uri, cache_dir
+    )
+    return _load_model_version(model_version, tracking_uri, cache_dir)
+
+
+def load_run_artifact_model(
+    registered_model_name: str,
+    version: str,
+    artifact_path: str,
+    tracking_uri: str = DEFAULT_TRACKING_URI,
+    cache_dir: Path | str | None = None,
+):
+    """Load a model logged by the run that produced a pinned model version.
+
+    Used for models logged next to the classifier, such as the multi-label binarizer,
+    whose own registry versions need not match the classifier's.
+    """
+    model_version = resolve_pinned_version(
+        registered_model_name, version, tracking_uri, cache_dir
+    )
+    artifact_uri = f"runs:/{model_version.run_id}/{artifact_path}"
+    local_dir = get_local_artifact(
+        model_version, artifact_uri, artifact_path, cache_dir, tracking_uri
+    )
+    return _load_sklearn_model(str(local_dir / artifact_path))
+
+
+def load_compact_model_cached(
+    registered_model_name: str,
+    env: str = "production",
+    tracking_uri: str = DEFAULT_TRACKING_URI,
+    cache_dir: Path | str | None = None,
+    ttl_seconds: float = DEFAULT_REGISTRY_TTL_SECONDS,
+) -> CompactModel:
+    model_version = resolve_model_version(
+        registered_model_name, env, tracking_uri, cache_dir, ttl_seconds
+    )
+    artifact_uri = f"runs:/{model_version.run_id}/{COMPACT_MODEL_ARTIFACT_PATH}/{COMPACT_MODEL_FILE}"
+    local_dir = get_local_artifact(
+        model_version,
+        artifact_uri,
+        COMPACT_MODEL_ARTIFACT_PATH,
+        cache_dir,
+        tracking_uri,
+    )
+    return _load_compact_model(str(local_dir / COMPACT_MODEL_FILE))
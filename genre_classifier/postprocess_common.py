@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+PREDICTION_COLUMN_TYPES = {
+    "genres": pa.list_(pa.string()),
+    "genre_scores": pa.list_(pa.float32()),
+    "top_genres": pa.list_(pa.string()),
+    "top_scores": pa.list_(pa.float32()),
+}
+
+
+def _list_series(values: np.ndarray, offsets: np.ndarray, index: pd.Index) -> pd.Series:
+    list_array = pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), values)
+    return pd.Series(list_array.to_numpy(zero_copy_only=False), index=index)
+
+
+def _matrix_series(matrix: np.ndarray, index: pd.Index) -> pd.Series:
+    offsets = np.arange(matrix.shape[0] + 1) * matrix.shape[1]
+    return _list_series(pa.array(matrix.ravel()), offsets, index)
+
+
+def predictions_to_genres(
+    predictions: np.ndarray, classes: np.ndarray, index: pd.Index
+) -> pd.Series:
+    """Turn a binary prediction matrix into a column with the list of genres per row.
+
+    Equivalent to `MultiLabelBinarizer.inverse_transform`, without per-row Python work.
+    """
+    predictions = np.asarray(predictions, dtype=bool)
+    rows, cols = np.nonzero(predictions)
+    offsets = np.zeros(len(predictions) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(predictions)), out=offsets[1:])
+    return _list_series(pa.array(np.asarray(classes)[cols]), offsets, index)
+
+
+def proba_to_scores(
+    probas: list[np.ndarray] | np.ndarray, model_classes: list[np.ndarray]
+) -> tuple[np.ndarray, np.ndarray]:
+    """Split per-output class probabilities into hard predictions and positive scores.
+
+    Hard predictions follow the argmax rule of the classifier's `predict`, the scores
+    are the probability of the positive class for each genre, shape (n, n_genres).
+    """
+    if isinstance(probas, np.ndarray):
+        probas, model_classes = [probas], [model_classes]
+
+    n_samples = probas[0].shape[0]
+    predictions = np.empty((n_samples, len(probas)), dtype=np.int64)
+    scores = np.zeros((n_samples, len(probas)), dtype=np.float32)
+    for k, (proba, output_classes) in enumerate(zip(probas, model_classes)):
+        predictions[:, k] = output_classes[proba.argmax(axis=1)]
+        positive = np.flatnonzero(output_classes == 1)
+        if positive.size:
+            scores[:, k] = proba[:, positive[0]]
+    return predictions, scores
+
+
+def scores_to_columns(
+    scores: np.ndarray,
+    classes: np.ndarray,
+    index: pd.Index,
+    top_k: int | None = None,
+) -> dict[str, pd.Series]:
+    """Compact score columns: all per-genre scores, or the top-k genres with scores."""
+    if top_k is None:
+        return {"genre_scores": _matrix_series(scores, index)}
+
+    top_k = min(top_k, scores.shape[1])
+    top_idx = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    order = np.argsort(-np.take_along_axis(scores, top_idx, axis=1), axis=1)
+    top_idx = np.take_along_axis(top_idx, order, axis=1)
+    return {
+        "top_genres": _matrix_series(np.asarray(classes)[top_idx], index),
+        "top_scores": _matrix_series(
+            np.take_along_axis(scores, top_idx, axis=1), index
+        ),
+    }
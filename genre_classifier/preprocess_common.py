@@ -1,13 +1,83 @@
+"""Feature cleaning shared by training, batch prediction and the online path.
+
+The kernels work on NumPy buffers, in blocks that fit in the CPU cache, and write into
+a new array, so the input is never modified. `fix_outliers` applies them to a data
+frame and `fix_outliers_batch` to an Arrow record batch or table.
+"""
+
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+
+# Rows per block, so the temporaries of a block stay in the L2 cache
+BLOCK_ROWS = 1 << 16
+
+
+def _as_float_array(values) -> np.ndarray:
+    if isinstance(values, (pa.Array, pa.ChunkedArray)):
+        # Nulls become NaN
+        values = values.to_numpy(zero_copy_only=False)
+    return np.asarray(values, dtype=np.float64)
+
+
+def clean_tempo(
+    tempo, valid_tempo_min: float = 70, valid_tempo_max: float = 180
+) -> np.ndarray:
+    """Tempos below half the valid range or above twice it become NaN, the remaining
+    tempos below the range are doubled and those above it halved"""
+    tempo = _as_float_array(tempo)
+    out = np.empty_like(tempo)
+    for start in range(0, len(tempo), BLOCK_ROWS):
+        t = tempo[start : start + BLOCK_ROWS]
+        o = out[start : start + BLOCK_ROWS]
+        np.copyto(o, t)
+        invalid = t < valid_tempo_min / 2
+        invalid |= t > valid_tempo_max * 2
+        np.copyto(o, np.nan, where=invalid)
+        np.multiply(o, 2, out=o, where=o < valid_tempo_min)
+        np.divide(o, 2, out=o, where=o > valid_tempo_max)
+    return out
+
+
+def clean_year(year) -> np.ndarray:
+    """Year 0 means unknown and becomes NaN"""
+    year = _as_float_array(year)
+    out = np.empty_like(year)
+    for start in range(0, len(year), BLOCK_ROWS):
+        y = year[start : start + BLOCK_ROWS]
+        o = out[start : start + BLOCK_ROWS]
+        np.copyto(o, y)
+        np.copyto(o, np.nan, where=y == 0)
+    return out
 
 
 def fix_outliers(
     df: pd.DataFrame, valid_tempo_min: float = 70, valid_tempo_max: float = 180
 ) -> pd.DataFrame:
-    df["year"] = df["year"].replace(0, np.nan)
-    df.loc[df["tempo"] < valid_tempo_min / 2, "tempo"] = np.nan
-    df.loc[df["tempo"] > valid_tempo_max * 2, "tempo"] = np.nan
-    df.loc[df["tempo"] < valid_tempo_min, "tempo"] *= 2
-    df.loc[df["tempo"] > valid_tempo_max, "tempo"] /= 2
+    """Copy of `df` with the year and tempo columns cleaned, `df` is left as is"""
+    # A shallow copy shares the other columns, assigning replaces the cleaned ones
+    df = df.copy(deep=False)
+    df["year"] = clean_year(df["year"].to_numpy())
+    df["tempo"] = clean_tempo(df["tempo"].to_numpy(), valid_tempo_min, valid_tempo_max)
     return df
+
+
+def fix_outliers_batch(
+    batch: pa.RecordBatch | pa.Table,
+    valid_tempo_min: float = 70,
+    valid_tempo_max: float = 180,
+) -> pa.RecordBatch | pa.Table:
+    """`fix_outliers` for Arrow data. Cleaned values that are NaN become nulls, the
+    other columns and the schema metadata are kept."""
+    columns = {
+        "year": clean_year(batch.column("year")),
+        "tempo": clean_tempo(batch.column("tempo"), valid_tempo_min, valid_tempo_max),
+    }
+    schema, arrays = batch.schema, list(batch.columns)
+    for name, values in columns.items():
+        i = schema.get_field_index(name)
+        schema = schema.set(i, pa.field(name, pa.float64()))
+        arrays[i] = pa.array(values, from_pandas=True)
+    if isinstance(batch, pa.Table):
+        return pa.Table.from_arrays(arrays, schema=schema)
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
@@ -0,0 +1,146 @@
+"""Samples of the data: fixed-size samples of data that is streamed one data frame at a
+time, and the deterministic song samples of the development mode.
+
+In development mode, every flow keeps only the songs whose hashed song id falls below
+the sample fraction, so ingest, preprocessing, the split, training and monitoring all
+work on the same songs without coordinating, and the sample is spread over the whole
+dataset rather than taken from the first directories. Samples are nested: a song that
+is in the sample at some fraction is in the sample at every larger fraction. Set the
+fraction per flow with `sample_fraction`, or for all flows with
+`GENRE_CLASSIFIER_SAMPLE_FRACTION`. Sampled runs write their outputs, and monitoring
+reads them, under `sample_path`, apart from the outputs of full runs.
+"""
+
+import hashlib
+import os
+from pathlib import PurePosixPath
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+KEY_COL = "_sample_key"
+DEFAULT_SAMPLE_FRACTION = os.environ.get("GENRE_CLASSIFIER_SAMPLE_FRACTION")
+
+
+def allocate(counts: dict, sample_size: int) -> dict:
+    """Split `sample_size` over strata proportionally to their counts (largest remainder)"""
+    total = sum(counts.values())
+    if total <= sample_size:
+        return dict(counts)
+    quotas = {stratum: count * sample_size / total for stratum, count in counts.items()}
+    allocation = {stratum: int(quota) for stratum, quota in quotas.items()}
+    remainders = sorted(
+        quotas, key=lambda stratum: quotas[stratum] - allocation[stratum], reverse=True
+    )
+    for stratum in remainders[: sample_size - sum(allocation.values())]:
+        allocation[stratum] += 1
+    return allocation
+
+
+class StratifiedReservoir:
+    """Stratified sample of a stream of data frames, with proportional allocation.
+
+    Every row gets a uniform random key, and each stratum keeps the rows with the
+    `sample_size` smallest keys, which is a uniform sample of the stratum at any point
+    in the stream. The final sample takes the rows with the smallest keys from every
+    stratum, allocated proportionally to the number of rows seen per stratum. Memory is
+    bounded by `sample_size` rows per stratum, whatever the length of the stream.
+    """
+
+    def __init__(
+        self, sample_size: int, strata_cols: list[str], seed: int | None = None
+    ):
+        self.sample_size = sample_size
+        self.strata_cols = strata_cols
+        self.rows_seen = 0
+        self._rng = np.random.default_rng(seed)
+        self._counts: dict = {}
+        self._reservoirs: dict[tuple, pd.DataFrame] = {}
+
+    def add(self, df: pd.DataFrame):
+        df = df.assign(**{KEY_COL: self._rng.random(len(df))})
+        self.rows_seen += len(df)
+        for stratum, group in df.groupby(self.strata_cols, dropna=False, sort=False):
+            self._counts[stratum] = self._counts.get(stratum, 0) + len(group)
+            if stratum in self._reservoirs:
+                group = pd.concat([self._reservoirs[stratum], group])
+            self._reservoirs[stratum] = group.nsmallest(self.sample_size, KEY_COL)
+
+    def sample(self) -> pd.DataFrame:
+        if not self._reservoirs:
+            return pd.DataFrame()
+        allocation = allocate(self._counts, self.sample_size)
+        return pd.concat(
+            [
+                reservoir.nsmallest(allocation[stratum], KEY_COL)
+                for stratum, reservoir in self._reservoirs.items()
+            ]
+        ).drop(columns=KEY_COL)
+
+
+def resolve_sample_fraction(sample_fraction: float | None = None) -> float | None:
+    """The fraction of songs to keep, or None to keep all of them"""
+    if sample_fraction is None and DEFAULT_SAMPLE_FRACTION:
+        sample_fraction = float(DEFAULT_SAMPLE_FRACTION)
+    if sample_fraction is None or sample_fraction >= 1:
+        return None
+    if sample_fraction <= 0:
+        raise ValueError(f"Sample fraction must be positive, got {sample_fraction}")
+    return sample_fraction
+
+
+def sample_path(path: str, sample_fraction: float | None) -> str:
+    """Where runs with `sample_fraction` keep `path`: under `sample-<fraction>` in its
+    top folder, e.g. `subset/sample-0.1/train.parquet` for `subset/train.parquet`"""
+    if sample_fraction is None:
+        return path
+    top, _, rest = path.partition("/")
+    prefix = f"{top}/sample-{sample_fraction:g}"
+    return f"{prefix}/{rest}" if rest else prefix
+
+
+def song_id_of(key: str | bytes) -> str:
+    """The song id of a song id, or of the object key of a song's .h5 file"""
+    if isinstance(key, bytes):
+        key = key.decode()
+    return PurePosixPath(key).stem
+
+
+def sample_position(song_id: str) -> float:
+    """Position of a song in [0, 1), uniform over songs and equal in every process"""
+    digest = hashlib.blake2b(song_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2**64
+
+
+def sample_mask(keys: Iterable, sample_fraction: float | None) -> np.ndarray:
+    """Which of the song ids or object keys are in the sample"""
+    keys = list(keys)
+    if sample_fraction is None:
+        return np.ones(len(keys), dtype=bool)
+    return np.fromiter(
+        (sample_position(song_id_of(key)) < sample_fraction for key in keys),
+        dtype=bool,
+        count=len(keys),
+    )
+
+
+def sample_keys(keys: Iterable[str], sample_fraction: float | None) -> list[str]:
+    keys = list(keys)
+    return [key for key, keep in zip(keys, sample_mask(keys, sample_fraction)) if keep]
+
+
+def sample_songs(df: pd.DataFrame, sample_fraction: float | None) -> pd.DataFrame:
+    """Rows of the sampled songs, by the song_id index or column"""
+    if sample_fraction is None:
+        return df
+    song_ids = df.index if df.index.name == "song_id" else df["song_id"]
+    return df[sample_mask(song_ids, sample_fraction)]
+
+
+def sample_table(table: pa.Table, sample_fraction: float | None) -> pa.Table:
+    if sample_fraction is None:
+        return table
+    song_ids = table.column("song_id").to_pylist()
+    return table.filter(pa.array(sample_mask(song_ids, sample_fraction)))
@@ -0,0 +1,68 @@
+"""Declared Arrow types of the song dataset.
+
+The preprocessed songs, and the train, validation, test and daily release tables split
+from them, are written with these types instead of the int64, float64 and string
+columns that pandas infers: float32 features, int8 `key` and `mode`, a nullable int16
+`year`, dictionary-encoded genre lists and fixed-width song ids. Parquet keeps them, so
+pandas reads the features back with the same dtypes.
+
+Song ids are decoded to strings by `to_pandas`, as predictions, lookups and the online
+server identify songs by string ids.
+"""
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+SONG_ID_LENGTH = 18  # e.g. TRAAAAW128F429D538
+# Model inputs, in the order the pipeline was fitted on
+FEATURE_COLS = ["duration", "key", "loudness", "mode", "tempo", "year"]
+
+SONG_SCHEMA = pa.schema(
+    [
+        ("song_id", pa.binary(SONG_ID_LENGTH)),
+        ("danceability", pa.float32()),
+        ("duration", pa.float32()),
+        ("energy", pa.float32()),
+        ("key", pa.int8()),
+        ("loudness", pa.float32()),
+        ("mode", pa.int8()),
+        ("tempo", pa.float32()),
+        ("year", pa.int16()),
+        ("genres", pa.list_(pa.dictionary(pa.int32(), pa.string()))),
+    ]
+)
+
+
+def conform_table(table: pa.Table, schema: pa.Schema = SONG_SCHEMA) -> pa.Table:
+    """Cast the columns of `table` that `schema` declares, keeping its other columns and
+    its pandas metadata. Values that do not fit the declared type raise an error, such
+    as song ids that are not `SONG_ID_LENGTH` characters long."""
+    target = table.schema
+    for i, field in enumerate(table.schema):
+        if field.name in schema.names:
+            target = target.set(i, schema.field(field.name))
+    return table.cast(target)
+
+
+def _decode_song_ids(data: pa.Table | pa.RecordBatch) -> pa.Table | pa.RecordBatch:
+    if "song_id" not in data.schema.names:
+        return data
+    i = data.schema.get_field_index("song_id")
+    if not pa.types.is_fixed_size_binary(data.schema.field(i).type):
+        return data
+    schema = data.schema.set(i, pa.field("song_id", pa.string()))
+    columns = list(data.columns)
+    song_ids = columns[i]
+    # pyarrow 15 crashes casting fixed-width binary arrays that do not start at offset
+    # 0, such as all but the first chunk read from Parquet, so cast a contiguous copy
+    chunks = song_ids.chunks if isinstance(song_ids, pa.ChunkedArray) else [song_ids]
+    columns[i] = pc.cast(pa.concat_arrays(chunks), pa.string())
+    if isinstance(data, pa.Table):
+        return pa.Table.from_arrays(columns, schema=schema)
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def to_pandas(data: pa.Table | pa.RecordBatch) -> pd.DataFrame:
+    """Convert to a data frame with string song ids and the declared feature dtypes"""
+    return _decode_song_ids(data).to_pandas()
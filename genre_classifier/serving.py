@@ -0,0 +1,274 @@
+"""HTTP inference server for online genre predictions.
+
+The registered pipeline and MultiLabelBinarizer are loaded once at startup. Concurrent
+requests are coalesced into micro-batches before calling `pipeline.predict`, which
+amortises the per-call overhead of the sklearn pipeline across requests.
+
+Run locally with `python -m genre_classifier.serving --environment dev`.
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from genre_classifier.model_cache import DEFAULT_REGISTRY_TTL_SECONDS, load_model
+from genre_classifier.preprocess_common import fix_outliers
+from genre_classifier.schema import FEATURE_COLS
+
+ID_COL = "song_id"
+
+PredictFn = Callable[[pd.DataFrame], list[list[str]]]
+
+
+def make_predict_fn(
+    pipeline, mlb, valid_tempo_min: float = 70, valid_tempo_max: float = 180
+) -> PredictFn:
+    def predict(df: pd.DataFrame) -> list[list[str]]:
+        df = fix_outliers(df, valid_tempo_min, valid_tempo_max)
+        predictions = pipeline.predict(df)
+        return [list(genres) for genres in mlb.inverse_transform(predictions)]
+
+    return predict
+
+
+class LatencyRecorder:
+    """Keeps the most recent request latencies and overall throughput counters."""
+
+    def __init__(self, window: int = 10_000):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._started_at = time.perf_counter()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.batched_rows = 0
+
+    def record_request(self, latency_seconds: float, rows: int):
+        with self._lock:
+            self._latencies.append(latency_seconds)
+            self.requests += 1
+            self.rows += rows
+
+    def record_batch(self, rows: int):
+        with self._lock:
+            self.batches += 1
+            self.batched_rows += rows
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = np.array(self._latencies)
+            elapsed = time.perf_counter() - self._started_at
+            p50, p99 = (
+                np.percentile(latencies, [50, 99]) * 1e3
+                if len(latencies)
+                else (None, None)
+            )
+            return {
+                "requests": self.requests,
+                "rows": self.rows,
+                "batches": self.batches,
+                "mean_batch_rows": self.batched_rows / self.batches
+                if self.batches
+                else None,
+                "latency_p50_ms": p50,
+                "latency_p99_ms": p99,
+                "requests_per_second": self.requests / elapsed,
+                "rows_per_second": self.rows / elapsed,
+            }
+
+
+class MicroBatcher:
+    """Coalesces concurrently submitted frames into batches for a single predict call.
+
+    A batch is flushed once it holds `max_batch_size` rows or `max_wait_ms` passed since
+    its first request arrived, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        predict_fn: PredictFn,
+        max_batch_size: int = 256,
+        max_wait_ms: float = 5.0,
+        recorder: LatencyRecorder | None = None,
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1e3
+        self.recorder = recorder or LatencyRecorder()
+        self._queue: queue.Queue[tuple[pd.DataFrame, Future] | None] = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, df: pd.DataFrame) -> Future:
+        future = Future()
+        self._queue.put((df, future))
+        return future
+
+    def predict(self, df: pd.DataFrame) -> list[list[str]]:
+        return self.submit(df).result()
+
+    def close(self):
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect_batch(self) -> list[tuple[pd.DataFrame, Future]] | None:
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch, rows = [item], len(item[0])
+        deadline = time.perf_counter() + self.max_wait_seconds
+        while rows < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while (batch := self._collect_batch()) is not None:
+            frames = [df for df, _ in batch]
+            try:
+                predictions = self.predict_fn(pd.concat(frames, ignore_index=True))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.recorder.record_batch(len(predictions))
+
+            start = 0
+            for df, future in batch:
+                future.set_result(predictions[start : start + len(df)])
+                start += len(df)
+
+
+class InferenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_handler(batcher: MicroBatcher) -> type[BaseHTTPRequestHandler]:
+    class InferenceHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: dict):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok"})
+            elif self.path == "/metrics":
+                self._send_json(200, batcher.recorder.snapshot())
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+
+            start = time.perf_counter()
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                songs = json.loads(self.rfile.read(length))["songs"]
+                df = pd.DataFrame(songs, columns=[ID_COL] + FEATURE_COLS)
+                df[FEATURE_COLS] = df[FEATURE_COLS].astype(float)
+            except (KeyError, TypeError, ValueError) as e:
+                self._send_json(400, {"error": f"Invalid request: {e}"})
+                return
+            if df.empty:
+                # Fitted pipelines reject empty frames, and there is nothing to batch
+                self._send_json(200, {"predictions": []})
+                return
+
+            try:
+                genres = batcher.predict(df[FEATURE_COLS])
+            except Exception as e:
+                self._send_json(500, {"error": f"Prediction failed: {e}"})
+                return
+            predictions = [
+                {ID_COL: song_id, "genres": song_genres}
+                for song_id, song_genres in zip(df[ID_COL], genres)
+            ]
+            batcher.recorder.record_request(time.perf_counter() - start, len(df))
+            self._send_json(200, {"predictions": predictions})
+
+        def log_message(self, format, *args):
+            pass
+
+    return InferenceHandler
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    environment: str = "dev",
+    max_batch_size: int = 256,
+    max_wait_ms: float = 5.0,
+    valid_tempo_min: float = 70,
+    valid_tempo_max: float = 180,
+    cache_dir: str | None = None,
+    registry_ttl_seconds: float = DEFAULT_REGISTRY_TTL_SECONDS,
+):
+    pipeline = load_model(
+        "genre-classifier-random-forest",
+        environment,
+        cache_dir=cache_dir,
+        ttl_seconds=registry_ttl_seconds,
+    )
+    mlb = load_model(
+        "genre-classifier-multi-label-binarizer",
+        environment,
+        cache_dir=cache_dir,
+        ttl_seconds=registry_ttl_seconds,
+    )
+    batcher = MicroBatcher(
+        make_predict_fn(pipeline, mlb, valid_tempo_min, valid_tempo_max),
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+    )
+    server = InferenceServer((host, port), make_handler(batcher))
+    print(f"Serving predictions on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Online genre prediction server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--environment", default="dev")
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--cache-dir", default=None)
+    args = parser.parse_args()
+    serve(
+        host=args.host,
+        port=args.port,
+        environment=args.environment,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        cache_dir=args.cache_dir,
+    )
@@ -0,0 +1,245 @@
+"""Mergeable per-partition summaries of the model inputs and outputs.
+
+Every daily partition gets a sketch when it lands: a log-bucketed histogram per
+numerical column and value counts per categorical column, and every prediction
+partition gets counts of the predicted genres. Bucket boundaries do not depend on the
+data, so sketches of any set of days merge by adding counts, and drift over a window
+of days never has to re-read the partitions themselves.
+
+Numerical buckets have a fixed relative width: bucket `i` holds values in
+`(gamma ** (i - 1), gamma ** i]` with `gamma = (1 + a) / (1 - a)`, so its midpoint is
+within a relative error `a` of every value it holds.
+"""
+
+import datetime
+import math
+from pathlib import PurePosixPath
+from typing import TypeVar
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from botocore.exceptions import ClientError
+from prefect_aws import S3Bucket
+from pydantic import BaseModel
+
+NUMERICAL_COLS = ["duration", "loudness", "tempo", "year"]
+BINARY_COLS = ["mode"]
+CATEGORICAL_COLS = ["key"]
+SKETCH_FILE = "sketch.json"
+GENRE_COUNTS_FILE = "genre_counts.json"
+# MLflow artifact with the counts of the genres a model predicts on the validation set
+REFERENCE_GENRE_COUNTS_PATH = f"val_predictions/{GENRE_COUNTS_FILE}"
+DEFAULT_RELATIVE_ACCURACY = 0.01
+MISSING_CATEGORY = "missing"
+
+
+def _add_counts(a: dict, b: dict) -> dict:
+    counts = dict(a)
+    for key, count in b.items():
+        counts[key] = counts.get(key, 0) + count
+    return counts
+
+
+def _bucket_counts(indices: np.ndarray) -> dict[int, int]:
+    keys, counts = np.unique(indices, return_counts=True)
+    return dict(zip(keys.tolist(), counts.tolist()))
+
+
+class NumericalSketch(BaseModel):
+    relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY
+    positive: dict[int, int] = {}
+    negative: dict[int, int] = {}
+    zero: int = 0
+    missing: int = 0
+
+    @property
+    def gamma(self) -> float:
+        return (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+
+    @property
+    def count(self) -> int:
+        """Number of non-missing values"""
+        return sum(self.positive.values()) + sum(self.negative.values()) + self.zero
+
+    @classmethod
+    def from_values(
+        cls, values: np.ndarray, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY
+    ) -> "NumericalSketch":
+        values = np.asarray(values, dtype=np.float64)
+        finite = np.isfinite(values)
+        log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        positive = values[finite & (values > 0)]
+        negative = -values[finite & (values < 0)]
+        return cls(
+            relative_accuracy=relative_accuracy,
+            positive=_bucket_counts(np.ceil(np.log(positive) / log_gamma).astype(int)),
+            negative=_bucket_counts(np.ceil(np.log(negative) / log_gamma).astype(int)),
+            zero=int(np.count_nonzero(finite & (values == 0))),
+            missing=int(np.count_nonzero(~finite)),
+        )
+
+    def merge(self, other: "NumericalSketch") -> "NumericalSketch":
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with a different relative accuracy")
+        return NumericalSketch(
+            relative_accuracy=self.relative_accuracy,
+            positive=_add_counts(self.positive, other.positive),
+            negative=_add_counts(self.negative, other.negative),
+            zero=self.zero + other.zero,
+            missing=self.missing + other.missing,
+        )
+
+    def histogram(self) -> tuple[np.ndarray, np.ndarray]:
+        """Bucket midpoints in ascending order, with the number of values in each"""
+        gamma = self.gamma
+        negative = sorted(self.negative.items(), reverse=True)
+        positive = sorted(self.positive.items())
+        values = (
+            [-2 * gamma**i / (gamma + 1) for i, _ in negative]
+            + ([0.0] if self.zero else [])
+            + [2 * gamma**i / (gamma + 1) for i, _ in positive]
+        )
+        counts = (
+            [count for _, count in negative]
+            + ([self.zero] if self.zero else [])
+            + [count for _, count in positive]
+        )
+        return np.array(values, dtype=np.float64), np.array(counts, dtype=np.int64)
+
+    def quantile(self, q: float) -> float:
+        values, counts = self.histogram()
+        if not len(values):
+            return math.nan
+        rank = q * (counts.sum() - 1)
+        return float(values[np.searchsorted(np.cumsum(counts), rank, side="right")])
+
+
+def count_categories(values: pd.Series) -> dict[str, int]:
+    """Value counts keyed by the value as a string, integral floats without decimals"""
+    if pd.api.types.is_float_dtype(values):
+        finite = values.dropna()
+        if (finite == finite.round()).all():
+            values = values.astype("Int64")
+    counts = values.value_counts(dropna=False)
+    return {
+        MISSING_CATEGORY if pd.isna(key) else str(key): int(count)
+        for key, count in counts.items()
+    }
+
+
+class PartitionSketch(BaseModel):
+    count: int = 0
+    numerical: dict[str, NumericalSketch] = {}
+    categorical: dict[str, dict[str, int]] = {}
+
+    def merge(self, other: "PartitionSketch") -> "PartitionSketch":
+        numerical = dict(self.numerical)
+        for column, sketch in other.numerical.items():
+            numerical[column] = (
+                numerical[column].merge(sketch) if column in numerical else sketch
+            )
+        categorical = dict(self.categorical)
+        for column, counts in other.categorical.items():
+            categorical[column] = _add_counts(categorical.get(column, {}), counts)
+        return PartitionSketch(
+            count=self.count + other.count,
+            numerical=numerical,
+            categorical=categorical,
+        )
+
+
+class GenreCounts(BaseModel):
+    """How often each genre was assigned, over a number of rows"""
+
+    rows: int = 0
+    counts: dict[str, int] = {}
+
+    def merge(self, other: "GenreCounts") -> "GenreCounts":
+        return GenreCounts(
+            rows=self.rows + other.rows, counts=_add_counts(self.counts, other.counts)
+        )
+
+
+def count_genres(genres: pd.Series | pa.ChunkedArray) -> GenreCounts:
+    if isinstance(genres, pd.Series):
+        genres = pa.chunked_array([pa.array(genres, type=pa.list_(pa.string()))])
+    counts = pc.value_counts(pc.list_flatten(genres))
+    return GenreCounts(
+        rows=len(genres),
+        counts=dict(
+            zip(counts.field("values").to_pylist(), counts.field("counts").to_pylist())
+        ),
+    )
+
+
+SketchT = TypeVar("SketchT", PartitionSketch, GenreCounts)
+
+
+def compute_sketch(
+    df: pd.DataFrame,
+    numerical_cols: list[str] = NUMERICAL_COLS,
+    categorical_cols: list[str] = BINARY_COLS + CATEGORICAL_COLS,
+    relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+) -> PartitionSketch:
+    return PartitionSketch(
+        count=len(df),
+        numerical={
+            column: NumericalSketch.from_values(df[column], relative_accuracy)
+            for column in numerical_cols
+        },
+        categorical={
+            column: count_categories(df[column]) for column in categorical_cols
+        },
+    )
+
+
+def merge_sketches(
+    sketches: list[SketchT], empty: SketchT = PartitionSketch()
+) -> SketchT:
+    merged = empty
+    for sketch in sketches:
+        merged = merged.merge(sketch)
+    return merged
+
+
+def window_dates(dates: list[str], window_days: int) -> list[str]:
+    """The dates within `window_days` days up to and including the latest date"""
+    if not dates:
+        return []
+    end = datetime.date.fromisoformat(max(dates))
+    start = (end - datetime.timedelta(days=window_days - 1)).isoformat()
+    return sorted(date for date in dates if date >= start)
+
+
+def get_sketch_path(data_path: str, date: str) -> str:
+    return f"{data_path}/{date}/{SKETCH_FILE}"
+
+
+def get_reference_sketch_path(data_path: str) -> str:
+    return str(PurePosixPath(data_path).with_suffix(f".{SKETCH_FILE}"))
+
+
+def load_sketch(
+    sketch_path: str,
+    bucket_block_name: str = "million-songs-dataset-s3",
+    sketch_type: type[SketchT] = PartitionSketch,
+) -> SketchT | None:
+    bucket = S3Bucket.load(bucket_block_name)
+    try:
+        content = bucket.read_path(sketch_path)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return sketch_type.model_validate_json(content)
+
+
+def save_sketch(
+    sketch: PartitionSketch | GenreCounts,
+    sketch_path: str,
+    bucket_block_name: str = "million-songs-dataset-s3",
+) -> None:
+    bucket = S3Bucket.load(bucket_block_name)
+    bucket.write_path(sketch_path, sketch.model_dump_json().encode())
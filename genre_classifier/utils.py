@@ -1,11 +1,24 @@
+import io
+import json
 import os
 import tempfile
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from prefect_aws import AwsCredentials, S3Bucket
 
+from genre_classifier.artifact_store import get_active_store
+from genre_classifier.schema import conform_table, to_pandas
+
+PREDICTIONS_INDEX_FILE = "predictions_index.json"
+PREDICTIONS_METADATA_FILE = "_metadata"
+
 
 def set_aws_credential_env(credentials_block_name: str = "aws-creds"):
     aws_credentials_block = AwsCredentials.load(credentials_block_name)
@@ -55,9 +68,13 @@ def download_file_from_s3(
 def read_parquet_data(
     data_path: Path | str, bucket_block_name: str = "million-songs-dataset-s3"
 ) -> pd.DataFrame:
+    store = get_active_store()
+    table = store.get(data_path, bucket_block_name) if store is not None else None
+    if table is not None:
+        return to_pandas(table)
     with tempfile.NamedTemporaryFile(mode="w") as f:
         download_file_from_s3(data_path, f.name, bucket_block_name)
-        data = pd.read_parquet(f.name)
+        data = to_pandas(pq.read_table(f.name))
     return data
 
 
@@ -65,7 +82,199 @@ def write_parquet_data(
     df: pd.DataFrame,
     to_path: Path | str,
     bucket_block_name: str = "million-songs-dataset-s3",
+    schema: pa.Schema | None = None,
 ) -> None:
+    """Write `df` as Parquet. With `schema`, the columns it declares are cast to the
+    declared types first, see `genre_classifier.schema`."""
+    store = get_active_store()
+    if store is None and schema is None:
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            df.to_parquet(f.name)
+            upload_file_to_s3(f.name, to_path, bucket_block_name)
+        return
+
+    table = pa.Table.from_pandas(df)
+    if schema is not None:
+        table = conform_table(table, schema)
+    if store is not None:
+        store.put(table, to_path, bucket_block_name)
+        return
     with tempfile.NamedTemporaryFile(mode="w") as f:
-        df.to_parquet(f.name)
+        pq.write_table(table, f.name)
         upload_file_to_s3(f.name, to_path, bucket_block_name)
+
+
+def get_object_key(bucket: S3Bucket, data_path: Path | str) -> str:
+    return f"{bucket.bucket_folder.rstrip('/')}/{data_path}".lstrip("/")
+
+
+def _read_parquet_object(client, bucket_name: str, key: str) -> pa.Table:
+    body = client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+    return pq.read_table(pa.BufferReader(body))
+
+
+def _with_partition_column(
+    table: pa.Table, partition_col: str, value: str, indices: pa.Array
+) -> pa.Table:
+    """Add a constant column as a one-value dictionary over a shared all-zero index"""
+    column = pa.DictionaryArray.from_arrays(
+        indices.slice(0, table.num_rows), pa.array([value])
+    )
+    return table.append_column(partition_col, column)
+
+
+def iter_parquet_partitions(
+    data_paths: list[str],
+    partition_values: list[str] | None = None,
+    partition_col: str = "date",
+    bucket_block_name: str = "million-songs-dataset-s3",
+    max_workers: int = 8,
+) -> Iterator[pa.Table]:
+    """Read many Parquet objects concurrently, yielding one table per path in order.
+
+    Objects are fetched in windows of `max_workers` with a single S3 client, so at most
+    one window of tables is held in memory. With `partition_values`, every table gets
+    `partition_col` holding its value, dictionary encoded over a shared index buffer
+    instead of materialising the value for every row.
+    """
+    bucket = S3Bucket.load(bucket_block_name)
+    client = bucket.credentials.get_s3_client()
+    keys = [get_object_key(bucket, data_path) for data_path in data_paths]
+    indices = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(keys), max_workers):
+            window = keys[start : start + max_workers]
+            tables = list(
+                executor.map(
+                    lambda key: _read_parquet_object(client, bucket.bucket_name, key),
+                    window,
+                )
+            )
+            for i, table in enumerate(tables, start):
+                if partition_values is not None:
+                    if indices is None or len(indices) < table.num_rows:
+                        indices = pa.array(np.zeros(table.num_rows, dtype=np.int32))
+                    table = _with_partition_column(
+                        table, partition_col, partition_values[i], indices
+                    )
+                yield table
+
+
+def read_parquet_partitions(
+    data_paths: list[str],
+    partition_values: list[str] | None = None,
+    partition_col: str = "date",
+    bucket_block_name: str = "million-songs-dataset-s3",
+    max_workers: int = 8,
+) -> pa.Table:
+    """The tables of `iter_parquet_partitions` concatenated into one"""
+    tables = list(
+        iter_parquet_partitions(
+            data_paths, partition_values, partition_col, bucket_block_name, max_workers
+        )
+    )
+    if not tables:
+        return pa.table({})
+    return pa.concat_tables(tables, promote_options="default")
+
+
+class S3RangeReader(io.RawIOBase):
+    """Seekable read-only file over an S3 object that fetches each read as a range GET"""
+
+    def __init__(self, client, bucket_name: str, key: str, size: int | None = None):
+        self._client = client
+        self._bucket_name = bucket_name
+        self._key = key
+        if size is None:
+            size = client.head_object(Bucket=bucket_name, Key=key)["ContentLength"]
+        self._size = size
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        start = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self._size}
+        self._position = start[whence] + offset
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        end = min(self._position + len(buffer), self._size)
+        if end <= self._position:
+            return 0
+        response = self._client.get_object(
+            Bucket=self._bucket_name,
+            Key=self._key,
+            Range=f"bytes={self._position}-{end - 1}",
+        )
+        data = response["Body"].read()
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+def find_row_groups(index: dict, song_ids: list[str]) -> list[int]:
+    """Row groups of a table sorted by song_id whose min/max range holds any of the ids"""
+    row_groups = set()
+    for song_id in song_ids:
+        i = bisect_left(index["row_group_max"], song_id)
+        if i < len(index["row_group_min"]) and index["row_group_min"][i] <= song_id:
+            row_groups.add(i)
+    return sorted(row_groups)
+
+
+def compacted_files(index: dict) -> list[dict]:
+    """Index entries of the files of the compacted table, oldest first. Indexes written
+    before the table was split into files describe a single file at the top level."""
+    if "files" in index:
+        return index["files"]
+    return [{**index, "metadata_file": PREDICTIONS_METADATA_FILE}]
+
+
+def lookup_predictions(
+    song_ids: list[str],
+    data_path: str = "subset/predictions_compacted",
+    bucket_block_name: str = "million-songs-dataset-s3",
+) -> pd.DataFrame:
+    """Look up compacted predictions by song_id.
+
+    The sidecar index holds the song_id range of each row group of every file of the
+    compacted table, and the Parquet footer of each file is stored next to it, so only
+    the row groups that can contain the requested ids are fetched, with range reads.
+    Files are searched oldest first, so a newer file's prediction of a song wins.
+    """
+    bucket = S3Bucket.load(bucket_block_name)
+    client = bucket.credentials.get_s3_client()
+    index = json.loads(bucket.read_path(f"{data_path}/{PREDICTIONS_INDEX_FILE}"))
+    files = compacted_files(index)
+
+    def read_footer(file_index: dict) -> pq.FileMetaData:
+        path = f"{data_path}/{file_index['metadata_file']}"
+        return pq.read_metadata(pa.BufferReader(bucket.read_path(path)))
+
+    tables = []
+    for file_index in files:
+        row_groups = find_row_groups(file_index, song_ids)
+        if not row_groups:
+            continue
+        metadata = read_footer(file_index)
+        reader = S3RangeReader(
+            client,
+            bucket.bucket_name,
+            get_object_key(bucket, f"{data_path}/{file_index['file']}"),
+            file_index["file_size"],
+        )
+        with pq.ParquetFile(reader, metadata=metadata) as parquet_file:
+            tables.append(parquet_file.read_row_groups(row_groups))
+    if not tables:
+        tables.append(read_footer(files[-1]).schema.to_arrow_schema().empty_table())
+    # Files merged from several runs hold the date as strings, the others as categories
+    df = pd.concat([table.to_pandas() for table in tables])
+    df = df[df.index.isin(song_ids)]
+    return df[~df.index.duplicated(keep="last")].sort_index(kind="stable")
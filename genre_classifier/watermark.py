@@ -0,0 +1,149 @@
+"""Persisted progress marker for the prediction pipeline.
+
+The watermark records the last release date up to which every partition was scored,
+plus the dates after it that were already scored out of order. Listing new partitions
+then only has to start shortly before the watermark instead of walking the whole
+history, and a skipped date stays pending until it is scored. Partitions that arrive
+after the watermark moved past their date are found by relisting a lookback window of
+`LATE_RELEASE_LOOKBACK_DAYS` before it, and scored if they have no predictions.
+
+The watermark is a single JSON object, so every update replaces it atomically. Runs
+that overlap merge their progress with the watermark saved in the meantime instead of
+overwriting it, so it never moves backwards.
+"""
+
+import datetime
+
+from botocore.exceptions import ClientError
+from prefect_aws import S3Bucket
+from pydantic import BaseModel
+
+from genre_classifier.utils import get_object_key
+
+WATERMARK_FILE = "_watermark.json"
+RELEASES_FILE = "releases.parquet"
+PREDICTIONS_FILE = "predictions.parquet"
+LATE_RELEASE_LOOKBACK_DAYS = 7
+
+
+class PredictionWatermark(BaseModel):
+    last_scored_date: str | None = None
+    completed: list[str] = []
+
+    def pending_dates(self, release_dates: list[str]) -> list[str]:
+        """Release dates that were listed after the watermark and are not scored yet"""
+        completed = set(self.completed)
+        return sorted(
+            date
+            for date in release_dates
+            if date not in completed
+            and (self.last_scored_date is None or date > self.last_scored_date)
+        )
+
+    def late_dates(
+        self, release_dates: list[str], prediction_dates: list[str]
+    ) -> list[str]:
+        """Release dates at or before the watermark that have no predictions, as their
+        partitions arrived after the watermark moved past them"""
+        if self.last_scored_date is None:
+            return []
+        scored = set(prediction_dates)
+        return sorted(
+            date
+            for date in release_dates
+            if date <= self.last_scored_date and date not in scored
+        )
+
+    def advance(
+        self, scored_dates: list[str], release_dates: list[str]
+    ) -> "PredictionWatermark":
+        """Mark dates as scored and move the watermark past every contiguous scored date"""
+        completed = set(self.completed) | set(scored_dates)
+        last_scored_date = self.last_scored_date
+        for date in sorted(release_dates):
+            if last_scored_date is not None and date <= last_scored_date:
+                continue
+            if date not in completed:
+                break
+            last_scored_date = date
+        return PredictionWatermark(
+            last_scored_date=last_scored_date,
+            completed=sorted(
+                date
+                for date in completed
+                if last_scored_date is None or date > last_scored_date
+            ),
+        )
+
+    def merge(
+        self, other: "PredictionWatermark", release_dates: list[str]
+    ) -> "PredictionWatermark":
+        """Combine the progress of two watermarks, keeping the later of the two marks"""
+        marks = [
+            date
+            for date in (self.last_scored_date, other.last_scored_date)
+            if date is not None
+        ]
+        merged = PredictionWatermark(last_scored_date=max(marks, default=None))
+        return merged.advance(self.completed + other.completed, release_dates)
+
+
+def lookback_start(last_scored_date: str | None, lookback_days: int) -> str | None:
+    """The date after which to list partitions to also find late ones of the last
+    `lookback_days` up to the watermark"""
+    if last_scored_date is None:
+        return None
+    start = datetime.date.fromisoformat(last_scored_date)
+    return (start - datetime.timedelta(days=lookback_days)).isoformat()
+
+
+def get_watermark_path(target_data_path: str) -> str:
+    return f"{target_data_path}/{WATERMARK_FILE}"
+
+
+def load_watermark(
+    target_data_path: str, bucket_block_name: str = "million-songs-dataset-s3"
+) -> PredictionWatermark | None:
+    bucket = S3Bucket.load(bucket_block_name)
+    try:
+        content = bucket.read_path(get_watermark_path(target_data_path))
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return PredictionWatermark.model_validate_json(content)
+
+
+def save_watermark(
+    watermark: PredictionWatermark,
+    target_data_path: str,
+    bucket_block_name: str = "million-songs-dataset-s3",
+) -> None:
+    bucket = S3Bucket.load(bucket_block_name)
+    bucket.write_path(
+        get_watermark_path(target_data_path), watermark.model_dump_json().encode()
+    )
+
+
+def list_partition_dates(
+    data_path: str,
+    file_name: str,
+    bucket_block_name: str = "million-songs-dataset-s3",
+    start_after_date: str | None = None,
+) -> list[str]:
+    """List the dates of `<data_path>/<date>/<file_name>` partitions, after a given date"""
+    bucket = S3Bucket.load(bucket_block_name)
+    client = bucket.credentials.get_s3_client()
+    prefix = f"{get_object_key(bucket, data_path)}/"
+    list_kwargs = {"Bucket": bucket.bucket_name, "Prefix": prefix}
+    if start_after_date is not None:
+        # "~" sorts after every file name inside the date directory
+        list_kwargs["StartAfter"] = f"{prefix}{start_after_date}/~"
+
+    dates = []
+    for page in client.get_paginator("list_objects_v2").paginate(**list_kwargs):
+        for obj in page.get("Contents", []):
+            parts = obj["Key"][len(prefix) :].split("/")
+            if len(parts) == 2 and parts[1] == file_name:
+                dates.append(parts[0])
+    return sorted(dates)
@@ -0,0 +1,232 @@
+from unittest.mock import patch
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from genre_classifier.flows.compact_predictions.flow import (
+    build_index,
+    compact,
+    compact_predictions_flow,
+)
+from genre_classifier.watermark import PredictionWatermark
+
+COMPACT_PREDICTIONS = "genre_classifier.flows.compact_predictions.flow"
+
+
+def make_predictions(song_ids: list[str], genre: str, date: str) -> pd.DataFrame:
+    return pd.DataFrame(
+        {"genres": [[genre]] * len(song_ids), "date": date},
+        index=pd.Index(song_ids, name="song_id"),
+    )
+
+
+class TestCompactPredictionsFlow:
+    def test_compact_keeps_latest_prediction_sorted_by_song_id(self):
+        df = compact(
+            pd.concat(
+                [
+                    make_predictions(["c", "a"], "rock", "2024-01-01"),
+                    make_predictions(["b", "a"], "pop", "2024-01-02"),
+                ]
+            )
+        )
+
+        assert df.index.tolist() == ["a", "b", "c"]
+        assert df.loc["a", "date"] == "2024-01-02"
+        assert list(df.loc["a", "genres"]) == ["pop"]
+
+    def test_build_index(self, tmp_path):
+        df = make_predictions([f"s{i}" for i in range(5)], "rock", "2024-01-01")
+        path = tmp_path / "predictions.parquet"
+        pq.write_table(pa.Table.from_pandas(df), path, row_group_size=2)
+
+        index = build_index(pq.read_metadata(path), path.name, path.stat().st_size)
+
+        assert index["num_rows"] == 5
+        assert index["row_group_min"] == ["s0", "s2", "s4"]
+        assert index["row_group_max"] == ["s1", "s3", "s4"]
+        assert index["row_group_num_rows"] == [2, 2, 1]
+
+    @patch(f"{COMPACT_PREDICTIONS}.write_compacted_predictions")
+    @patch(f"{COMPACT_PREDICTIONS}.read_compacted_predictions")
+    @patch(f"{COMPACT_PREDICTIONS}.read_predictions")
+    @patch(f"{COMPACT_PREDICTIONS}.load_watermark")
+    @patch(f"{COMPACT_PREDICTIONS}.list_partition_dates")
+    @patch(f"{COMPACT_PREDICTIONS}.load_compaction_index")
+    @patch(f"{COMPACT_PREDICTIONS}.get_run_logger")
+    def test_compacts_only_new_dates_up_to_watermark(
+        self,
+        _logger,
+        mock_load_index,
+        mock_list_dates,
+        mock_load_watermark,
+        mock_read_predictions,
+        mock_read_compacted,
+        mock_write,
+    ):
+        files = [{"file": "predictions-2024-01-02.parquet"}]
+        mock_load_index.return_value = {
+            "files": files,
+            "last_compacted_date": "2024-01-02",
+            "recent_dates": ["2024-01-01", "2024-01-02"],
+        }
+        mock_list_dates.return_value = [
+            "2024-01-01",
+            "2024-01-02",
+            "2024-01-03",
+            "2024-01-05",
+        ]
+        # 2024-01-04 is not scored yet, so 2024-01-05 has to wait
+        mock_load_watermark.return_value = PredictionWatermark(
+            last_scored_date="2024-01-03", completed=["2024-01-05"]
+        )
+        mock_read_predictions.return_value = make_predictions(
+            ["d", "b", "d"], "pop", "2024-01-03"
+        )
+        mock_write.return_value = {"files": [*files, {}]}
+
+        compact_predictions_flow.fn(
+            "bucket", "subset/predictions", "subset/predictions_compacted"
+        )
+
+        mock_list_dates.assert_called_once_with(
+            "subset/predictions", "predictions.parquet", "bucket", "2023-12-26"
+        )
+        mock_read_predictions.assert_called_once_with(
+            "bucket", "subset/predictions", ["2024-01-03"]
+        )
+        # The new dates are appended as a new file, the compacted ones are not read
+        mock_read_compacted.assert_not_called()
+        df, index, _, file_name, _, _ = mock_write.call_args.args
+        assert df.index.tolist() == ["b", "d"]
+        assert file_name == "predictions-2024-01-03.parquet"
+        assert index == {
+            "files": files,
+            "last_compacted_date": "2024-01-03",
+            "recent_dates": ["2024-01-01", "2024-01-02", "2024-01-03"],
+        }
+
+    @patch(f"{COMPACT_PREDICTIONS}.write_compacted_predictions")
+    @patch(f"{COMPACT_PREDICTIONS}.read_predictions")
+    @patch(f"{COMPACT_PREDICTIONS}.load_watermark", return_value=None)
+    @patch(f"{COMPACT_PREDICTIONS}.list_partition_dates")
+    @patch(f"{COMPACT_PREDICTIONS}.load_compaction_index")
+    @patch(f"{COMPACT_PREDICTIONS}.get_run_logger")
+    def test_compacts_late_dates_before_last_compacted_date(
+        self,
+        _logger,
+        mock_load_index,
+        mock_list_dates,
+        _load_watermark,
+        mock_read_predictions,
+        mock_write,
+    ):
+        mock_load_index.return_value = {
+            "files": [{"file": "predictions-2024-01-03.parquet"}],
+            "last_compacted_date": "2024-01-03",
+            "recent_dates": ["2024-01-01", "2024-01-03"],
+        }
+        # The releases of 2024-01-02 arrived late and were scored since
+        mock_list_dates.return_value = ["2024-01-01", "2024-01-02", "2024-01-03"]
+        mock_read_predictions.return_value = make_predictions(
+            ["e"], "pop", "2024-01-02"
+        )
+        mock_write.return_value = {"files": [{}, {}]}
+
+        compact_predictions_flow.fn("bucket")
+
+        assert mock_read_predictions.call_args.args[-1] == ["2024-01-02"]
+        _, index, _, file_name, _, _ = mock_write.call_args.args
+        assert file_name == "predictions-2024-01-02.parquet"
+        assert index["last_compacted_date"] == "2024-01-03"
+        assert index["recent_dates"] == ["2024-01-01", "2024-01-02", "2024-01-03"]
+
+    @patch(f"{COMPACT_PREDICTIONS}.delete_compacted_files")
+    @patch(f"{COMPACT_PREDICTIONS}.write_compacted_predictions")
+    @patch(f"{COMPACT_PREDICTIONS}.read_compacted_predictions")
+    @patch(f"{COMPACT_PREDICTIONS}.read_predictions")
+    @patch(f"{COMPACT_PREDICTIONS}.load_watermark", return_value=None)
+    @patch(f"{COMPACT_PREDICTIONS}.list_partition_dates")
+    @patch(f"{COMPACT_PREDICTIONS}.load_compaction_index")
+    @patch(f"{COMPACT_PREDICTIONS}.get_run_logger")
+    def test_merges_all_files_when_there_are_too_many(
+        self,
+        _logger,
+        mock_load_index,
+        mock_list_dates,
+        _load_watermark,
+        mock_read_predictions,
+        mock_read_compacted,
+        mock_write,
+        mock_delete,
+    ):
+        files = [
+            {"file": "predictions-2024-01-01.parquet"},
+            {"file": "predictions-2024-01-02.parquet"},
+        ]
+        mock_load_index.return_value = {
+            "files": files,
+            "last_compacted_date": "2024-01-02",
+        }
+        # Dates up to the last compacted date of earlier indexes count as compacted
+        mock_list_dates.return_value = ["2024-01-01", "2024-01-02", "2024-01-03"]
+        mock_read_predictions.return_value = make_predictions(
+            ["b", "d"], "pop", "2024-01-03"
+        )
+        mock_read_compacted.return_value = make_predictions(
+            ["a", "b", "c"], "rock", "2024-01-02"
+        )
+        mock_write.return_value = {"files": [{}]}
+
+        compact_predictions_flow.fn("bucket", max_files=2)
+
+        mock_read_compacted.assert_called_once_with(
+            "bucket", "subset/predictions_compacted", files
+        )
+        df = mock_write.call_args.args[0]
+        assert df.index.tolist() == ["a", "b", "c", "d"]
+        assert df["date"].tolist() == [
+            "2024-01-02",
+            "2024-01-03",
+            "2024-01-02",
+            "2024-01-03",
+        ]
+        assert mock_write.call_args.args[1]["files"] == []
+        assert mock_read_predictions.call_args.args[-1] == ["2024-01-03"]
+        mock_delete.assert_called_once_with(
+            "bucket", "subset/predictions_compacted", files
+        )
+
+    @patch(f"{COMPACT_PREDICTIONS}.write_compacted_predictions")
+    @patch(f"{COMPACT_PREDICTIONS}.read_predictions")
+    @patch(f"{COMPACT_PREDICTIONS}.load_watermark", return_value=None)
+    @patch(f"{COMPACT_PREDICTIONS}.list_partition_dates")
+    @patch(f"{COMPACT_PREDICTIONS}.load_compaction_index", return_value=None)
+    @patch(f"{COMPACT_PREDICTIONS}.get_run_logger")
+    def test_first_compaction_reads_every_date(
+        self,
+        _logger,
+        _load_index,
+        mock_list_dates,
+        _load_watermark,
+        mock_read_predictions,
+        mock_write,
+    ):
+        mock_list_dates.return_value = ["2024-01-01", "2024-01-02"]
+        mock_read_predictions.return_value = make_predictions(
+            ["a"], "rock", "2024-01-01"
+        )
+        mock_write.return_value = {"files": [{}]}
+
+        compact_predictions_flow.fn("bucket")
+
+        assert mock_list_dates.call_args.args[-1] is None
+        assert mock_read_predictions.call_args.args[-1] == ["2024-01-01", "2024-01-02"]
+        _, index, _, file_name, _, _ = mock_write.call_args.args
+        assert file_name == "predictions-2024-01-02.parquet"
+        assert index == {
+            "files": [],
+            "last_compacted_date": "2024-01-02",
+            "recent_dates": ["2024-01-01", "2024-01-02"],
+        }
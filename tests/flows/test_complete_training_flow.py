@@ -0,0 +1,98 @@
+from contextlib import nullcontext
+from unittest.mock import MagicMock, patch
+
+from genre_classifier.fingerprint import STAGES_PATH, StageRecord, compute_fingerprint
+from genre_classifier.flows.complete_training.flow import (
+    complete_training_flow,
+    run_stage,
+)
+
+COMPLETE_TRAINING = "genre_classifier.flows.complete_training.flow"
+
+
+@patch("genre_classifier.flows.complete_training.flow.get_run_logger")
+@patch("genre_classifier.flows.complete_training.flow.save_stage_record")
+@patch("genre_classifier.flows.complete_training.flow.load_stage_record")
+class TestCompleteTrainingFlow:
+    def test_run_stage_reuses_matching_completed_run(self, mock_load, mock_save, _):
+        mock_load.return_value = StageRecord(
+            stage="split",
+            fingerprint=compute_fingerprint("split", {"seed": 42}),
+            output="subset",
+            output_fingerprint="abc",
+        )
+        run = MagicMock()
+
+        record, reused = run_stage("split", {"seed": 42}, run, lambda path: "abc")
+
+        assert reused
+        assert record.output == "subset"
+        run.assert_not_called()
+        mock_save.assert_not_called()
+
+    def test_run_stage_reruns_on_changed_inputs(self, mock_load, mock_save, _):
+        mock_load.return_value = StageRecord(
+            stage="split",
+            fingerprint=compute_fingerprint("split", {"seed": 42}),
+            output="subset",
+        )
+
+        record, reused = run_stage(
+            "split", {"seed": 1}, lambda: "subset", lambda path: "def"
+        )
+
+        assert not reused
+        assert record.fingerprint == compute_fingerprint("split", {"seed": 1})
+        assert record.output_fingerprint == "def"
+        mock_save.assert_called_once_with(
+            record, "million-songs-dataset-s3", STAGES_PATH
+        )
+
+    def test_run_stage_reruns_on_changed_output(self, mock_load, mock_save, _):
+        mock_load.return_value = StageRecord(
+            stage="split",
+            fingerprint=compute_fingerprint("split", {"seed": 42}),
+            output="subset",
+            output_fingerprint="abc",
+        )
+        run = MagicMock(return_value="subset")
+
+        _, reused = run_stage("split", {"seed": 42}, run, lambda path: "def")
+
+        assert not reused
+        run.assert_called_once()
+
+    @patch(f"{COMPLETE_TRAINING}.train_flow", return_value=None)
+    @patch(f"{COMPLETE_TRAINING}.split_data_flow", return_value="subset/sample-0.1")
+    @patch(f"{COMPLETE_TRAINING}.preprocess_flow")
+    @patch(f"{COMPLETE_TRAINING}.ingest_flow")
+    @patch(f"{COMPLETE_TRAINING}.artifact_store", nullcontext)
+    @patch(f"{COMPLETE_TRAINING}.split_output_fingerprint", return_value="split")
+    @patch(f"{COMPLETE_TRAINING}.s3_fingerprint", return_value="output")
+    @patch(f"{COMPLETE_TRAINING}.url_fingerprint", return_value={})
+    def test_sampled_runs_keep_their_stage_records_apart(
+        self,
+        _url_fingerprint,
+        _s3_fingerprint,
+        _split_output_fingerprint,
+        mock_ingest_flow,
+        mock_preprocess_flow,
+        mock_split_data_flow,
+        mock_train_flow,
+        mock_load,
+        mock_save,
+        _,
+    ):
+        mock_load.return_value = None
+        mock_ingest_flow.return_value = "subset/sample-0.1/MillionSongSubset"
+        mock_preprocess_flow.return_value = (
+            "subset/sample-0.1/MillionSongSubset/subset.parquet"
+        )
+
+        complete_training_flow.fn("test", sample_fraction=0.1)
+
+        stages_paths = {call.args[2] for call in mock_load.call_args_list}
+        assert stages_paths == {"subset/sample-0.1/_stages"}
+        assert {call.args[2] for call in mock_save.call_args_list} == stages_paths
+        mock_ingest_flow.assert_called_once_with(sample_fraction=0.1)
+        assert mock_train_flow.call_args.kwargs["data_path"] == "subset/sample-0.1"
@@ -0,0 +1,194 @@
+from contextlib import nullcontext
+from unittest.mock import MagicMock, patch
+
+from mlflow.exceptions import MlflowException
+
+from genre_classifier.drift import DatasetDrift
+from genre_classifier.evaluation import DailyPerformance, PerformanceHistory
+from genre_classifier.fingerprint import StageRecord
+from genre_classifier.flows.complete_training import flow as complete_training
+from genre_classifier.flows.model_monitoring import flow as model_monitoring
+from genre_classifier.model_cache import CachedModelVersion
+from genre_classifier.sketches import GenreCounts
+
+MONITORING = "genre_classifier.flows.model_monitoring.flow"
+COMPLETE_TRAINING = "genre_classifier.flows.complete_training.flow"
+
+
+class TestModelMonitoringFlow:
+    @patch(f"{COMPLETE_TRAINING}.train_flow")
+    @patch(f"{COMPLETE_TRAINING}.split_data_flow")
+    @patch(f"{COMPLETE_TRAINING}.preprocess_flow")
+    @patch(f"{COMPLETE_TRAINING}.ingest_flow")
+    @patch(f"{COMPLETE_TRAINING}.artifact_store", nullcontext)
+    @patch(f"{COMPLETE_TRAINING}.save_stage_record")
+    @patch(f"{COMPLETE_TRAINING}.load_stage_record")
+    @patch(f"{COMPLETE_TRAINING}.compute_fingerprint", return_value="unchanged")
+    @patch(f"{COMPLETE_TRAINING}.split_output_fingerprint", return_value="output")
+    @patch(f"{COMPLETE_TRAINING}.s3_fingerprint", return_value="output")
+    @patch(f"{COMPLETE_TRAINING}.url_fingerprint", return_value={})
+    @patch(f"{COMPLETE_TRAINING}.get_run_logger")
+    @patch(f"{MONITORING}.get_training_genre_counts", return_value=None)
+    @patch(f"{MONITORING}.get_model_classes")
+    @patch(f"{MONITORING}.evaluate_new_predictions", return_value=PerformanceHistory())
+    @patch(f"{MONITORING}.get_ground_truth_data")
+    @patch(f"{MONITORING}.calculate_drift")
+    @patch(f"{MONITORING}.get_window_sketch")
+    @patch(f"{MONITORING}.get_reference_sketch")
+    @patch(f"{MONITORING}.get_run_logger")
+    def test_retrain_trains_on_unchanged_data(
+        self,
+        _monitoring_logger,
+        _reference_sketch,
+        _window_sketch,
+        mock_calculate_drift,
+        _ground_truth,
+        _evaluate,
+        _classes,
+        _genre_counts,
+        _training_logger,
+        _url_fingerprint,
+        _s3_fingerprint,
+        _split_output_fingerprint,
+        _compute_fingerprint,
+        mock_load_stage_record,
+        _save_stage_record,
+        mock_ingest_flow,
+        mock_preprocess_flow,
+        mock_split_data_flow,
+        mock_train_flow,
+    ):
+        mock_calculate_drift.return_value = DatasetDrift(
+            columns={}, share_drifted=1.0, dataset_drift=True
+        )
+        mock_train_flow.return_value = None
+        # Every stage completed before on the same data
+        mock_load_stage_record.side_effect = lambda stage, *args: StageRecord(
+            stage=stage,
+            fingerprint="unchanged",
+            output="subset",
+            output_fingerprint="output",
+        )
+
+        with patch(
+            f"{COMPLETE_TRAINING}.complete_training_flow",
+            MagicMock(side_effect=complete_training.complete_training_flow.fn),
+        ) as mock_complete_training_flow:
+            assert model_monitoring.model_monitoring_flow.fn()
+
+        assert mock_complete_training_flow.call_args.kwargs["retrain"]
+        mock_ingest_flow.assert_not_called()
+        mock_preprocess_flow.assert_not_called()
+        mock_split_data_flow.assert_not_called()
+        mock_train_flow.assert_called_once()
+
+    @patch(f"{MONITORING}.get_run_logger")
+    @patch(f"{MONITORING}.get_local_artifact")
+    @patch(f"{MONITORING}.resolve_model_version")
+    def test_get_training_genre_counts(
+        self, mock_resolve, mock_get_local_artifact, _logger, tmp_path
+    ):
+        mock_resolve.return_value = CachedModelVersion(
+            name="genre-classifier-random-forest",
+            version="4",
+            source="s3://bucket/1/run-4/artifacts/model",
+            run_id="run-4",
+            checked_at=0.0,
+        )
+        counts = GenreCounts(rows=10, counts={"rock": 6, "pop": 3})
+        (tmp_path / "genre_counts.json").write_text(counts.model_dump_json())
+        mock_get_local_artifact.return_value = tmp_path
+
+        assert model_monitoring.get_training_genre_counts.fn("dev") == counts
+        assert (
+            mock_get_local_artifact.call_args.args[1]
+            == "runs:/run-4/val_predictions/genre_counts.json"
+        )
+
+        # Models trained before the reference was logged
+        mock_get_local_artifact.side_effect = MlflowException("not found")
+        assert model_monitoring.get_training_genre_counts.fn("dev") is None
+
+    @patch(f"{MONITORING}.load_sketch")
+    @patch(f"{MONITORING}.list_partition_dates")
+    def test_get_window_genre_counts(self, mock_list_dates, mock_load_sketch):
+        mock_list_dates.return_value = ["2024-01-01", "2024-01-06", "2024-01-07"]
+        mock_load_sketch.side_effect = lambda path, bucket, sketch_type: {
+            "subset/predictions/2024-01-06/genre_counts.json": GenreCounts(
+                rows=2, counts={"rock": 2}
+            ),
+            "subset/predictions/2024-01-07/genre_counts.json": GenreCounts(
+                rows=3, counts={"rock": 1, "pop": 2}
+            ),
+        }[path]
+
+        counts = model_monitoring.get_window_genre_counts.fn(
+            "bucket", "subset/predictions", window_days=2
+        )
+
+        assert counts == GenreCounts(rows=5, counts={"rock": 3, "pop": 2})
+
+    @patch(f"{MONITORING}.save_performance_history")
+    @patch(f"{MONITORING}.evaluate_predictions")
+    @patch(f"{MONITORING}.iter_parquet_partitions")
+    @patch(f"{MONITORING}.list_partition_dates")
+    @patch(f"{MONITORING}.load_performance_history")
+    @patch(f"{MONITORING}.get_run_logger")
+    def test_evaluate_new_predictions_lists_from_last_evaluated_date(
+        self,
+        _logger,
+        mock_load_history,
+        mock_list_dates,
+        mock_iter_partitions,
+        mock_evaluate,
+        mock_save_history,
+    ):
+        evaluated = DailyPerformance(rows=1, jaccard_sum=1.0)
+        mock_load_history.return_value = PerformanceHistory(
+            days={"2024-01-01": evaluated, "2024-01-10": evaluated}
+        )
+        # 2024-01-08 was scored late
+        mock_list_dates.return_value = ["2024-01-08", "2024-01-10", "2024-01-11"]
+        mock_iter_partitions.return_value = iter([MagicMock(), MagicMock()])
+        mock_evaluate.return_value = DailyPerformance(rows=2)
+
+        history = model_monitoring.evaluate_new_predictions.fn(
+            None, ["rock"], "bucket", "subset/predictions", "history.json"
+        )
+
+        mock_list_dates.assert_called_once_with(
+            "subset/predictions", "predictions.parquet", "bucket", "2024-01-03"
+        )
+        assert mock_iter_partitions.call_args.args[0] == [
+            "subset/predictions/2024-01-08/predictions.parquet",
+            "subset/predictions/2024-01-11/predictions.parquet",
+        ]
+        assert sorted(history.days) == [
+            "2024-01-01",
+            "2024-01-08",
+            "2024-01-10",
+            "2024-01-11",
+        ]
+        mock_save_history.assert_called_once()
+
+    def test_calculate_prediction_drift(self):
+        reference = GenreCounts(
+            rows=1000, counts={"rock": 600, "pop": 300, "jazz": 100}
+        )
+
+        same = model_monitoring.calculate_prediction_drift.fn(
+            reference,
+            GenreCounts(rows=500, counts={"rock": 300, "pop": 150, "jazz": 50}),
+        )
+        shifted = model_monitoring.calculate_prediction_drift.fn(
+            reference,
+            GenreCounts(rows=500, counts={"rock": 50, "pop": 150, "jazz": 300}),
+        )
+
+        assert not same.drifted
+        assert shifted.drifted
+        # An empty window has no evidence of drift either way
+        assert (
+            model_monitoring.calculate_prediction_drift.fn(reference, GenreCounts())
+            is None
+        )
@@ -0,0 +1,371 @@
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sklearn.preprocessing import MultiLabelBinarizer
+
+from genre_classifier.flows.predict.flow import (
+    get_pending_release_dates,
+    predict_flow,
+    predict_streaming,
+    shadow_predict,
+    split_by_lengths,
+    update_watermark,
+)
+from genre_classifier.flows.train.flow import make_model_pipeline
+from genre_classifier.sketches import GenreCounts
+from genre_classifier.watermark import PredictionWatermark
+
+
+def make_releases(song_ids: list[str]) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "song_id": song_ids,
+            "duration": 200.0,
+            "key": 1,
+            "loudness": -10.0,
+            "mode": 1,
+            "tempo": 120.0,
+            "year": 2000,
+        }
+    ).set_index("song_id")
+
+
+class TestPredictFlow:
+    @patch("genre_classifier.flows.predict.flow.save_watermark")
+    @patch("genre_classifier.flows.predict.flow.list_partition_dates")
+    @patch("genre_classifier.flows.predict.flow.load_watermark")
+    def test_get_pending_release_dates(
+        self, mock_load_watermark, mock_list_partition_dates, mock_save_watermark
+    ):
+        mock_load_watermark.return_value = PredictionWatermark(
+            last_scored_date="2024-01-01", completed=["2024-01-03"]
+        )
+        mock_list_partition_dates.side_effect = [
+            ["2023-12-31", "2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"],
+            ["2023-12-31", "2024-01-01", "2024-01-03"],
+        ]
+
+        pending_dates = get_pending_release_dates.fn(
+            "bucket", "subset/daily", "subset/predictions"
+        )
+
+        assert pending_dates == ["2024-01-02", "2024-01-04"]
+        # The week before the watermark is listed again, for late partitions
+        assert [call.args for call in mock_list_partition_dates.call_args_list] == [
+            ("subset/daily", "releases.parquet", "bucket", "2023-12-25"),
+            ("subset/predictions", "predictions.parquet", "bucket", "2023-12-25"),
+        ]
+        mock_save_watermark.assert_not_called()
+
+    @patch("genre_classifier.flows.predict.flow.get_run_logger")
+    @patch("genre_classifier.flows.predict.flow.save_watermark")
+    @patch("genre_classifier.flows.predict.flow.list_partition_dates")
+    @patch("genre_classifier.flows.predict.flow.load_watermark")
+    def test_get_pending_release_dates_finds_late_partitions(
+        self,
+        mock_load_watermark,
+        mock_list_partition_dates,
+        mock_save_watermark,
+        mock_get_run_logger,
+    ):
+        mock_load_watermark.return_value = PredictionWatermark(
+            last_scored_date="2024-01-03"
+        )
+        # 2024-01-02 arrived after the watermark moved past it
+        mock_list_partition_dates.side_effect = [
+            ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"],
+            ["2024-01-01", "2024-01-03"],
+        ]
+
+        pending_dates = get_pending_release_dates.fn(
+            "bucket", "subset/daily", "subset/predictions", lookback_days=3
+        )
+
+        assert pending_dates == ["2024-01-02", "2024-01-04"]
+        assert mock_list_partition_dates.call_args.args[-1] == "2023-12-31"
+
+    @patch("genre_classifier.flows.predict.flow.get_run_logger")
+    @patch("genre_classifier.flows.predict.flow.save_watermark")
+    @patch("genre_classifier.flows.predict.flow.list_partition_dates")
+    @patch("genre_classifier.flows.predict.flow.load_watermark")
+    def test_get_pending_release_dates_bootstraps_watermark(
+        self,
+        mock_load_watermark,
+        mock_list_partition_dates,
+        mock_save_watermark,
+        mock_get_run_logger,
+    ):
+        mock_load_watermark.return_value = None
+        releases = ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"]
+        mock_list_partition_dates.side_effect = [
+            releases,
+            ["2024-01-01", "2024-01-03"],
+            releases,
+            ["2024-01-01", "2024-01-03"],
+        ]
+
+        pending_dates = get_pending_release_dates.fn(
+            "bucket", "subset/daily", "subset/predictions"
+        )
+
+        assert pending_dates == ["2024-01-02", "2024-01-04"]
+        saved_watermark = mock_save_watermark.call_args.args[0]
+        assert saved_watermark == PredictionWatermark(
+            last_scored_date="2024-01-01", completed=["2024-01-03"]
+        )
+
+    @patch("genre_classifier.flows.predict.flow.get_run_logger")
+    @patch("genre_classifier.flows.predict.flow.save_watermark")
+    @patch("genre_classifier.flows.predict.flow.list_partition_dates")
+    @patch("genre_classifier.flows.predict.flow.load_watermark")
+    def test_update_watermark_merges_overlapping_run(
+        self,
+        mock_load_watermark,
+        mock_list_partition_dates,
+        mock_save_watermark,
+        mock_get_run_logger,
+    ):
+        mock_load_watermark.side_effect = [
+            PredictionWatermark(last_scored_date="2024-01-01"),
+            # Saved by a run that scored later dates in the meantime
+            PredictionWatermark(last_scored_date="2024-01-03"),
+        ]
+        mock_list_partition_dates.return_value = [
+            "2024-01-02",
+            "2024-01-03",
+            "2024-01-04",
+        ]
+
+        watermark = update_watermark.fn(
+            ["2024-01-02"], "bucket", "subset/daily", "subset/predictions"
+        )
+
+        assert watermark == PredictionWatermark(last_scored_date="2024-01-03")
+        mock_save_watermark.assert_called_once_with(
+            watermark, "subset/predictions", "bucket"
+        )
+
+    def test_split_by_lengths(self):
+        df = pd.DataFrame({"a": range(6)})
+        parts = split_by_lengths(df, [1, 0, 5])
+        assert [len(part) for part in parts] == [1, 0, 5]
+        assert parts[2]["a"].tolist() == [1, 2, 3, 4, 5]
+
+    @patch("genre_classifier.flows.predict.flow.save_sketch")
+    @patch("genre_classifier.flows.predict.flow.update_watermark")
+    @patch("genre_classifier.flows.predict.flow.write_parquet_data")
+    @patch("genre_classifier.flows.predict.flow.iter_parquet_partitions")
+    @patch("genre_classifier.flows.predict.flow.fetch_model")
+    @patch("genre_classifier.flows.predict.flow.get_pending_release_dates")
+    def test_predict_flow_backfill(
+        self,
+        mock_get_pending_release_dates,
+        mock_fetch_model,
+        mock_iter_parquet_partitions,
+        mock_write_parquet_data,
+        mock_update_watermark,
+        mock_save_sketch,
+    ):
+        releases = {
+            "subset/daily/2024-01-01/releases.parquet": make_releases(["a", "b"]),
+            "subset/daily/2024-01-02/releases.parquet": make_releases(["c"]),
+        }
+        mock_get_pending_release_dates.return_value = ["2024-01-01", "2024-01-02"]
+        mock_iter_parquet_partitions.side_effect = lambda paths, **kwargs: (
+            pa.Table.from_pandas(releases[path]) for path in paths
+        )
+
+        pipeline = MagicMock()
+        pipeline.predict.side_effect = lambda df: np.ones((len(df), 1), dtype=int)
+        mlb = MultiLabelBinarizer(classes=["rock"]).fit([])
+        mock_fetch_model.side_effect = [pipeline, mlb]
+
+        predict_flow(backfill=True)
+
+        pipeline.predict.assert_called_once()
+        mock_update_watermark.assert_called_once()
+        assert mock_update_watermark.call_args.args[0] == ["2024-01-01", "2024-01-02"]
+        assert len(pipeline.predict.call_args.args[0]) == 3
+        written = {
+            call.args[1]: call.args[0]
+            for call in mock_write_parquet_data.call_args_list
+        }
+        assert sorted(written) == [
+            "subset/predictions/2024-01-01/predictions.parquet",
+            "subset/predictions/2024-01-02/predictions.parquet",
+        ]
+        assert written[
+            "subset/predictions/2024-01-01/predictions.parquet"
+        ].index.tolist() == [
+            "a",
+            "b",
+        ]
+        saved_counts = {
+            call.args[1]: call.args[0] for call in mock_save_sketch.call_args_list
+        }
+        assert saved_counts[
+            "subset/predictions/2024-01-01/genre_counts.json"
+        ] == GenreCounts(rows=2, counts={"rock": 2})
+
+    @patch("genre_classifier.flows.predict.flow.save_sketch")
+    @patch("genre_classifier.flows.predict.flow.get_run_logger")
+    @patch("genre_classifier.flows.predict.flow.upload_file_to_s3")
+    @patch("genre_classifier.flows.predict.flow.download_file_from_s3")
+    def test_predict_streaming(
+        self,
+        mock_download_file_from_s3,
+        mock_upload_file_to_s3,
+        mock_get_run_logger,
+        mock_save_sketch,
+    ):
+        releases = make_releases(list("abcde"))
+        releases["tempo"] = [60.0, 400.0, 120.0, 120.0, 200.0]
+        mock_download_file_from_s3.side_effect = (
+            lambda path, to_path, bucket: releases.to_parquet(to_path)
+        )
+        uploaded = {}
+        mock_upload_file_to_s3.side_effect = (
+            lambda path, to_path, bucket: uploaded.update(
+                {to_path: pd.read_parquet(path)}
+            )
+        )
+
+        pipeline = MagicMock()
+        # Only rows of the second chunk get a genre, so the first chunk has empty lists
+        pipeline.predict.side_effect = lambda df: df.index.isin(["c", "d"]).astype(int)[
+            :, None
+        ]
+        mlb = MultiLabelBinarizer(classes=["rock"]).fit([])
+
+        n_rows = predict_streaming.fn(
+            "2024-01-01",
+            pipeline,
+            mlb,
+            "bucket",
+            "subset/daily",
+            "subset/predictions",
+            chunk_size=2,
+            workers=2,
+        )
+
+        assert n_rows == 5
+        assert pipeline.predict.call_count == 3
+        tempos = pd.concat(
+            call.args[0]["tempo"] for call in pipeline.predict.call_args_list
+        )
+        np.testing.assert_array_equal(
+            tempos.sort_index(), [120.0, np.nan, 120.0, 120.0, 100.0]
+        )
+        predictions = uploaded["subset/predictions/2024-01-01/predictions.parquet"]
+        assert predictions.index.tolist() == list("abcde")
+        assert [list(genres) for genres in predictions["genres"]] == [
+            [],
+            [],
+            ["rock"],
+            ["rock"],
+            [],
+        ]
+        mock_save_sketch.assert_called_once_with(
+            GenreCounts(rows=5, counts={"rock": 2}),
+            "subset/predictions/2024-01-01/genre_counts.json",
+            "bucket",
+        )
+
+    @patch("genre_classifier.flows.predict.flow.save_sketch")
+    @patch("genre_classifier.flows.predict.flow.get_run_logger")
+    @patch("genre_classifier.flows.predict.flow.upload_file_to_s3")
+    @patch("genre_classifier.flows.predict.flow.download_file_from_s3")
+    def test_predict_streaming_empty_partition(
+        self,
+        mock_download_file_from_s3,
+        mock_upload_file_to_s3,
+        mock_get_run_logger,
+        mock_save_sketch,
+    ):
+        mock_download_file_from_s3.side_effect = (
+            lambda path, to_path, bucket: make_releases([]).to_parquet(to_path)
+        )
+        uploaded = {}
+        mock_upload_file_to_s3.side_effect = (
+            lambda path, to_path, bucket: uploaded.update(
+                {to_path: pd.read_parquet(path)}
+            )
+        )
+        releases = make_releases([f"s{i}" for i in range(10)])
+        labels = np.arange(20).reshape(10, 2) % 2
+        pipeline = make_model_pipeline(impute_missing_values=False, seed=1)
+        pipeline.fit(releases, labels)
+        mlb = MultiLabelBinarizer(classes=["pop", "rock"]).fit([])
+
+        for kwargs, columns in [
+            ({}, ["genres"]),
+            ({"output_scores": True}, ["genres", "genre_scores"]),
+            ({"top_k_scores": 1}, ["genres", "top_genres", "top_scores"]),
+        ]:
+            n_rows = predict_streaming.fn(
+                "2024-01-01",
+                pipeline,
+                mlb,
+                "bucket",
+                "subset/daily",
+                "subset/predictions",
+                chunk_size=2,
+                **kwargs,
+            )
+
+            assert n_rows == 0
+            predictions = uploaded["subset/predictions/2024-01-01/predictions.parquet"]
+            assert len(predictions) == 0
+            assert list(predictions.columns) == columns
+            assert predictions.index.name == "song_id"
+
+    def test_shadow_predict_shares_identical_preprocessing(self):
+        rng = np.random.default_rng(0)
+        releases = pd.DataFrame(
+            {
+                "song_id": [f"s{i}" for i in range(40)],
+                "duration": rng.uniform(100, 300, 40),
+                "key": rng.integers(0, 12, 40),
+                "loudness": rng.uniform(-20, 0, 40),
+                "mode": rng.integers(0, 2, 40),
+                "tempo": rng.uniform(70, 180, 40),
+                "year": rng.integers(1990, 2010, 40),
+            }
+        ).set_index("song_id")
+        labels = rng.integers(0, 2, (40, 2))
+        mlb = MultiLabelBinarizer(classes=["pop", "rock"]).fit([])
+
+        first = make_model_pipeline(impute_missing_values=False, seed=1)
+        first.fit(releases, labels)
+        second = make_model_pipeline(impute_missing_values=False, seed=2)
+        second.fit(releases, labels)
+        # Same fitted preprocessing as the first model, different classifier
+        same_preprocessing = make_model_pipeline(impute_missing_values=False, seed=3)
+        same_preprocessing.steps[0] = first.steps[0]
+        same_preprocessing[-1].fit(first[:-1].transform(releases), labels)
+        expected = {
+            label: pipeline.predict(releases.copy())
+            for label, pipeline in [("a", first), ("b", same_preprocessing)]
+        }
+        different = make_model_pipeline(impute_missing_values=False, seed=1)
+        different.fit(releases.assign(duration=releases["duration"] * 2), labels)
+
+        shadow, latencies = shadow_predict.fn(
+            releases,
+            {"a": first, "b": same_preprocessing, "c": different},
+            {"a": mlb, "b": mlb, "c": mlb},
+        )
+
+        assert list(shadow.columns) == ["genres_a", "genres_b", "genres_c"]
+        assert shadow.index.tolist() == releases.index.tolist()
+        assert [latencies[label]["preprocessing_shared"] for label in "abc"] == [
+            False,
+            True,
+            False,
+        ]
+        for label in "ab":
+            assert [list(genres) for genres in shadow[f"genres_{label}"]] == [
+                list(genres) for genres in mlb.inverse_transform(expected[label])
+            ]
@@ -1,12 +1,15 @@
 from unittest.mock import MagicMock, patch
 
+import numpy as np
 import pandas as pd
 
 from genre_classifier.flows.train.flow import (
+    FEATURE_COLS,
     eval,
     filter_top_genres,
     fix_outliers,
     get_top_genres,
+    load_feature_set,
     read_data,
     train,
     train_flow,
@@ -59,9 +62,10 @@ class TestTrainFlow:
         mock_fix_outliers.assert_called_once_with(df, 70, 180)
         assert not result_df.empty
 
+    @patch("mlflow.log_artifact")
     @patch("mlflow.sklearn.log_model")
     @patch("mlflow.log_metric")
-    def test_train(self, mock_log_metric, mock_log_model):
+    def test_train(self, mock_log_metric, mock_log_model, mock_log_artifact):
         df = pd.DataFrame(
             {
                 "duration": [1, 2],
@@ -78,12 +82,16 @@ class TestTrainFlow:
         assert pipeline is not None
         assert mlb is not None
         mock_log_model.assert_called()
+        mock_log_artifact.assert_called_once()
         mock_log_metric.assert_called()
 
-    @patch("mlflow.log_metric")
+    @patch("mlflow.log_dict")
+    @patch("mlflow.log_metrics")
     @patch("mlflow.register_model")
     @patch("mlflow.active_run")
-    def test_eval(self, mock_active_run, mock_register_model, mock_log_metric):
+    def test_eval(
+        self, mock_active_run, mock_register_model, mock_log_metrics, mock_log_dict
+    ):
         df = pd.DataFrame(
             {
                 "duration": [1, 2],
@@ -97,13 +105,58 @@ class TestTrainFlow:
         )
         pipeline = MagicMock()
         mlb = MagicMock()
+        mlb.classes_ = ["rock", "pop"]
         mlb.transform.return_value = [[1, 0], [0, 1]]
         pipeline.predict.return_value = [[1, 0], [0, 1]]
         result = eval(df, pipeline, mlb, True, 0.0, 1.0, True)
         assert result
-        mock_log_metric.assert_called()
+        metrics = mock_log_metrics.call_args.args[0]
+        assert metrics["jaccard_score_val"] == 1.0
+        assert metrics["f1_val/rock"] == 1.0
+        logged = {call.args[1]: call.args[0] for call in mock_log_dict.call_args_list}
+        assert logged["val_predictions/genre_counts.json"] == {
+            "rows": 2,
+            "counts": {"rock": 1, "pop": 1},
+        }
+        assert "evaluation_val.json" in logged
         mock_register_model.assert_called()
 
+    @patch("mlflow.log_dict")
+    @patch("mlflow.log_metrics")
+    @patch("mlflow.register_model")
+    @patch("mlflow.active_run")
+    def test_eval_gates_on_confidence_bound(
+        self, mock_active_run, mock_register_model, mock_log_metrics, mock_log_dict
+    ):
+        rng = np.random.default_rng(0)
+        y_true = rng.random((200, 2)) < 0.5
+        y_true[:, 0] = True
+        y_pred = y_true.copy()
+        y_pred[:40] = ~y_pred[:40]
+        df = pd.DataFrame({column: np.zeros(200) for column in FEATURE_COLS})
+        pipeline = MagicMock()
+        pipeline.predict.return_value = y_pred
+        mlb = MagicMock()
+        mlb.classes_ = ["rock", "pop"]
+
+        # The point estimate of the Jaccard score is 0.8
+        assert eval(df, pipeline, mlb, True, 0.78, 1.0, "dev", y_true=y_true)
+        jaccard = mock_log_metrics.call_args.args[0]["jaccard_score_val_lower"]
+        assert jaccard < 0.78
+        assert not eval(
+            df,
+            pipeline,
+            mlb,
+            True,
+            0.78,
+            1.0,
+            "dev",
+            y_true=y_true,
+            gate_on_confidence_bound=True,
+        )
+        # The classifier and the binarizer, for the first evaluation only
+        assert mock_register_model.call_count == 2
+
     @patch("genre_classifier.flows.train.flow.set_aws_credential_env")
     @patch("genre_classifier.flows.train.flow.read_data")
     @patch("genre_classifier.flows.train.flow.get_top_genres")
@@ -153,3 +206,44 @@ class TestTrainFlow:
         mock_log_params.assert_called()
         mock_start_run.assert_called()
         mock_end_run.assert_called()
+
+    @patch("genre_classifier.flows.train.flow.s3_fingerprint")
+    @patch("genre_classifier.flows.train.flow.read_data")
+    def test_load_feature_set(self, mock_read_data, mock_s3_fingerprint, tmp_path):
+        mock_s3_fingerprint.return_value = "etag"
+        data = pd.DataFrame(
+            {
+                "duration": [200.0, 180.0, 240.0],
+                "key": [1, 2, 3],
+                "loudness": [-5.0, -7.0, -9.0],
+                "mode": [0, 1, 1],
+                "tempo": [60.0, 400.0, 90.0],
+                "year": [0, 2000, 1999],
+                "genres": [["rock", "pop"], ["jazz"], ["rock"]],
+            },
+            index=pd.Index(["a", "b", "c"], name="song_id"),
+        )
+        mock_read_data.fn.side_effect = (
+            lambda path, bucket_block_name, sample_fraction: (data.copy())
+        )
+
+        feature_set = load_feature_set(top_k_genres=2, feature_store_dir=tmp_path)
+        train_split = feature_set["train"]
+        assert feature_set.info.classes == ["rock", "pop"]
+        assert train_split.song_ids.to_pylist() == ["a", "c"]
+        np.testing.assert_array_equal(train_split.y, [[1, 1], [1, 0]])
+        np.testing.assert_array_equal(train_split.X["tempo"], [120.0, 90.0])
+        assert mock_read_data.fn.call_count == 2
+
+        reopened = load_feature_set(top_k_genres=2, feature_store_dir=tmp_path)
+        assert reopened.info.key == feature_set.info.key
+        assert mock_read_data.fn.call_count == 2
+
+        load_feature_set(top_k_genres=1, feature_store_dir=tmp_path)
+        assert mock_read_data.fn.call_count == 4
+
+        load_feature_set(
+            top_k_genres=1, feature_store_dir=tmp_path, sample_fraction=0.5
+        )
+        assert mock_read_data.fn.call_count == 6
+        assert mock_read_data.fn.call_args.args[2] == 0.5
@@ -0,0 +1,91 @@
+import io
+import threading
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from genre_classifier.artifact_store import artifact_store, get_active_store
+from genre_classifier.utils import read_parquet_data, write_parquet_data
+
+
+class TestArtifactStore:
+    @patch("genre_classifier.utils.download_file_from_s3")
+    @patch("genre_classifier.artifact_store.S3Bucket.load")
+    def test_tables_are_handed_off_in_memory_and_persisted(
+        self, mock_load, mock_download
+    ):
+        uploaded = {}
+        release_upload = threading.Event()
+
+        def write_path(path, content):
+            release_upload.wait(timeout=5)
+            uploaded[path] = content
+
+        mock_load.return_value.write_path.side_effect = write_path
+        df = pd.DataFrame(
+            {"tempo": [120.0, 90.5]}, index=pd.Index(["a", "b"], name="song_id")
+        )
+
+        with artifact_store() as store:
+            write_parquet_data(df, "subset/train.parquet")
+            # Served from memory while the upload is still in flight
+            pd.testing.assert_frame_equal(read_parquet_data("subset/train.parquet"), df)
+            assert uploaded == {}
+            release_upload.set()
+            store.flush()
+            assert list(uploaded) == ["subset/train.parquet"]
+
+        assert get_active_store() is None
+        mock_download.assert_not_called()
+        persisted = pq.read_table(io.BytesIO(uploaded["subset/train.parquet"]))
+        pd.testing.assert_frame_equal(persisted.to_pandas(), df)
+
+    @patch("genre_classifier.artifact_store.S3Bucket.load")
+    def test_upload_errors_are_raised_on_close(self, mock_load):
+        mock_load.return_value = MagicMock(
+            write_path=MagicMock(side_effect=OSError("upload failed"))
+        )
+
+        with pytest.raises(OSError, match="upload failed"):
+            with artifact_store():
+                write_parquet_data(pd.DataFrame({"a": [1]}), "subset/a.parquet")
+
+        assert get_active_store() is None
+
+    @patch("genre_classifier.artifact_store.S3Bucket.load")
+    def test_uploads_to_the_same_path_keep_write_order(self, mock_load):
+        uploaded = []
+        second_uploaded = threading.Event()
+
+        def write_path(path, content):
+            value = pq.read_table(io.BytesIO(content))["a"][0].as_py()
+            if value == 1:
+                # Without ordering, the second upload finishes while this one waits
+                second_uploaded.wait(timeout=0.5)
+            uploaded.append(value)
+            if value == 2:
+                second_uploaded.set()
+
+        mock_load.return_value.write_path.side_effect = write_path
+
+        with artifact_store() as store:
+            write_parquet_data(pd.DataFrame({"a": [1]}), "subset/a.parquet")
+            write_parquet_data(pd.DataFrame({"a": [2]}), "subset/a.parquet")
+            store.flush()
+
+        assert uploaded == [1, 2]
+
+    @patch("genre_classifier.artifact_store.S3Bucket.load")
+    def test_errors_of_overwritten_uploads_are_raised(self, mock_load):
+        def write_path(path, content):
+            if pq.read_table(io.BytesIO(content))["a"][0].as_py() == 1:
+                raise OSError("upload failed")
+
+        mock_load.return_value.write_path.side_effect = write_path
+
+        with pytest.raises(OSError, match="upload failed"):
+            with artifact_store():
+                write_parquet_data(pd.DataFrame({"a": [1]}), "subset/a.parquet")
+                write_parquet_data(pd.DataFrame({"a": [2]}), "subset/a.parquet")
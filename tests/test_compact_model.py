@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.compose import make_column_transformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.impute import KNNImputer
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import MinMaxScaler
+
+from genre_classifier.compact_model import export_compact_model, load_compact_model
+
+
+def make_data(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "duration": rng.normal(240, 60, n),
+            "key": rng.integers(0, 12, n),
+            "loudness": rng.normal(-10, 4, n),
+            "mode": rng.integers(0, 2, n),
+            "tempo": rng.normal(120, 25, n),
+            "year": rng.integers(1960, 2011, n).astype(float),
+        }
+    )
+    df.loc[rng.random(n) < 0.3, "year"] = np.nan
+    df.loc[rng.random(n) < 0.05, "tempo"] = np.nan
+    return df
+
+
+class TestCompactModel:
+    @pytest.mark.parametrize("impute_missing_values", [True, False])
+    def test_predictions_match_pipeline(self, tmp_path, impute_missing_values):
+        train_data = make_data(500)
+        y = (np.random.default_rng(1).random((500, 4)) < 0.3).astype(int)
+        steps = [
+            make_column_transformer(
+                (MinMaxScaler(clip=True), ["duration", "loudness", "tempo", "year"]),
+                ("passthrough", ["mode"]),
+                remainder="drop",
+            )
+        ]
+        if impute_missing_values:
+            steps.append(
+                KNNImputer(n_neighbors=5, weights="distance").set_output(
+                    transform="pandas"
+                )
+            )
+        steps.append(RandomForestClassifier(n_estimators=10, random_state=42))
+        pipeline = make_pipeline(*steps).fit(train_data, y)
+
+        model_path = export_compact_model(pipeline, tmp_path / "model.gcm")
+        model = load_compact_model(model_path)
+
+        test_data = make_data(200, seed=2)
+        np.testing.assert_array_equal(
+            model.predict(test_data), pipeline.predict(test_data)
+        )
+        for compact_proba, proba in zip(
+            model.predict_proba(test_data), pipeline.predict_proba(test_data)
+        ):
+            np.testing.assert_allclose(compact_proba, proba)
+
+    def test_load_rejects_other_files(self, tmp_path):
+        path = tmp_path / "model.pkl"
+        path.write_bytes(b"not a model")
+        with pytest.raises(ValueError):
+            load_compact_model(path)
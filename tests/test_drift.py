@@ -0,0 +1,79 @@
+import numpy as np
+from scipy import stats
+
+from genre_classifier.drift import categorical_drift, numerical_drift, sketch_drift
+from genre_classifier.sketches import PartitionSketch, compute_sketch
+from tests.test_sketches import make_features
+
+
+class TestDrift:
+    def test_numerical_drift_matches_scipy(self):
+        rng = np.random.default_rng(0)
+        reference = rng.normal(0, 1, 500)
+        current = rng.normal(0.3, 1, 400)
+
+        drift = numerical_drift("x", reference, current)
+
+        ks = stats.ks_2samp(reference, current)
+        assert np.isclose(drift.ks_statistic, ks.statistic)
+        assert np.isclose(drift.ks_p_value, ks.pvalue, rtol=0.2)
+        assert np.isclose(
+            drift.wasserstein_normed,
+            stats.wasserstein_distance(reference, current) / reference.std(),
+        )
+        assert drift.drifted
+
+    def test_numerical_drift_with_weights_equals_repeated_values(self):
+        values = np.array([1.0, 2.0, 3.0])
+        weights = np.array([3, 1, 2])
+        current = np.array([1.0, 3.0, 3.0, 4.0])
+
+        weighted = numerical_drift("x", values, current, reference_weights=weights)
+        repeated = numerical_drift("x", np.repeat(values, weights), current)
+
+        assert weighted == repeated
+
+    def test_categorical_drift(self):
+        reference = {"0": 500, "1": 500}
+        assert not categorical_drift("mode", reference, {"0": 48, "1": 52}).drifted
+        drift = categorical_drift("mode", reference, {"0": 80, "1": 20})
+        assert drift.drifted
+        assert drift.chi2_p_value < 0.05
+
+    def test_sketch_drift_detects_shift(self):
+        reference = compute_sketch(make_features(5000, seed=0))
+        same = compute_sketch(make_features(5000, seed=1))
+        shifted = compute_sketch(make_features(5000, seed=1, tempo_shift=30))
+
+        no_drift = sketch_drift(reference, same)
+        assert not no_drift.dataset_drift
+        assert max(column.psi for column in no_drift.columns.values()) < 0.05
+
+        drift = sketch_drift(reference, shifted)
+        assert drift.columns["tempo"].drifted
+        assert drift.columns["tempo"].psi > 0.2
+        assert not drift.columns["duration"].drifted
+        assert drift.share_drifted == 1 / 6
+        assert not drift.dataset_drift
+
+    def test_sketch_drift_of_empty_window(self):
+        reference = compute_sketch(make_features(1000))
+
+        drift = sketch_drift(reference, PartitionSketch())
+
+        assert drift.insufficient_data
+        assert not drift.dataset_drift
+        assert all(column.insufficient_data for column in drift.columns.values())
+
+    def test_sketch_drift_of_all_missing_column(self):
+        reference = compute_sketch(make_features(1000))
+        current = make_features(1000, seed=1)
+        current["tempo"] = np.nan
+
+        drift = sketch_drift(reference, compute_sketch(current))
+
+        assert drift.columns["tempo"].insufficient_data
+        assert not drift.columns["tempo"].drifted
+        assert not drift.columns["duration"].insufficient_data
+        assert not drift.insufficient_data
+        assert not drift.dataset_drift
@@ -0,0 +1,158 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import (
+    f1_score,
+    hamming_loss,
+    jaccard_score,
+    precision_recall_fscore_support,
+)
+from sklearn.preprocessing import MultiLabelBinarizer
+
+from genre_classifier.evaluation import (
+    DailyPerformance,
+    PerformanceHistory,
+    binarize,
+    bootstrap_evaluation,
+    bootstrap_weights,
+    confusion_counts,
+    evaluate_predictions,
+    join_on_song_id,
+)
+
+CLASSES = ["jazz", "pop", "rock"]
+
+
+def make_genres(n: int, seed: int) -> list[list[str]]:
+    rng = np.random.default_rng(seed)
+    return [
+        [genre for genre in CLASSES + ["other"] if rng.random() < 0.4] for _ in range(n)
+    ]
+
+
+class TestEvaluation:
+    def test_binarize_matches_multi_label_binarizer(self):
+        genres = make_genres(50, seed=0)
+        mlb = MultiLabelBinarizer(classes=CLASSES).fit([])
+
+        with warnings.catch_warnings():
+            # Unknown genres are ignored with a warning
+            warnings.simplefilter("ignore", UserWarning)
+            expected = mlb.transform(genres).astype(bool)
+        np.testing.assert_array_equal(binarize(pd.Series(genres), CLASSES), expected)
+
+    def test_join_on_song_id(self):
+        predictions = pd.DataFrame(index=pd.Index(["c", "x", "a"]))
+        ground_truth = pd.DataFrame(index=pd.Index(["b", "a", "c"]))
+
+        prediction_rows, truth_rows = join_on_song_id(predictions, ground_truth)
+
+        assert prediction_rows.tolist() == [0, 2]
+        assert truth_rows.tolist() == [2, 1]
+
+    def test_evaluate_predictions_matches_sklearn(self):
+        ids = [f"s{i}" for i in range(200)]
+        ground_truth = pd.DataFrame(
+            {"genres": make_genres(200, seed=1)}, index=pd.Index(ids)
+        ).sample(frac=1, random_state=0)
+        predictions = pd.DataFrame(
+            {"genres": make_genres(150, seed=2)}, index=pd.Index(ids[50:])
+        )
+
+        performance = evaluate_predictions(predictions, ground_truth, CLASSES)
+
+        y_true = binarize(ground_truth.loc[predictions.index, "genres"], CLASSES)
+        y_pred = binarize(predictions["genres"], CLASSES)
+        labelled = y_true.any(axis=1)
+        assert performance.rows == labelled.sum()
+        assert np.isclose(
+            performance.jaccard_sum / performance.rows,
+            jaccard_score(y_true[labelled], y_pred[labelled], average="samples"),
+        )
+        assert np.isclose(
+            performance.hamming_sum / performance.rows,
+            hamming_loss(y_true[labelled], y_pred[labelled]),
+        )
+
+    def test_performance_history_summary(self):
+        history = PerformanceHistory(
+            days={
+                "2024-01-01": DailyPerformance(rows=10, jaccard_sum=5, hamming_sum=1),
+                "2024-01-02": DailyPerformance(rows=30, jaccard_sum=3, hamming_sum=3),
+            }
+        )
+
+        assert history.summary() == {
+            "rows": 40,
+            "jaccard_score": 0.2,
+            "hamming_loss": 0.1,
+        }
+        assert history.summary(["2024-01-01"])["jaccard_score"] == 0.5
+        assert history.summary([])["rows"] == 0
+
+    def test_confusion_counts(self):
+        y_true = np.array([[1, 0], [1, 1], [0, 0]], dtype=bool)
+        y_pred = np.array([[1, 1], [0, 1], [0, 0]], dtype=bool)
+
+        counts = confusion_counts(y_true, y_pred)
+
+        # True negatives, false positives, false negatives, true positives
+        assert counts.tolist() == [[1, 0, 1, 1], [1, 1, 0, 1]]
+
+    def test_bootstrap_evaluation_matches_sklearn(self):
+        y_true = binarize(pd.Series(make_genres(300, seed=3)), CLASSES)
+        y_pred = binarize(pd.Series(make_genres(300, seed=4)), CLASSES)
+
+        evaluation = bootstrap_evaluation(y_true, y_pred, CLASSES, seed=0)
+
+        precision, recall, f1, support = precision_recall_fscore_support(
+            y_true, y_pred, average=None, zero_division=0
+        )
+        for i, genre in enumerate(CLASSES):
+            genre_evaluation = evaluation.genres[genre]
+            assert genre_evaluation.support == support[i]
+            assert np.isclose(genre_evaluation.precision.estimate, precision[i])
+            assert np.isclose(genre_evaluation.recall.estimate, recall[i])
+            assert np.isclose(genre_evaluation.f1.estimate, f1[i])
+        assert np.isclose(
+            evaluation.jaccard_score.estimate,
+            jaccard_score(y_true, y_pred, average="samples", zero_division=0),
+        )
+        assert np.isclose(
+            evaluation.hamming_loss.estimate, hamming_loss(y_true, y_pred)
+        )
+        assert np.isclose(
+            evaluation.macro_f1.estimate, f1_score(y_true, y_pred, average="macro")
+        )
+        assert np.isclose(
+            evaluation.micro_f1.estimate, f1_score(y_true, y_pred, average="micro")
+        )
+
+    def test_bootstrap_intervals(self):
+        y_true = binarize(pd.Series(make_genres(2000, seed=5)), CLASSES)
+        y_pred = binarize(pd.Series(make_genres(2000, seed=6)), CLASSES)
+
+        evaluation = bootstrap_evaluation(y_true, y_pred, CLASSES, seed=0)
+        small = bootstrap_evaluation(y_true[:200], y_pred[:200], CLASSES, seed=0)
+
+        for interval in [evaluation.jaccard_score, evaluation.genres["pop"].f1]:
+            assert interval.lower < interval.estimate < interval.upper
+        width = evaluation.jaccard_score.upper - evaluation.jaccard_score.lower
+        small_width = small.jaccard_score.upper - small.jaccard_score.lower
+        assert width < small_width
+        assert evaluation == bootstrap_evaluation(y_true, y_pred, CLASSES, seed=0)
+
+    def test_bootstrap_weights(self):
+        weights = bootstrap_weights(10, 50, np.random.default_rng(0))
+
+        assert weights.shape == (50, 10)
+        assert (weights.sum(axis=1) == 10).all()
+
+    def test_bootstrap_evaluation_without_rows(self):
+        no_rows = np.zeros((0, len(CLASSES)), dtype=bool)
+
+        evaluation = bootstrap_evaluation(no_rows, no_rows, CLASSES)
+
+        assert evaluation.rows == 0
+        assert evaluation.genres["rock"].f1.lower == 0
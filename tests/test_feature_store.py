@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+from genre_classifier.feature_store import (
+    feature_set_key,
+    materialize_feature_set,
+    open_feature_set,
+)
+from genre_classifier.sketches import GenreCounts
+
+FEATURE_COLS = ["tempo", "year"]
+
+
+def make_splits() -> dict[str, tuple[pd.DataFrame, np.ndarray]]:
+    train = pd.DataFrame(
+        {"tempo": [120.0, 90.0, np.nan], "year": [2000.0, np.nan, 1999.0]},
+        index=pd.Index(["a", "b", "c"], name="song_id"),
+    )
+    val = pd.DataFrame(
+        {"tempo": [100.0], "year": [1990.0]}, index=pd.Index(["d"], name="song_id")
+    )
+    return {
+        "train": (train, np.array([[1, 0], [0, 1], [1, 1]])),
+        "val": (val, np.array([[0, 1]])),
+    }
+
+
+def is_memory_mapped(array) -> bool:
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def test_materialize_and_open_feature_set(tmp_path):
+    key = feature_set_key({"data": "etag", "top_k_genres": 2})
+    assert open_feature_set(key, tmp_path) is None
+
+    materialize_feature_set(
+        key,
+        {"data": "etag", "top_k_genres": 2},
+        make_splits(),
+        FEATURE_COLS,
+        ["rock", "pop"],
+        GenreCounts(rows=3, counts={"rock": 2, "pop": 2}),
+        tmp_path,
+    )
+    feature_set = open_feature_set(key, tmp_path)
+
+    assert feature_set.info.classes == ["rock", "pop"]
+    assert feature_set.info.rows == {"train": 3, "val": 1}
+    train = feature_set["train"]
+    pd.testing.assert_frame_equal(
+        train.X, make_splits()["train"][0].reset_index(drop=True)
+    )
+    np.testing.assert_array_equal(train.y, [[1, 0], [0, 1], [1, 1]])
+    assert train.y.dtype == np.uint8
+    assert train.song_ids.to_pylist() == ["a", "b", "c"]
+    assert feature_set["val"].song_ids.to_pylist() == ["d"]
+
+
+def test_feature_set_is_memory_mapped(tmp_path):
+    key = feature_set_key({"data": "etag"})
+    feature_set = materialize_feature_set(
+        key,
+        {"data": "etag"},
+        make_splits(),
+        FEATURE_COLS,
+        ["rock", "pop"],
+        GenreCounts(rows=3),
+        tmp_path,
+    )
+
+    train = feature_set["train"]
+
+    assert is_memory_mapped(train.y)
+    assert all(is_memory_mapped(train.X[column].to_numpy()) for column in FEATURE_COLS)
+
+
+def test_feature_set_key_depends_on_inputs():
+    assert feature_set_key({"data": "a", "valid_tempo_min": 70}) == feature_set_key(
+        {"valid_tempo_min": 70, "data": "a"}
+    )
+    assert feature_set_key({"data": "a"}) != feature_set_key({"data": "b"})
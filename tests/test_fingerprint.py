@@ -0,0 +1,51 @@
+from unittest.mock import MagicMock, patch
+
+from genre_classifier.fingerprint import compute_fingerprint, s3_fingerprint
+
+
+def make_bucket(objects: dict[str, str]) -> MagicMock:
+    bucket = MagicMock()
+    bucket.bucket_name = "test-bucket"
+    bucket.bucket_folder = ""
+    paginator = bucket.credentials.get_s3_client.return_value.get_paginator.return_value
+    paginator.paginate.side_effect = lambda Bucket, Prefix: [
+        {
+            "Contents": [
+                {"Key": key, "ETag": etag}
+                for key, etag in sorted(objects.items())
+                if key.startswith(Prefix)
+            ]
+        }
+    ]
+    return bucket
+
+
+class TestFingerprint:
+    def test_compute_fingerprint_ignores_key_order(self):
+        assert compute_fingerprint("split", {"a": 1, "b": 2}) == compute_fingerprint(
+            "split", {"b": 2, "a": 1}
+        )
+        assert compute_fingerprint("split", {"a": 1}) != compute_fingerprint(
+            "train", {"a": 1}
+        )
+        assert compute_fingerprint("split", {"a": 1}) != compute_fingerprint(
+            "split", {"a": 2}
+        )
+
+    @patch("genre_classifier.fingerprint.S3Bucket.load")
+    def test_s3_fingerprint_follows_matching_objects_only(self, mock_load):
+        objects = {
+            "subset/songs/a.h5": '"1"',
+            "subset/songs/b.h5": '"2"',
+            "subset/songs/subset.parquet": '"3"',
+            "subset/songs-other/c.h5": '"4"',
+        }
+        mock_load.return_value = make_bucket(objects)
+        fingerprint = s3_fingerprint("subset/songs", ".h5")
+
+        objects["subset/songs/subset.parquet"] = '"5"'
+        objects["subset/songs-other/c.h5"] = '"6"'
+        assert s3_fingerprint("subset/songs", ".h5") == fingerprint
+
+        objects["subset/songs/b.h5"] = '"7"'
+        assert s3_fingerprint("subset/songs", ".h5") != fingerprint
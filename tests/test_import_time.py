@@ -0,0 +1,64 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+TRAINING_STACK = ["mlflow", "sklearn", "joblib", "evidently", "h5py"]
+
+# Flow module, heavy modules it must not import at load, budget in seconds for
+# everything except prefect itself, which every flow pays
+FLOW_ENTRY_POINTS = [
+    ("genre_classifier.flows.predict.flow", TRAINING_STACK, 1.5),
+    ("genre_classifier.flows.compact_predictions.flow", TRAINING_STACK, 1.5),
+    ("genre_classifier.flows.ingest_data.flow", TRAINING_STACK, 1.5),
+    ("genre_classifier.flows.split_data.flow", TRAINING_STACK, 2.0),
+    ("genre_classifier.flows.model_monitoring.flow", TRAINING_STACK, 2.5),
+    ("genre_classifier.flows.preprocess.flow", ["mlflow", "sklearn", "evidently"], 2.5),
+]
+
+# Wall-clock budgets depend on the machine, so they are only checked on request
+CHECK_IMPORT_BUDGETS = os.environ.get("GENRE_CLASSIFIER_CHECK_IMPORT_BUDGETS") == "1"
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|(\s+)(\S+)$")
+
+
+def import_times(module: str) -> dict[str, float]:
+    """Cumulative import time in seconds of every top-level package imported by
+    importing `module` in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        cumulative, name = int(match.group(1)) / 1e6, match.group(3)
+        times[name] = max(times.get(name, 0.0), cumulative)
+    return times
+
+
+@pytest.mark.parametrize(
+    "module,forbidden",
+    [(module, forbidden) for module, forbidden, _ in FLOW_ENTRY_POINTS],
+)
+def test_flow_import_skips_heavy_modules(module, forbidden):
+    times = import_times(module)
+
+    imported = sorted({name.split(".")[0] for name in times} & set(forbidden))
+    assert imported == []
+
+
+@pytest.mark.skipif(
+    not CHECK_IMPORT_BUDGETS, reason="set GENRE_CLASSIFIER_CHECK_IMPORT_BUDGETS=1"
+)
+@pytest.mark.parametrize("module,_forbidden,budget_seconds", FLOW_ENTRY_POINTS)
+def test_flow_import_time(module, _forbidden, budget_seconds):
+    times = import_times(module)
+
+    assert times[module] - times.get("prefect", 0.0) < budget_seconds
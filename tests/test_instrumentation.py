@@ -0,0 +1,130 @@
+import asyncio
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from prefect import flow, task
+from pydantic import BaseModel
+
+from genre_classifier.instrumentation import (
+    data_size,
+    instrumented,
+    instrumented_flow,
+)
+
+
+class SongMetadata(BaseModel):
+    song_id: str
+
+
+@task
+@instrumented
+def double(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.concat([df, df])
+
+
+@task
+@instrumented
+async def async_double(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.concat([df, df])
+
+
+@flow
+@instrumented_flow
+def child_flow(df: pd.DataFrame) -> pd.DataFrame:
+    return double(df)
+
+
+@flow
+@instrumented_flow
+def parent_flow(df: pd.DataFrame) -> pd.DataFrame:
+    return double(child_flow(df))
+
+
+@flow
+@instrumented_flow
+def repeating_flow(df: pd.DataFrame) -> pd.DataFrame:
+    return double(double(df))
+
+
+@flow
+@instrumented_flow
+async def async_flow(df: pd.DataFrame) -> pd.DataFrame:
+    return await async_double(df)
+
+
+class TestInstrumentation:
+    def test_data_size(self):
+        df = pd.DataFrame({"a": np.arange(10, dtype=np.int64)})
+        table = pa.table({"a": np.arange(5, dtype=np.int64)})
+        assert data_size(table) == (5, 40)
+        assert data_size((df, "model")) == (10, df.memory_usage(index=True).sum())
+        assert data_size({"x": np.zeros((3, 2))}) == (3, 48)
+        assert data_size([SongMetadata(song_id="a"), SongMetadata(song_id="b")]) == (
+            2,
+            0,
+        )
+        assert data_size(None) == (0, 0)
+
+    # Runs left active by other tests must not receive the flow metrics
+    @patch("mlflow.active_run", return_value=None)
+    @patch("genre_classifier.instrumentation.create_table_artifact")
+    def test_subflow_metrics_are_summarized_by_parent(
+        self, mock_create_artifact, _active_run
+    ):
+        df = pd.DataFrame({"a": range(10)})
+
+        assert len(parent_flow(df)) == 40
+
+        child_call, parent_call = mock_create_artifact.call_args_list
+        assert child_call.kwargs["key"] == "task-metrics-child-flow"
+        assert [row["task"] for row in child_call.kwargs["table"]] == ["double"]
+        assert parent_call.kwargs["key"] == "task-metrics-parent-flow"
+        rows = parent_call.kwargs["table"]
+        assert [(row["rows_in"], row["rows_out"]) for row in rows] == [
+            (10, 20),
+            (20, 40),
+        ]
+        assert all(row["wall_seconds"] >= 0 for row in rows)
+
+    @patch("mlflow.active_run", return_value=None)
+    def test_async_flow_metrics(self, _active_run):
+        df = pd.DataFrame({"a": range(10)})
+
+        async def create_artifact(**kwargs):
+            calls.append(kwargs)
+
+        calls = []
+        with patch(
+            "genre_classifier.instrumentation.create_table_artifact",
+            side_effect=create_artifact,
+        ):
+            assert len(asyncio.run(async_flow(df))) == 20
+
+        assert [row["task"] for row in calls[0]["table"]] == ["async_double"]
+
+    @patch("mlflow.log_metrics")
+    @patch("mlflow.active_run")
+    @patch("genre_classifier.instrumentation.create_table_artifact")
+    def test_repeated_tasks_are_logged_as_steps(
+        self, _create_artifact, mock_active_run, mock_log_metrics
+    ):
+        mock_active_run.return_value.info.run_id = "run-with-repeated-tasks"
+        df = pd.DataFrame({"a": range(10)})
+
+        assert len(repeating_flow(df)) == 40
+
+        assert [call.kwargs["step"] for call in mock_log_metrics.call_args_list] == [
+            0,
+            1,
+        ]
+        assert [
+            call.args[0]["double.rows_in"] for call in mock_log_metrics.call_args_list
+        ] == [10, 20]
+
+    def test_tasks_outside_flows_are_not_recorded(self):
+        df = pd.DataFrame({"a": range(3)})
+        with patch("genre_classifier.instrumentation._records", {}) as records:
+            assert len(double.fn(df)) == 6
+        assert records == {}
@@ -0,0 +1,131 @@
+import time
+from unittest.mock import MagicMock, patch
+
+from genre_classifier.model_cache import (
+    CachedModelVersion,
+    get_local_artifact,
+    load_model,
+    load_run_artifact_model,
+    resolve_model_version,
+    resolve_pinned_version,
+)
+
+
+def make_version(version: str = "3", checked_at: float | None = None):
+    return CachedModelVersion(
+        name="genre-classifier-random-forest",
+        version=version,
+        source=f"s3://bucket/1/run-{version}/artifacts/model",
+        run_id=f"run-{version}",
+        checked_at=time.time() if checked_at is None else checked_at,
+    )
+
+
+class TestModelCache:
+    @patch("genre_classifier.model_cache.fetch_registered_version")
+    def test_resolve_model_version_uses_pointer_within_ttl(self, mock_fetch, tmp_path):
+        mock_fetch.return_value = make_version()
+
+        first = resolve_model_version(
+            "genre-classifier-random-forest", "dev", cache_dir=tmp_path
+        )
+        second = resolve_model_version(
+            "genre-classifier-random-forest", "dev", cache_dir=tmp_path
+        )
+
+        assert first == second
+        mock_fetch.assert_called_once()
+
+    @patch("genre_classifier.model_cache.fetch_registered_version")
+    def test_resolve_model_version_rechecks_after_ttl(self, mock_fetch, tmp_path):
+        mock_fetch.side_effect = [make_version("3"), make_version("4")]
+
+        resolve_model_version(
+            "genre-classifier-random-forest", "dev", cache_dir=tmp_path
+        )
+        model_version = resolve_model_version(
+            "genre-classifier-random-forest", "dev", cache_dir=tmp_path, ttl_seconds=0
+        )
+
+        assert model_version.version == "4"
+        assert mock_fetch.call_count == 2
+
+    @patch("genre_classifier.model_cache.fetch_model_version")
+    def test_resolve_pinned_version_never_rechecks(self, mock_fetch, tmp_path):
+        mock_fetch.return_value = make_version("5", checked_at=0)
+
+        first = resolve_pinned_version(
+            "genre-classifier-random-forest", "5", cache_dir=tmp_path
+        )
+        second = resolve_pinned_version(
+            "genre-classifier-random-forest", "5", cache_dir=tmp_path
+        )
+
+        assert first == second
+        assert second.version == "5"
+        mock_fetch.assert_called_once()
+
+    @patch("genre_classifier.model_cache.set_aws_credential_env")
+    @patch("mlflow.artifacts.download_artifacts")
+    def test_get_local_artifact_downloads_once(
+        self, mock_download, mock_set_aws_credential_env, tmp_path
+    ):
+        def download(artifact_uri, dst_path, tracking_uri):
+            (tmp_path / dst_path / "model").mkdir()
+
+        mock_download.side_effect = download
+        model_version = make_version()
+
+        first = get_local_artifact(
+            model_version, model_version.source, "model", tmp_path
+        )
+        second = get_local_artifact(
+            model_version, model_version.source, "model", tmp_path
+        )
+
+        assert first == second == tmp_path / model_version.name / "3" / "model"
+        assert (first / "model").is_dir()
+        mock_download.assert_called_once()
+
+    @patch("genre_classifier.model_cache.get_local_artifact")
+    @patch("genre_classifier.model_cache.resolve_model_version")
+    @patch("mlflow.sklearn.load_model")
+    def test_load_model_keeps_loaded_models_in_memory(
+        self, mock_load_model, mock_resolve, mock_get_local_artifact, tmp_path
+    ):
+        mock_resolve.return_value = make_version("7")
+        mock_get_local_artifact.return_value = tmp_path / "7" / "model"
+        mock_load_model.return_value = MagicMock()
+
+        first = load_model("genre-classifier-random-forest", cache_dir=tmp_path)
+        second = load_model("genre-classifier-random-forest", cache_dir=tmp_path)
+
+        assert first is second
+        mock_load_model.assert_called_once_with(str(tmp_path / "7" / "model" / "model"))
+
+    @patch("mlflow.sklearn.load_model")
+    @patch("mlflow.artifacts.download_artifacts")
+    @patch("genre_classifier.model_cache.set_aws_credential_env")
+    @patch("genre_classifier.model_cache.fetch_model_version")
+    def test_load_run_artifact_model_uses_the_versions_run(
+        self, mock_fetch, _, mock_download, mock_load_model, tmp_path
+    ):
+        mock_fetch.return_value = make_version("5")
+
+        load_run_artifact_model(
+            "genre-classifier-random-forest",
+            "5",
+            "multi_label_binarizer",
+            cache_dir=tmp_path,
+        )
+
+        assert mock_download.call_args.args[0] == "runs:/run-5/multi_label_binarizer"
+        mock_load_model.assert_called_once_with(
+            str(
+                tmp_path
+                / "genre-classifier-random-forest"
+                / "5"
+                / "multi_label_binarizer"
+                / "multi_label_binarizer"
+            )
+        )
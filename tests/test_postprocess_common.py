@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import MultiLabelBinarizer
+
+from genre_classifier.postprocess_common import (
+    predictions_to_genres,
+    proba_to_scores,
+    scores_to_columns,
+)
+
+
+class TestPostprocessCommon:
+    def test_predictions_to_genres_matches_inverse_transform(self):
+        mlb = MultiLabelBinarizer(classes=["rock", "pop", "jazz"]).fit([])
+        predictions = np.array([[1, 0, 1], [0, 0, 0], [0, 1, 0], [1, 1, 1]])
+        index = pd.Index(["a", "b", "c", "d"], name="song_id")
+
+        genres = predictions_to_genres(predictions, mlb.classes_, index)
+
+        assert genres.index.equals(index)
+        assert [list(g) for g in genres] == [
+            list(g) for g in mlb.inverse_transform(predictions)
+        ]
+
+    def test_proba_to_scores_matches_predict(self):
+        rng = np.random.default_rng(0)
+        X = rng.random((200, 3))
+        y = (rng.random((200, 4)) < 0.4).astype(int)
+        y[:, 3] = 0
+        rfc = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y)
+
+        predictions, scores = proba_to_scores(rfc.predict_proba(X), rfc.classes_)
+
+        np.testing.assert_array_equal(predictions, rfc.predict(X))
+        assert scores.shape == (200, 4)
+        assert (scores[:, 3] == 0).all()
+
+    def test_scores_to_columns_top_k(self):
+        scores = np.array([[0.1, 0.7, 0.3], [0.9, 0.2, 0.5]], dtype=np.float32)
+        index = pd.Index(["a", "b"], name="song_id")
+
+        columns = scores_to_columns(scores, np.array(["rock", "pop", "jazz"]), index, 2)
+
+        assert [list(g) for g in columns["top_genres"]] == [
+            ["pop", "jazz"],
+            ["rock", "jazz"],
+        ]
+        np.testing.assert_allclose(columns["top_scores"]["b"], [0.9, 0.5])
+
+    def test_scores_to_columns_all_genres(self):
+        scores = np.array([[0.1, 0.7], [0.9, 0.2]], dtype=np.float32)
+        index = pd.Index(["a", "b"], name="song_id")
+
+        columns = scores_to_columns(scores, np.array(["rock", "pop"]), index)
+
+        np.testing.assert_allclose(np.stack(columns["genre_scores"]), scores)
@@ -1,7 +1,13 @@
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 
-from genre_classifier.preprocess_common import fix_outliers
+from genre_classifier.preprocess_common import (
+    BLOCK_ROWS,
+    clean_tempo,
+    fix_outliers,
+    fix_outliers_batch,
+)
 
 
 class TestPreprocessCommon:
@@ -22,3 +28,48 @@ class TestPreprocessCommon:
 
         # Verify the results
         pd.testing.assert_frame_equal(result_df, expected_df)
+
+    def test_fix_outliers_does_not_modify_input(self):
+        df = pd.DataFrame({"year": [0, 2000], "tempo": [60, 400], "key": [1, 2]})
+        original = df.copy()
+
+        result_df = fix_outliers(df)
+
+        pd.testing.assert_frame_equal(df, original)
+        assert result_df["tempo"].isna().tolist() == [False, True]
+        pd.testing.assert_series_equal(result_df["key"], original["key"])
+
+    def test_clean_tempo_across_blocks(self):
+        tempo = np.tile([0.0, 30.0, 50.0, 120.0, 250.0, 400.0, np.nan], BLOCK_ROWS)
+
+        result = clean_tempo(tempo, 70, 180)
+
+        expected = np.tile(
+            [np.nan, np.nan, 100.0, 120.0, 125.0, np.nan, np.nan], BLOCK_ROWS
+        )
+        np.testing.assert_array_equal(result, expected)
+
+    def test_clean_tempo_applies_steps_in_order(self):
+        # Doubled tempos above the valid range are halved again
+        result = clean_tempo(np.array([60.0, 100.0]), 70, 100)
+
+        np.testing.assert_array_equal(result, [60.0, 100.0])
+
+    def test_fix_outliers_batch(self):
+        batch = pa.RecordBatch.from_pydict(
+            {
+                "song_id": ["a", "b", "c"],
+                "year": pa.array([2000, 0, None], pa.int32()),
+                "tempo": [60.0, 400.0, 90.0],
+            }
+        )
+
+        result = fix_outliers_batch(batch)
+
+        assert isinstance(result, pa.RecordBatch)
+        assert result.schema.names == ["song_id", "year", "tempo"]
+        assert result.column("year").to_pylist() == [2000.0, None, None]
+        assert result.column("tempo").to_pylist() == [120.0, None, 90.0]
+        assert fix_outliers_batch(pa.Table.from_batches([batch])).equals(
+            pa.Table.from_batches([result])
+        )
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from genre_classifier import sampling
+from genre_classifier.sampling import (
+    StratifiedReservoir,
+    allocate,
+    resolve_sample_fraction,
+    sample_keys,
+    sample_path,
+    sample_songs,
+    sample_table,
+)
+
+SONG_IDS = [f"TR{i:016d}" for i in range(2000)]
+
+
+class TestSampling:
+    def test_allocate(self):
+        assert allocate({"a": 50, "b": 30, "c": 20}, 9) == {"a": 4, "b": 3, "c": 2}
+        assert allocate({"a": 2, "b": 1}, 10) == {"a": 2, "b": 1}
+
+    def test_stratified_reservoir_is_proportional_and_bounded(self):
+        rng = np.random.default_rng(0)
+        reservoir = StratifiedReservoir(100, ["mode"], seed=1)
+        for _ in range(20):
+            chunk = pd.DataFrame(
+                {"mode": (rng.random(500) < 0.25).astype(int), "x": rng.random(500)}
+            )
+            reservoir.add(chunk)
+            assert sum(len(r) for r in reservoir._reservoirs.values()) <= 200
+
+        sample = reservoir.sample()
+
+        assert reservoir.rows_seen == 10_000
+        assert len(sample) == 100
+        minority_share = reservoir._counts[(1,)] / reservoir.rows_seen
+        assert sample["mode"].sum() == round(100 * minority_share)
+        assert "_sample_key" not in sample.columns
+
+    def test_stratified_reservoir_keeps_small_streams(self):
+        reservoir = StratifiedReservoir(100, ["key", "mode"], seed=0)
+        df = pd.DataFrame({"key": [1, 2, 2, np.nan], "mode": [0, 1, 1, 0]})
+        reservoir.add(df)
+        assert len(reservoir.sample()) == 4
+
+
+class TestSampleFraction:
+    def test_sample_keys_by_song_id(self):
+        keys = [f"data/A/B/C/{song_id}.h5" for song_id in SONG_IDS]
+
+        sampled = sample_keys(keys, 0.1)
+
+        assert 150 < len(sampled) < 250
+        assert sampled == sample_keys(list(reversed(keys)), 0.1)[::-1]
+        assert [key.split("/")[-1][:-3] for key in sampled] == sample_keys(
+            SONG_IDS, 0.1
+        )
+
+    def test_samples_are_nested(self):
+        small = set(sample_keys(SONG_IDS, 0.05))
+        large = set(sample_keys(SONG_IDS, 0.2))
+
+        assert small < large
+
+    def test_sample_songs_and_table_agree(self):
+        df = pd.DataFrame(
+            {"song_id": SONG_IDS, "tempo": np.arange(len(SONG_IDS), dtype=float)}
+        )
+        table = pa.table(
+            {
+                "song_id": pa.array(
+                    [song_id.encode() for song_id in SONG_IDS], pa.binary(18)
+                ),
+                "tempo": df["tempo"],
+            }
+        )
+
+        by_column = sample_songs(df, 0.1)
+        by_index = sample_songs(df.set_index("song_id"), 0.1)
+        by_table = sample_table(table, 0.1)
+
+        assert by_column["song_id"].tolist() == sample_keys(SONG_IDS, 0.1)
+        assert by_index.index.tolist() == sample_keys(SONG_IDS, 0.1)
+        assert by_table.column("tempo").to_pylist() == by_column["tempo"].tolist()
+
+    def test_no_fraction_keeps_all_songs(self):
+        df = pd.DataFrame({"song_id": SONG_IDS[:3]})
+
+        assert sample_songs(df, None) is df
+        assert sample_keys(SONG_IDS, None) == SONG_IDS
+
+    def test_resolve_sample_fraction(self, monkeypatch):
+        monkeypatch.setattr(sampling, "DEFAULT_SAMPLE_FRACTION", None)
+        assert resolve_sample_fraction(None) is None
+        assert resolve_sample_fraction(1.0) is None
+        assert resolve_sample_fraction(0.25) == 0.25
+        with pytest.raises(ValueError):
+            resolve_sample_fraction(0)
+
+        monkeypatch.setattr(sampling, "DEFAULT_SAMPLE_FRACTION", "0.1")
+        assert resolve_sample_fraction(None) == 0.1
+        assert resolve_sample_fraction(0.5) == 0.5
+
+    def test_sample_path(self):
+        assert sample_path("subset/train.parquet", None) == "subset/train.parquet"
+        assert (
+            sample_path("subset/train.parquet", 0.1)
+            == "subset/sample-0.1/train.parquet"
+        )
+        assert sample_path("subset", 0.25) == "subset/sample-0.25"
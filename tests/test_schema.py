@@ -0,0 +1,76 @@
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from genre_classifier.schema import SONG_SCHEMA, conform_table, to_pandas
+
+
+def make_songs() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "song_id": ["TRAAAAW128F429D538", "TRAAABD128F429CF47"],
+            "duration": [218.9, 148.0],
+            "key": [1, None],
+            "mode": [0, 1],
+            "tempo": [92.2, 121.3],
+            "year": [0, 1985],
+            "genres": [["hip hop", "rock"], []],
+            "extra": ["a", "b"],
+        }
+    ).set_index("song_id")
+
+
+def test_conform_table():
+    table = conform_table(pa.Table.from_pandas(make_songs()))
+
+    for name in ["song_id", "duration", "key", "mode", "tempo", "year", "genres"]:
+        assert table.schema.field(name).type == SONG_SCHEMA.field(name).type
+    assert table.schema.field("extra").type == pa.string()
+    assert table.column("key").null_count == 1
+
+
+def test_conform_table_rejects_invalid_song_ids():
+    table = pa.table({"song_id": ["TRSHORT"]})
+
+    with pytest.raises(pa.ArrowInvalid):
+        conform_table(table)
+
+
+def test_parquet_round_trip():
+    df = make_songs()
+    buffer = io.BytesIO()
+    pq.write_table(conform_table(pa.Table.from_pandas(df)), buffer)
+    buffer.seek(0)
+
+    result = to_pandas(pq.read_table(buffer))
+
+    assert result.index.tolist() == df.index.tolist()
+    assert result.index.name == "song_id"
+    assert result["duration"].dtype == "float32"
+    assert result["mode"].dtype == "int8"
+    assert result["year"].dtype == "int16"
+    assert [list(genres) for genres in result["genres"]] == [["hip hop", "rock"], []]
+
+
+def test_to_pandas_record_batch():
+    table = conform_table(pa.Table.from_pandas(make_songs()))
+
+    result = to_pandas(table.to_batches()[0])
+
+    assert result.index.tolist() == ["TRAAAAW128F429D538", "TRAAABD128F429CF47"]
+
+
+def test_to_pandas_chunked_song_ids():
+    table = conform_table(pa.Table.from_pandas(make_songs()))
+    chunked = pa.concat_tables([table, table.slice(1)])
+
+    result = to_pandas(chunked)
+
+    assert result.index.tolist() == [
+        "TRAAAAW128F429D538",
+        "TRAAABD128F429CF47",
+        "TRAAABD128F429CF47",
+    ]
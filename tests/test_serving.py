@@ -0,0 +1,120 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib import request
+
+import pandas as pd
+
+from genre_classifier.serving import (
+    FEATURE_COLS,
+    InferenceServer,
+    LatencyRecorder,
+    MicroBatcher,
+    make_handler,
+)
+
+
+def predict_row_sums(df: pd.DataFrame) -> list[list[str]]:
+    return [[str(int(total))] for total in df[FEATURE_COLS].sum(axis=1)]
+
+
+def make_songs(n: int, offset: int = 0) -> pd.DataFrame:
+    return pd.DataFrame(
+        [{col: float(offset + i) for col in FEATURE_COLS} for i in range(n)]
+    )
+
+
+class TestMicroBatcher:
+    def test_coalesces_concurrent_requests(self):
+        batch_sizes = []
+
+        def predict_fn(df):
+            batch_sizes.append(len(df))
+            return predict_row_sums(df)
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=64, max_wait_ms=50)
+        with ThreadPoolExecutor(16) as executor:
+            results = list(
+                executor.map(lambda i: batcher.predict(make_songs(1, i)), range(16))
+            )
+        batcher.close()
+
+        assert results == [[[str(6 * i)]] for i in range(16)]
+        assert sum(batch_sizes) == 16
+        assert len(batch_sizes) < 16
+
+    def test_respects_max_batch_size(self):
+        batch_sizes = []
+
+        def predict_fn(df):
+            batch_sizes.append(len(df))
+            return predict_row_sums(df)
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=2, max_wait_ms=50)
+        futures = [batcher.submit(make_songs(1, i)) for i in range(6)]
+        results = [future.result() for future in futures]
+        batcher.close()
+
+        assert results == [[[str(6 * i)]] for i in range(6)]
+        assert max(batch_sizes) <= 2
+
+    def test_propagates_prediction_errors(self):
+        def predict_fn(df):
+            raise RuntimeError("boom")
+
+        batcher = MicroBatcher(predict_fn)
+        future = batcher.submit(make_songs(1))
+        assert isinstance(future.exception(), RuntimeError)
+        batcher.close()
+
+
+class TestInferenceServer:
+    def test_predict_and_metrics_endpoints(self):
+        batcher = MicroBatcher(predict_row_sums, recorder=LatencyRecorder())
+        server = InferenceServer(("127.0.0.1", 0), make_handler(batcher))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+
+        songs = [{"song_id": "TR1", **{col: 1.0 for col in FEATURE_COLS}}]
+        req = request.Request(
+            f"{url}/predict", data=json.dumps({"songs": songs}).encode()
+        )
+        with request.urlopen(req) as response:
+            body = json.loads(response.read())
+        with request.urlopen(f"{url}/metrics") as response:
+            metrics = json.loads(response.read())
+
+        server.shutdown()
+        server.server_close()
+        batcher.close()
+
+        assert body == {"predictions": [{"song_id": "TR1", "genres": ["6"]}]}
+        assert metrics["requests"] == 1
+        assert metrics["rows"] == 1
+        assert metrics["latency_p50_ms"] is not None
+
+    def test_predict_without_songs(self):
+        batches = []
+
+        def predict_fn(df):
+            batches.append(df)
+            return predict_row_sums(df)
+
+        batcher = MicroBatcher(predict_fn)
+        server = InferenceServer(("127.0.0.1", 0), make_handler(batcher))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        req = request.Request(
+            f"http://127.0.0.1:{server.server_port}/predict",
+            data=json.dumps({"songs": []}).encode(),
+        )
+        with request.urlopen(req) as response:
+            status, body = response.status, json.loads(response.read())
+
+        server.shutdown()
+        server.server_close()
+        batcher.close()
+
+        assert status == 200
+        assert body == {"predictions": []}
+        assert batches == []
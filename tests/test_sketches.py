@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from genre_classifier.sketches import (
+    GenreCounts,
+    NumericalSketch,
+    PartitionSketch,
+    compute_sketch,
+    count_categories,
+    count_genres,
+    merge_sketches,
+    window_dates,
+)
+
+
+def make_features(n: int, seed: int = 0, tempo_shift: float = 0.0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "duration": rng.uniform(100, 400, n),
+            "loudness": rng.uniform(-30, 0, n),
+            "tempo": rng.normal(120 + tempo_shift, 20, n),
+            "year": np.where(rng.random(n) < 0.3, 0, rng.integers(1960, 2011, n)),
+            "mode": rng.integers(0, 2, n),
+            "key": rng.integers(0, 12, n),
+        }
+    )
+
+
+class TestSketches:
+    def test_merged_sketches_equal_sketch_of_all_data(self):
+        df = make_features(1000)
+        merged = merge_sketches(
+            [compute_sketch(df.iloc[:300]), compute_sketch(df.iloc[300:])]
+        )
+        assert merged == compute_sketch(df)
+        assert merged.count == 1000
+
+    def test_sketch_round_trips_through_json(self):
+        sketch = compute_sketch(make_features(100))
+        assert PartitionSketch.model_validate_json(sketch.model_dump_json()) == sketch
+
+    def test_quantiles_within_relative_accuracy(self):
+        values = np.random.default_rng(0).uniform(-30, 400, 10_000)
+        values[:10] = np.nan
+        sketch = NumericalSketch.from_values(values, relative_accuracy=0.01)
+
+        assert sketch.missing == 10
+        assert sketch.count == 9990
+        for q in [0.1, 0.5, 0.9]:
+            expected = np.nanquantile(values, q)
+            assert abs(sketch.quantile(q) - expected) <= 0.01 * abs(expected) + 0.5
+
+    def test_count_categories(self):
+        counts = count_categories(pd.Series([1.0, 2.0, np.nan, 1.0]))
+        assert counts == {"1": 2, "2": 1, "missing": 1}
+
+    def test_window_dates(self):
+        dates = ["2024-01-01", "2024-01-05", "2024-01-06", "2024-01-08"]
+        assert window_dates(dates, 4) == ["2024-01-05", "2024-01-06", "2024-01-08"]
+        assert window_dates([], 4) == []
+
+    def test_count_genres(self):
+        genres = pd.Series([np.array(["rock", "pop"]), np.array([]), ["rock"]])
+        counts = count_genres(genres)
+        assert counts == GenreCounts(rows=3, counts={"rock": 2, "pop": 1})
+        assert counts.merge(counts).counts == {"rock": 4, "pop": 2}
@@ -1,12 +1,20 @@
+import io
+import json
 import os
 from unittest.mock import MagicMock, patch
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
+from genre_classifier.flows.compact_predictions.flow import build_index
 from genre_classifier.utils import (
     download_file_from_s3,
+    find_row_groups,
     get_file_uri,
+    lookup_predictions,
     read_parquet_data,
+    read_parquet_partitions,
     set_aws_credential_env,
     upload_dir_to_s3,
     upload_file_to_s3,
@@ -77,13 +85,13 @@ class TestUtils:
         )
 
     @patch("genre_classifier.utils.S3Bucket.load")
-    @patch("pandas.read_parquet")
+    @patch("pyarrow.parquet.read_table")
     @patch("tempfile.NamedTemporaryFile")
     def test_read_parquet_data(self, mock_tempfile, mock_read_parquet, mock_load):
         mock_bucket = MagicMock()
         mock_load.return_value = mock_bucket
         mock_tempfile.return_value.__enter__.return_value.name = "tempfile"
-        mock_read_parquet.return_value = pd.DataFrame({"col1": [1, 2], "col2": [3, 4]})
+        mock_read_parquet.return_value = pa.table({"col1": [1, 2], "col2": [3, 4]})
 
         df = read_parquet_data("data/file.parquet", "million-songs-dataset-s3")
         mock_bucket.download_object_to_path.assert_called_once_with(
@@ -106,3 +114,146 @@ class TestUtils:
         mock_bucket.upload_from_path.assert_called_once_with(
             "tempfile", "target/file.parquet"
         )
+
+    def test_find_row_groups(self):
+        index = {"row_group_min": ["a", "d", "g"], "row_group_max": ["c", "f", "i"]}
+        assert find_row_groups(index, ["e", "b", "e"]) == [0, 1]
+        assert find_row_groups(index, ["0", "cc", "z"]) == []
+
+    @patch("genre_classifier.utils.S3Bucket.load")
+    def test_lookup_predictions_reads_only_matching_row_group(self, mock_load):
+        df = pd.DataFrame(
+            {"genres": [[f"genre-{i}"] for i in range(100)], "date": "2024-01-01"},
+            index=pd.Index([f"song-{i:03d}" for i in range(100)], name="song_id"),
+        )
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pandas(df), buffer, row_group_size=10)
+        content = buffer.getvalue()
+        index = build_index(
+            pq.ParquetFile(io.BytesIO(content)).metadata,
+            "predictions.parquet",
+            len(content),
+        )
+
+        ranges = []
+
+        def get_object(Bucket, Key, Range):
+            start, end = map(int, Range.removeprefix("bytes=").split("-"))
+            ranges.append((start, end))
+            return {"Body": io.BytesIO(content[start : end + 1])}
+
+        mock_bucket = MagicMock()
+        mock_bucket.bucket_name = "test-bucket"
+        mock_bucket.bucket_folder = ""
+        metadata = io.BytesIO()
+        pq.ParquetFile(io.BytesIO(content)).metadata.write_metadata_file(metadata)
+        sidecars = {
+            "subset/predictions_compacted/predictions_index.json": json.dumps(
+                index
+            ).encode(),
+            "subset/predictions_compacted/_metadata": metadata.getvalue(),
+        }
+        mock_bucket.read_path.side_effect = sidecars.__getitem__
+        mock_bucket.credentials.get_s3_client.return_value.get_object.side_effect = (
+            get_object
+        )
+        mock_load.return_value = mock_bucket
+
+        result = lookup_predictions(["song-042", "song-043", "missing"])
+
+        assert result.index.tolist() == ["song-042", "song-043"]
+        assert [list(genres) for genres in result["genres"]] == [
+            ["genre-42"],
+            ["genre-43"],
+        ]
+        # Only the bytes of the row group holding songs 40-49 are read
+        assert sum(end - start + 1 for start, end in ranges) < len(content) / 5
+
+    @patch("genre_classifier.utils.S3Bucket.load")
+    def test_lookup_predictions_prefers_newer_files(self, mock_load):
+        objects = {}
+        files = []
+        for name, songs, genre in [
+            ("predictions-2024-01-01.parquet", ["song-1", "song-2"], "rock"),
+            ("predictions-2024-01-02.parquet", ["song-2", "song-3"], "pop"),
+            ("predictions-2024-01-03.parquet", ["song-7"], "jazz"),
+        ]:
+            df = pd.DataFrame(
+                {"genres": [[genre]] * len(songs)},
+                index=pd.Index(songs, name="song_id"),
+            )
+            buffer = io.BytesIO()
+            pq.write_table(pa.Table.from_pandas(df), buffer)
+            content = buffer.getvalue()
+            metadata = pq.ParquetFile(io.BytesIO(content)).metadata
+            file_index = build_index(metadata, name, len(content))
+            file_index["metadata_file"] = f"{name}._metadata"
+            files.append(file_index)
+            footer = io.BytesIO()
+            metadata.write_metadata_file(footer)
+            objects[f"subset/predictions_compacted/{name}"] = content
+            objects[f"subset/predictions_compacted/{name}._metadata"] = (
+                footer.getvalue()
+            )
+        objects["subset/predictions_compacted/predictions_index.json"] = json.dumps(
+            {"files": files}
+        ).encode()
+        read = []
+
+        def read_path(path):
+            read.append(path)
+            return objects[path]
+
+        def get_object(Bucket, Key, Range):
+            start, end = map(int, Range.removeprefix("bytes=").split("-"))
+            return {"Body": io.BytesIO(objects[Key][start : end + 1])}
+
+        mock_bucket = MagicMock()
+        mock_bucket.bucket_name = "test-bucket"
+        mock_bucket.bucket_folder = ""
+        mock_bucket.read_path.side_effect = read_path
+        mock_bucket.credentials.get_s3_client.return_value.get_object.side_effect = (
+            get_object
+        )
+        mock_load.return_value = mock_bucket
+
+        result = lookup_predictions(["song-2", "song-1"])
+
+        assert result.index.tolist() == ["song-1", "song-2"]
+        assert [list(genres) for genres in result["genres"]] == [["rock"], ["pop"]]
+        # The file holding only song-7 is skipped without reading its footer
+        assert (
+            "subset/predictions_compacted/predictions-2024-01-03.parquet._metadata"
+            not in read
+        )
+        assert lookup_predictions(["missing"]).empty
+
+    @patch("genre_classifier.utils.S3Bucket.load")
+    def test_read_parquet_partitions(self, mock_load):
+        objects = {}
+        for i, date in enumerate(["2024-01-01", "2024-01-02", "2024-01-03"]):
+            buffer = io.BytesIO()
+            pq.write_table(pa.table({"value": [i] * (i + 1)}), buffer)
+            objects[f"subset/daily/{date}/releases.parquet"] = buffer.getvalue()
+
+        mock_bucket = MagicMock()
+        mock_bucket.bucket_name = "test-bucket"
+        mock_bucket.bucket_folder = ""
+        mock_bucket.credentials.get_s3_client.return_value.get_object.side_effect = (
+            lambda Bucket, Key: {"Body": io.BytesIO(objects[Key])}
+        )
+        mock_load.return_value = mock_bucket
+
+        table = read_parquet_partitions(
+            list(objects),
+            ["2024-01-01", "2024-01-02", "2024-01-03"],
+            bucket_block_name="other-bucket",
+            max_workers=2,
+        )
+
+        mock_load.assert_called_once_with("other-bucket")
+        df = table.to_pandas()
+        assert df["value"].tolist() == [0, 1, 1, 2, 2, 2]
+        assert df["date"].astype(str).tolist() == (
+            ["2024-01-01"] + ["2024-01-02"] * 2 + ["2024-01-03"] * 3
+        )
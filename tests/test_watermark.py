@@ -0,0 +1,95 @@
+from unittest.mock import MagicMock, patch
+
+from genre_classifier.watermark import (
+    PredictionWatermark,
+    list_partition_dates,
+    lookback_start,
+)
+
+
+class TestPredictionWatermark:
+    def test_pending_dates_skips_scored_dates(self):
+        watermark = PredictionWatermark(
+            last_scored_date="2024-01-02", completed=["2024-01-04"]
+        )
+        release_dates = ["2024-01-01", "2024-01-03", "2024-01-04", "2024-01-05"]
+        assert watermark.pending_dates(release_dates) == ["2024-01-03", "2024-01-05"]
+
+    def test_late_dates_are_unscored_dates_up_to_watermark(self):
+        watermark = PredictionWatermark(last_scored_date="2024-01-03")
+        release_dates = ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"]
+
+        late_dates = watermark.late_dates(release_dates, ["2024-01-01", "2024-01-03"])
+
+        assert late_dates == ["2024-01-02"]
+        assert PredictionWatermark().late_dates(release_dates, []) == []
+
+    def test_lookback_start(self):
+        assert lookback_start("2024-03-01", 7) == "2024-02-23"
+        assert lookback_start(None, 7) is None
+
+    def test_advance_moves_past_contiguous_dates(self):
+        watermark = PredictionWatermark(
+            last_scored_date="2024-01-01", completed=["2024-01-03"]
+        )
+        release_dates = ["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"]
+
+        watermark = watermark.advance(["2024-01-02", "2024-01-05"], release_dates)
+
+        assert watermark.last_scored_date == "2024-01-03"
+        assert watermark.completed == ["2024-01-05"]
+
+    def test_advance_keeps_gap_pending(self):
+        watermark = PredictionWatermark().advance(
+            ["2024-01-02"], ["2024-01-01", "2024-01-02"]
+        )
+        assert watermark.last_scored_date is None
+        assert watermark.pending_dates(["2024-01-01", "2024-01-02"]) == ["2024-01-01"]
+
+    def test_merge_never_moves_backwards(self):
+        release_dates = ["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"]
+        ahead = PredictionWatermark(
+            last_scored_date="2024-01-03", completed=["2024-01-05"]
+        )
+        behind = PredictionWatermark(
+            last_scored_date="2024-01-01", completed=["2024-01-04"]
+        )
+
+        for merged in (
+            ahead.merge(behind, release_dates),
+            behind.merge(ahead, release_dates),
+        ):
+            assert merged.last_scored_date == "2024-01-05"
+            assert merged.completed == []
+
+
+class TestListPartitionDates:
+    @patch("genre_classifier.watermark.S3Bucket.load")
+    def test_list_partition_dates_starts_after_date(self, mock_load):
+        mock_bucket = MagicMock()
+        mock_bucket.bucket_name = "test-bucket"
+        mock_bucket.bucket_folder = ""
+        mock_paginator = MagicMock()
+        mock_paginator.paginate.return_value = [
+            {
+                "Contents": [
+                    {"Key": "subset/daily/2024-01-03/releases.parquet"},
+                    {"Key": "subset/daily/2024-01-03/sketch.json"},
+                ]
+            },
+            {"Contents": [{"Key": "subset/daily/2024-01-02/releases.parquet"}]},
+        ]
+        client = mock_bucket.credentials.get_s3_client.return_value
+        client.get_paginator.return_value = mock_paginator
+        mock_load.return_value = mock_bucket
+
+        dates = list_partition_dates(
+            "subset/daily", "releases.parquet", "bucket", "2024-01-01"
+        )
+
+        assert dates == ["2024-01-02", "2024-01-03"]
+        mock_paginator.paginate.assert_called_once_with(
+            Bucket="test-bucket",
+            Prefix="subset/daily/",
+            StartAfter="subset/daily/2024-01-01/~",
+        )